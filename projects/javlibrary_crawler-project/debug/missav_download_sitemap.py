@@ -29,13 +29,14 @@ config: Config
 # sitemap_snapshot = missav.SiteMapSnapshot.new(md5)
 # # 如果你手动解压了 xml.gz 文件, 会产生一些未压缩的临时文件, 这个方法可以自动清除掉这些临时文件以节约磁盘空间
 # sitemap_snapshot.remove_uncompressed()
-# p = sitemap_snapshot.get_item_xml(58)
-# item_url_list = missav.parse_item_xml(p)
-# filtered_item_url_list = missav.ItemUrl.filter_by_lang(
-#     item_url_list, missav.LangCodeEnum.zh
-# )
-# for item in filtered_item_url_list[:10]:
-#     print(item)
+# # 第一次使用时会解析所有的 xml 文件生成 URL 索引, 之后直接读取索引
+# with missav.open_url_index(sitemap_snapshot) as url_index:
+#     for i, item in enumerate(
+#         url_index.iter_item_urls([missav.LangCodeEnum.zh], file_ith=58)
+#     ):
+#         if i >= 10:
+#             break
+#         print(item)
 
 
 # ------------------------------------------------------------------------------
@@ -52,6 +53,17 @@ config: Config
 #         # _first_k_url=50,
 #     )
 
+# ------------------------------------------------------------------------------
+# 一次性为多个语言创建 DynamoDB import 所需的 data 文件, 每个 xml 文件只解析一次.
+# 之后对每个语言调用 import_dynamodb_data(..., create_data_files=False) 即可.
+# ------------------------------------------------------------------------------
+# if __name__ == "__main__": # 这个函数用到了多线程, 所以必须在 __main__ 里跑
+#     snapshot_id = "4328d4511415a77eea41c3b091eb0e2a"
+#     missav.create_dynamodb_import_data_files_multi_lang(
+#         snapshot_id=snapshot_id,
+#         lang_code_list=[missav.LangCodeEnum.cn, missav.LangCodeEnum.ja],
+#     )
+
 # ------------------------------------------------------------------------------
 # 把下载好的 sitemap_items_*.xml.gz 文件中的数据作为 pending task list 写入 DynamoDB 中.
 # 这里用到了 import Dynamodb data from S3.
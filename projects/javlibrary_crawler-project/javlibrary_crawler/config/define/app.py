@@ -48,6 +48,22 @@ class AppMixin:
     def s3dir_missav_dynamodb_exports(self: "Env") -> S3Path:
         return self.s3dir_missav.joinpath("dynamodb_exports").to_dir()
 
+    @property
+    def s3dir_missav_crawler_stats(self: "Env") -> S3Path:
+        return self.s3dir_missav.joinpath("crawler_stats").to_dir()
+
+    @property
+    def s3dir_missav_crawler_reports(self: "Env") -> S3Path:
+        return self.s3dir_missav.joinpath("crawler_reports").to_dir()
+
+    @property
+    def s3dir_missav_zstd_dictionaries(self: "Env") -> S3Path:
+        return self.s3dir_missav.joinpath("zstd_dictionaries").to_dir()
+
+    @property
+    def s3dir_missav_segments(self: "Env") -> S3Path:
+        return self.s3dir_missav.joinpath("segments").to_dir()
+
     @property
     def s3path_missav_crawler_sqlite(self: "Env") -> S3Path:
         return self.s3dir_missav.joinpath("missav_crawler.sqlite")
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from .sitemap import SiteMapSnapshot
+from .sitemap import SitemapEntry
 from .sitemap import ActressUrl
 from .sitemap import ItemUrl
 from .sitemap import parse_actresses_xml
 from .sitemap import parse_item_xml
+from .sitemap import IncompleteXmlError
+from .sitemap import download_sitemap_file
+from .url_index import UrlIndex
+from .url_index import open_url_index
 from .paths import dir_missav_sitemap
 from .paths import path_missav_crawler_db
 from .constants import LangCodeEnum
@@ -21,11 +26,49 @@ from .dynamodb import lang_to_task_mapping
 from .dynamodb import lang_to_step1_mapping
 from .downloader import HttpError
 from .downloader import MalformedHtmlError
+from .downloader import HttpClient
+from .downloader import http_client
+from .rate_limiter import AdaptiveRateLimiter
+from .circuit_breaker import CircuitOpenError
+from .circuit_breaker import CircuitBreaker
+from .latency import LatencyStats
+from .retry import RetryGiveUpError
+from .retry import RetryBudget
+from .retry import RetryPolicy
+from .scheduler import interleave_by_weight
+from .codec import HtmlCodec
+from .codec import ZstdDictionaryStore
+from .codec import train_zstd_dictionary
+from .segment import SegmentPointer
+from .segment import SegmentWriter
+from .segment import read_blob
+from .segment import read_segment
+from .lease import Claim
+from .lease import claim_tasks
+from .lease import commit_tasks
+from .lease import TaskLeaser
+from .lease import CompletionBatcher
+from .drain import GracefulDrain
+from .deadline import StartTimeProvider
+from .deadline import EnvStartTimeProvider
+from .deadline import ProcessStartTimeProvider
+from .deadline import ClockStartTimeProvider
+from .deadline import GitHubRunStartTimeProvider
+from .deadline import ChainedStartTimeProvider
+from .deadline import make_default_start_time_provider
 from .downloader import get_video_detail_html
+from .downloader import get_video_detail_html_bytes
+from .downloader import HtmlValidators
+from .downloader import FetchResult
+from .downloader import fetch_video_detail_html
 from .crawler import create_dynamodb_import_data_files
+from .crawler import create_dynamodb_import_data_files_multi_lang
 from .crawler import import_dynamodb_data
 from .crawler import insert_pending_tasks
+from .crawler import train_html_dictionary
 from .crawler import crawl_pending_tasks
+from .crawler import crawl_pending_tasks_multi_lang
+from .crawler import refresh_succeeded_tasks
 from .crawler import export_dynamodb
 from .crawler import dynamodb_to_sqlite
 from .crawler import extract_video_details
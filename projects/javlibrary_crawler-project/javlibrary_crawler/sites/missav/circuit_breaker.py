@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""
+整个网站级别的熔断器.
+
+当 missav.com 挂了或者把我们屏蔽了的时候, 每个任务都会失败, 但是每个任务仍然要走一遍
+完整的重试流程和 DynamoDB 加锁解锁, 白白浪费 GitHub Action 的运行时间和 DynamoDB 的写入.
+
+:class:`CircuitBreaker` 有三个状态:
+
+- closed: 正常状态, 所有请求都可以发出. 连续失败 ``failure_threshold`` 次后变为 open.
+- open: 熔断状态, 所有请求都会阻塞等待. ``reset_timeout`` 秒后变为 half_open.
+- half_open: 只放行一个探测请求, 其他请求继续等待. 探测成功则回到 closed, 所有等待的
+  请求继续执行; 探测失败则彻底熔断 (``is_broken``), 所有请求都会抛出
+  :class:`CircuitOpenError`, 爬虫应该提前结束这次运行.
+
+熔断器通常挂在进程内共享的 :class:`~.downloader.HttpClient` 上, 所以每次运行开始时
+要调用 :meth:`CircuitBreaker.reset`, 上一次运行的熔断不应该影响这一次.
+"""
+
+import typing as T
+import time
+import threading
+import dataclasses
+
+from ...logger import logger
+
+
+class CircuitOpenError(Exception):
+    """
+    熔断器彻底熔断后, 再发起请求时会抛出这个异常.
+    """
+
+    pass
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclasses.dataclass
+class CircuitBreaker:
+    """
+    线程安全的熔断器, 通常由所有请求同一个网站的线程共享.
+
+    :param failure_threshold: 连续失败多少次后熔断.
+    :param reset_timeout: 熔断后等待多少秒再发出探测请求.
+    :param clock: 返回当前时间 (秒) 的函数, 用于测试.
+    """
+
+    failure_threshold: int = dataclasses.field(default=10)
+    reset_timeout: float = dataclasses.field(default=30)
+    clock: T.Callable[[], float] = dataclasses.field(default=time.monotonic, repr=False)
+
+    state: str = dataclasses.field(default=CLOSED, init=False)
+    is_broken: bool = dataclasses.field(default=False, init=False)
+    n_consecutive_failure: int = dataclasses.field(default=0, init=False)
+    n_trip: int = dataclasses.field(default=0, init=False)
+    trip_reason: T.Optional[str] = dataclasses.field(default=None, init=False)
+    _opened_at: float = dataclasses.field(default=0.0, init=False, repr=False)
+    _cond: threading.Condition = dataclasses.field(
+        default_factory=threading.Condition, init=False, repr=False
+    )
+
+    def raise_if_broken(self):
+        """
+        如果已经彻底熔断, 抛出 :class:`CircuitOpenError`. 不会阻塞.
+        """
+        if self.is_broken:
+            raise CircuitOpenError(f"circuit breaker is open: {self.trip_reason}")
+
+    def before_request(self):
+        """
+        在发起请求之前调用. closed 状态下直接返回; open 状态下阻塞直到可以探测;
+        half_open 状态下, 第一个调用者成为探测请求, 其他调用者阻塞直到探测结束.
+
+        :raises CircuitOpenError: 已经彻底熔断.
+        """
+        with self._cond:
+            while True:
+                self.raise_if_broken()
+                if self.state == CLOSED:
+                    return
+                if self.state == OPEN:
+                    remaining = self._opened_at + self.reset_timeout - self.clock()
+                    if remaining <= 0:
+                        logger.info(
+                            "circuit breaker is half open, send a probe request"
+                        )
+                        self.state = HALF_OPEN
+                        return
+                    self._cond.wait(timeout=remaining)
+                else:  # HALF_OPEN, wait for the result of the probe request
+                    self._cond.wait()
+
+    def on_success(self):
+        """
+        报告一次成功的请求.
+        """
+        with self._cond:
+            self.n_consecutive_failure = 0
+            if self.state == HALF_OPEN:
+                logger.info("probe request succeeded, circuit breaker is closed")
+                self.state = CLOSED
+                self._cond.notify_all()
+
+    def on_failure(self, reason: str):
+        """
+        报告一次失败的请求.
+
+        :param reason: 失败的原因, 熔断时会记录在 ``trip_reason`` 中.
+        """
+        with self._cond:
+            self.n_consecutive_failure += 1
+            if self.state == HALF_OPEN:
+                self.is_broken = True
+                self.trip_reason = f"probe request failed: {reason}"
+                logger.error(f"circuit breaker is broken, {self.trip_reason}")
+                self._cond.notify_all()
+            elif (
+                self.state == CLOSED
+                and self.n_consecutive_failure >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.n_trip += 1
+                self._opened_at = self.clock()
+                self.trip_reason = (
+                    f"{self.n_consecutive_failure} consecutive failures, "
+                    f"last error: {reason}"
+                )
+                logger.error(
+                    f"circuit breaker is open, {self.trip_reason}, "
+                    f"probe in {self.reset_timeout} seconds"
+                )
+
+    def reset(self):
+        """
+        回到初始的 closed 状态, 并清空所有的计数.
+        """
+        with self._cond:
+            self.state = CLOSED
+            self.is_broken = False
+            self.n_consecutive_failure = 0
+            self.n_trip = 0
+            self.trip_reason = None
+            self._cond.notify_all()
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "state": self.state,
+            "is_broken": self.is_broken,
+            "n_trip": self.n_trip,
+            "trip_reason": self.trip_reason,
+        }
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+存储在 S3 中的 HTML 的压缩格式.
+
+以前每个页面都是单独用 gzip 压缩的. missav.com 的页面都是用同一个模板生成的, 大部分内容
+(CSS, script, 导航栏等) 在每个页面中都是重复的, 但是 gzip 只能利用单个页面内部的重复.
+zstd 可以使用一个从大量页面样本中训练出来的字典, 把这些公共的部分放到字典中, 压缩后的
+数据只需要保存每个页面和字典不同的部分. 这样压缩后的体积更小, 压缩和解压也比 gzip 快.
+
+- :class:`HtmlCodec`: 压缩时使用 gzip 或者 zstd (可以带字典). 解压时根据数据开头的
+  magic number 自动识别格式, 所以以前用 gzip 压缩的数据仍然可以读取.
+- :class:`ZstdDictionaryStore`: 字典按照 dict_id 保存在 S3 中, dict_id 就是字典的版本号.
+  zstd 会把 dict_id 写入压缩后的数据中, 解压时根据 dict_id 读取对应的字典,
+  所以换了新的字典之后, 用旧字典压缩的数据仍然可以解压.
+
+``zstandard`` 是可选依赖 (``zstd`` extra), 只有在使用 zstd 的时候才需要安装.
+测试依赖中包含了它.
+"""
+
+import typing as T
+import gzip
+import threading
+import dataclasses
+
+from s3pathlib import S3Path, ContentTypeEnum
+from boto_session_manager import BotoSesManager
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+CONTENT_TYPE_ZSTD = "application/zstd"
+
+
+def _require_zstandard():
+    if zstandard is None:  # pragma: no cover
+        raise ImportError(
+            "zstd compression requires the 'zstandard' package, "
+            "install it with 'pip install javlibrary_crawler[zstd]'"
+        )
+
+
+def detect_compression(data: bytes) -> str:
+    """
+    根据 magic number 判断数据是用 gzip 还是 zstd 压缩的.
+    """
+    if data.startswith(GZIP_MAGIC):
+        return GZIP
+    if data.startswith(ZSTD_MAGIC):
+        return ZSTD
+    raise ValueError(f"unknown compression format, magic number = {data[:4]!r}")
+
+
+def get_zstd_dict_id(data: bytes) -> int:
+    """
+    返回 zstd 压缩的数据所使用的字典的 dict_id, 没有使用字典则返回 0.
+    """
+    _require_zstandard()
+    return zstandard.get_frame_parameters(data).dict_id
+
+
+def train_zstd_dictionary(
+    samples: T.Iterable[bytes],
+    dict_id: int,
+    dict_size: int = 112640,
+    level: int = 3,
+) -> bytes:
+    """
+    用一批 HTML 样本训练 zstd 字典.
+
+    :param samples: 未压缩的 HTML 样本, 通常需要几百个.
+    :param dict_id: 字典的版本号, 必须是正整数. zstd 建议使用 32768 到 2**31 - 1 之间的值.
+    :param dict_size: 字典的最大字节数.
+    :param level: 训练时针对的压缩级别, 应该和压缩时用的级别一致.
+
+    :return: 字典的内容.
+    """
+    _require_zstandard()
+    if dict_id <= 0:
+        raise ValueError(f"dict_id has to be positive, got {dict_id}")
+    zdict = zstandard.train_dictionary(
+        dict_size,
+        list(samples),
+        dict_id=dict_id,
+        level=level,
+    )
+    return zdict.as_bytes()
+
+
+@dataclasses.dataclass
+class ZstdDictionaryStore:
+    """
+    保存在 S3 中的 zstd 字典, 每个字典一个文件, 文件名是 ``${dict_id}.zdict``.
+    读取过的字典会缓存在内存中. 这个对象是线程安全的.
+    """
+
+    s3dir: S3Path = dataclasses.field()
+    bsm: BotoSesManager = dataclasses.field(repr=False)
+
+    _cache: T.Dict[int, bytes] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def get_s3path(self, dict_id: int) -> S3Path:
+        return self.s3dir.joinpath(f"{dict_id}.zdict")
+
+    def put(self, dict_id: int, dictionary: bytes) -> S3Path:
+        s3path = self.get_s3path(dict_id)
+        s3path.write_bytes(dictionary, bsm=self.bsm)
+        with self._lock:
+            self._cache[dict_id] = dictionary
+        return s3path
+
+    def get(self, dict_id: int) -> bytes:
+        with self._lock:
+            if dict_id in self._cache:
+                return self._cache[dict_id]
+        dictionary = self.get_s3path(dict_id).read_bytes(bsm=self.bsm)
+        with self._lock:
+            self._cache[dict_id] = dictionary
+        return dictionary
+
+    def get_latest_dict_id(self) -> T.Optional[int]:
+        """
+        返回最新 (最大) 的 dict_id, 如果还没有字典, 返回 None.
+        """
+        dict_id_list = [
+            int(s3path.fname)
+            for s3path in self.s3dir.iter_objects(bsm=self.bsm)
+            if s3path.ext == ".zdict" and s3path.fname.isdigit()
+        ]
+        return max(dict_id_list) if dict_id_list else None
+
+
+@dataclasses.dataclass
+class HtmlCodec:
+    """
+    HTML 的压缩和解压. 这个对象是线程安全的.
+
+    :param compression: 压缩时用的格式, ``"gzip"`` 或者 ``"zstd"``. 解压时会自动识别格式,
+        和这个参数无关.
+    :param level: 压缩级别, 默认 gzip 为 9, zstd 为 3.
+    :param dict_id: zstd 压缩时使用的字典, None 表示不使用字典.
+    :param dictionary_loader: 根据 dict_id 返回字典内容的函数, 例如
+        :meth:`ZstdDictionaryStore.get`. 压缩时用 ``dict_id`` 读取字典, 解压时用
+        数据中记录的 dict_id 读取字典.
+    """
+
+    compression: str = dataclasses.field(default=GZIP)
+    level: T.Optional[int] = dataclasses.field(default=None)
+    dict_id: T.Optional[int] = dataclasses.field(default=None)
+    dictionary_loader: T.Optional[T.Callable[[int], bytes]] = dataclasses.field(
+        default=None, repr=False
+    )
+
+    # zstd 的 compressor 和 decompressor 不能在多个线程之间共享
+    _local: threading.local = dataclasses.field(
+        default_factory=threading.local, init=False, repr=False
+    )
+    _zdict_cache: T.Dict[int, T.Any] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.compression not in (GZIP, ZSTD):
+            raise ValueError(f"unknown compression {self.compression!r}")
+        if self.compression == ZSTD:
+            _require_zstandard()
+        if self.dict_id is not None:
+            if self.compression != ZSTD:
+                raise ValueError("dict_id is only supported by zstd")
+            if self.dictionary_loader is None:
+                raise ValueError("dictionary_loader is required when dict_id is set")
+
+    @property
+    def content_type(self) -> str:
+        return (
+            ContentTypeEnum.app_gzip if self.compression == GZIP else CONTENT_TYPE_ZSTD
+        )
+
+    def _get_zdict(self, dict_id: int) -> "zstandard.ZstdCompressionDict":
+        with self._lock:
+            zdict = self._zdict_cache.get(dict_id)
+        if zdict is None:
+            if self.dictionary_loader is None:
+                raise ValueError(
+                    f"data is compressed with zstd dictionary {dict_id}, "
+                    f"but no dictionary_loader is given"
+                )
+            zdict = zstandard.ZstdCompressionDict(self.dictionary_loader(dict_id))
+            with self._lock:
+                self._zdict_cache[dict_id] = zdict
+        return zdict
+
+    def _get_compressor(self) -> "zstandard.ZstdCompressor":
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level,
+                dict_data=(
+                    None if self.dict_id is None else self._get_zdict(self.dict_id)
+                ),
+            )
+            self._local.compressor = compressor
+        return compressor
+
+    def _get_decompressor(self, dict_id: int) -> "zstandard.ZstdDecompressor":
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = dict()
+            self._local.decompressors = decompressors
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=None if dict_id == 0 else self._get_zdict(dict_id),
+            )
+            decompressors[dict_id] = decompressor
+        return decompressor
+
+    def compress(self, data: bytes) -> bytes:
+        if self.compression == GZIP:
+            # a fixed mtime makes the output deterministic, so the same html
+            # always gets the same md5 (and the same S3 key)
+            return gzip.compress(
+                data,
+                compresslevel=9 if self.level is None else self.level,
+                mtime=0,
+            )
+        return self._get_compressor().compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if detect_compression(data) == GZIP:
+            return gzip.decompress(data)
+        _require_zstandard()
+        return self._get_decompressor(get_zstd_dict_id(data)).decompress(data)
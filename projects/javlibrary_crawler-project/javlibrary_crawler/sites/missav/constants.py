@@ -39,7 +39,84 @@ if GITHUB_ACTION_RUN_INTERVAL < 300:  # pragma: no cover
         "GitHub Action run interval has to be at least 5 minutes (300 seconds)."
     )
 
+# The workflow records the start time of the job run in this environment variable
+# (unix timestamp or ISO 8601), so that the crawler doesn't need to call the
+# GitHub API to figure out when the job run started.
+START_TIME_ENV_VAR = "MISSAV_CRAWLER_STARTED_AT"
+
 # How long it takes for processing one downloads,
 # including http request, and DynamoDB / S3 operations
 # just use the happy path time, not including retry time
 TASK_PROCESSING_TIME = 2
+
+# 最多同时处理多少个下载任务. 下载任务的大部分时间花在网络 IO 上
+# (HTTP 请求, S3 put, DynamoDB update), 所以并发处理可以显著提高每次运行处理的任务数.
+CRAWL_CONCURRENCY = 4
+
+# 对 missav.com 的请求速率 (每秒多少个请求) 的初始值, 下限和上限. 实际的速率会由
+# :class:`~javlibrary_crawler.sites.missav.rate_limiter.AdaptiveRateLimiter`
+# 根据请求是否成功动态调整, 不管并发数有多大, 请求频率都不会超过当前速率.
+RATE_LIMIT_INITIAL = 1
+RATE_LIMIT_MIN = 0.2
+RATE_LIMIT_MAX = 8
+
+# 对 missav.com 的请求连续失败多少次后熔断, 以及熔断后等待多少秒再发出探测请求.
+# 见 :class:`~javlibrary_crawler.sites.missav.circuit_breaker.CircuitBreaker`.
+CIRCUIT_BREAKER_THRESHOLD = 10
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+
+# pipeline 模式下 (见 :func:`~javlibrary_crawler.sites.missav.pipeline.run_pipeline`),
+# 除了 HTTP 下载以外每个 stage 的 worker 数量, 以及 stage 之间的队列长度.
+# HTTP 下载 stage 的 worker 数量等于 CRAWL_CONCURRENCY.
+PIPELINE_N_COMPRESS_WORKER = 1
+PIPELINE_N_S3_WORKER = 2
+PIPELINE_N_DYNAMODB_WORKER = 2
+PIPELINE_QUEUE_SIZE = 4
+
+# 整个运行共享的重试预算 (见 :class:`~javlibrary_crawler.sites.missav.retry.RetryBudget`),
+# 允许的重试次数为 RETRY_BUDGET_MIN_RETRIES + RETRY_BUDGET_RATIO * 任务数.
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_RETRIES = 10
+
+# 在一次运行中处理多个语言时 (见 ``crawler.crawl_pending_tasks_multi_lang``),
+# 每个语言的任务的权重. 权重越大, 这个语言分到的处理时间越多.
+MULTI_LANG_WEIGHTS = {
+    LangCodeEnum.cn: 1,
+    LangCodeEnum.zh: 1,
+    LangCodeEnum.ja: 1,
+}
+
+# 下载的 HTML 在 S3 中的压缩格式, "gzip" 或者 "zstd" (需要安装 zstandard).
+# 使用 zstd 时, 会使用 S3 中最新的字典 (见 ``crawler.train_html_dictionary``),
+# 没有字典时就不使用字典. 读取 HTML 时会自动识别格式, 所以随时可以切换.
+HTML_COMPRESSION = "gzip"
+# zstd 的压缩级别, 训练字典的样本数量, 以及字典的最大字节数.
+ZSTD_LEVEL = 3
+ZSTD_DICT_N_SAMPLE = 1000
+ZSTD_DICT_SIZE = 112640
+
+# 打包模式下 (见 :mod:`javlibrary_crawler.sites.missav.segment`), 每个 segment 的最大
+# 字节数, 以及 segment 中的第一个页面最多等待多少秒就写入 S3. 在 segment 写入 S3 之前
+# 任务的锁不会释放, 所以等待时间必须比锁的过期时间 (60 秒) 短.
+SEGMENT_MAX_SIZE = 8 * 1024 * 1024
+SEGMENT_MAX_AGE = 30
+
+# 批量加锁模式下 (见 :mod:`javlibrary_crawler.sites.missav.lease`), 每次预先获取多少个
+# 任务的锁, 每次最多提交多少个任务的状态, 以及第一个结束的任务最多等待多少秒就提交.
+# 预先获取的锁从获取时就开始计时, 在提交之前不会释放, 所以等待处理的时间, 处理的时间
+# 和等待提交的时间加起来必须比锁的过期时间 (60 秒) 短.
+LEASE_BATCH_SIZE = 10
+COMMIT_BATCH_SIZE = 25
+COMMIT_MAX_AGE = 5
+
+# 收到 SIGINT / SIGTERM 之后 (见 :mod:`javlibrary_crawler.sites.missav.drain`),
+# 正在处理的任务最多还有多少秒可以正常结束, 超时之后就把它们交还给下一次运行.
+# GitHub Action 取消 job 时, 先发送 SIGINT, 7.5 秒之后发送 SIGTERM, 再过 2.5 秒就
+# kill 进程, 所以这个值要比 7.5 秒短.
+DRAIN_GRACE_PERIOD = 5
+
+# 下载 sitemap 快照 (见 :meth:`javlibrary_crawler.sites.missav.sitemap.SiteMapSnapshot.download`)
+# 时最多同时下载多少个 .xml 文件, 以及每个文件最多尝试多少次. 请求频率仍然受
+# HttpClient 的限速器控制, 并发数不能超过 HttpClient 的 ``pool_size``.
+SITEMAP_DOWNLOAD_CONCURRENCY = 8
+SITEMAP_DOWNLOAD_MAX_ATTEMPTS = 5
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+决定这次运行的开始时间, 进而决定截止时间.
+
+截止时间是从 "这次运行什么时候开始" 推算出来的. 以前在 GitHub Action 中每次运行都会
+匿名调用 GitHub API 查询 workflow run 的 ``run_started_at``. 这不但多了一次网络请求,
+还可能触发匿名用户的 rate limit (每小时 60 次), 导致整个运行直接失败.
+
+现在开始时间由一组 :class:`StartTimeProvider` 按顺序提供, 第一个返回非 None 的为准:
+
+1. :class:`EnvStartTimeProvider`: 读取运行环境注入的环境变量 (默认是
+   ``constants.START_TIME_ENV_VAR``), 例如 workflow 的第一个 step 记录的时间.
+   不需要任何网络请求.
+2. :class:`GitHubRunStartTimeProvider`: 只在 GitHub Action 中, 并且没有注入环境变量时
+   才调用 GitHub API, 结果会被缓存. API 调用失败时返回 None, 而不是让运行失败.
+3. :class:`ProcessStartTimeProvider`: 进程启动的时间. 它比真实的开始时间晚 (没有算上
+   安装依赖等步骤), 所以只作为最后的兜底.
+
+CodeBuild, 本地 cron 等其他运行环境可以实现自己的 :class:`StartTimeProvider`, 然后
+传给 ``crawl_pending_tasks(..., start_time_provider=...)``.
+"""
+
+import typing as T
+import os
+import dataclasses
+from datetime import datetime, timezone, timedelta
+
+from ...logger import logger
+from ...utils import get_utc_now
+
+from .constants import START_TIME_ENV_VAR
+
+# recorded when the crawler modules are imported, which is right after the
+# process starts in the crawler scripts
+PROCESS_STARTED_AT = get_utc_now()
+
+
+def parse_start_time(value: str) -> datetime:
+    """
+    解析开始时间, 支持 unix timestamp (秒, 例如 ``date +%s`` 的输出) 和 ISO 8601
+    (例如 ``date -u +%Y-%m-%dT%H:%M:%SZ`` 的输出). 没有时区的时间被当作 UTC.
+    """
+    value = value.strip()
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except ValueError:
+        pass
+    # datetime.fromisoformat doesn't accept the "Z" suffix before Python 3.11
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+@dataclasses.dataclass
+class StartTimeProvider:
+    """
+    提供这次运行的开始时间. 子类需要实现 :meth:`get_start_time`.
+    """
+
+    def get_start_time(self) -> T.Optional[datetime]:
+        """
+        返回带时区的开始时间, 如果不知道就返回 None.
+        """
+        raise NotImplementedError
+
+    @property
+    def name(self) -> str:
+        return self.__class__.__name__
+
+
+@dataclasses.dataclass
+class EnvStartTimeProvider(StartTimeProvider):
+    """
+    从环境变量中读取开始时间, 格式见 :func:`parse_start_time`.
+
+    :param env_var: 环境变量的名字.
+    :param environ: 环境变量, 默认是 ``os.environ``, 用于测试.
+    """
+
+    env_var: str = dataclasses.field(default=START_TIME_ENV_VAR)
+    environ: T.Mapping[str, str] = dataclasses.field(
+        default_factory=lambda: os.environ, repr=False
+    )
+
+    def get_start_time(self) -> T.Optional[datetime]:
+        value = self.environ.get(self.env_var)
+        if not value:
+            return None
+        try:
+            return parse_start_time(value)
+        except ValueError:
+            logger.info(f"invalid {self.env_var} = {value!r}, ignored")
+            return None
+
+
+@dataclasses.dataclass
+class ProcessStartTimeProvider(StartTimeProvider):
+    """
+    返回进程启动的时间 (见 :data:`PROCESS_STARTED_AT`).
+    """
+
+    started_at: datetime = dataclasses.field(default=PROCESS_STARTED_AT)
+
+    def get_start_time(self) -> T.Optional[datetime]:
+        return self.started_at
+
+
+@dataclasses.dataclass
+class ClockStartTimeProvider(StartTimeProvider):
+    """
+    把调用时的当前时间作为开始时间, 也就是 "从现在开始计时".
+
+    :param now: 返回当前 UTC 时间的函数.
+    """
+
+    now: T.Callable[[], datetime] = dataclasses.field(default=get_utc_now, repr=False)
+
+    def get_start_time(self) -> T.Optional[datetime]:
+        return self.now()
+
+
+def fetch_github_run_started_at(repo: str, run_id: int) -> datetime:
+    """
+    调用 GitHub API 查询 workflow run 的开始时间. 如果有 ``GITHUB_TOKEN`` 环境变量就
+    用它认证, 认证用户的 rate limit 比匿名用户高得多.
+    """
+    from github import Github
+
+    token = os.environ.get("GITHUB_TOKEN")
+    g = Github(token) if token else Github()
+    wf_run = g.get_repo(repo).get_workflow_run(run_id)
+    started_at = wf_run.run_started_at
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    return started_at
+
+
+@dataclasses.dataclass
+class GitHubRunStartTimeProvider(StartTimeProvider):
+    """
+    调用 GitHub API 查询当前 workflow run 的开始时间. 同一个 run 只会查询一次,
+    查询失败 (例如触发了 rate limit) 时返回 None, 并且不会重试.
+
+    :param repo: GitHub repo 的全名.
+    :param environ: 环境变量, 从中读取 ``GITHUB_RUN_ID``. 默认是 ``os.environ``.
+    :param fetch: ``(repo, run_id) -> datetime`` 的函数, 用于测试.
+    """
+
+    repo: str = dataclasses.field(default="angoraking/javadb-project")
+    environ: T.Mapping[str, str] = dataclasses.field(
+        default_factory=lambda: os.environ, repr=False
+    )
+    fetch: T.Callable[[str, int], datetime] = dataclasses.field(
+        default=fetch_github_run_started_at, repr=False
+    )
+
+    _cache: T.Dict[int, T.Optional[datetime]] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    def get_start_time(self) -> T.Optional[datetime]:
+        value = self.environ.get("GITHUB_RUN_ID")
+        if not value:
+            return None
+        run_id = int(value)
+        if run_id not in self._cache:
+            try:
+                self._cache[run_id] = self.fetch(self.repo, run_id)
+            except Exception as e:
+                logger.info(f"failed to get the start time of run {run_id}: {e!r}")
+                self._cache[run_id] = None
+        return self._cache[run_id]
+
+
+# shared by all runs in the same process, so that the API is called only once
+github_run_start_time_provider = GitHubRunStartTimeProvider()
+
+
+@dataclasses.dataclass
+class ChainedStartTimeProvider(StartTimeProvider):
+    """
+    按顺序询问每个 provider, 返回第一个非 None 的开始时间.
+    :attr:`source` 记录了最后一次是哪个 provider 给出的结果.
+    """
+
+    providers: T.List[StartTimeProvider] = dataclasses.field(default_factory=list)
+
+    source: T.Optional[str] = dataclasses.field(default=None, init=False)
+
+    def get_start_time(self) -> T.Optional[datetime]:
+        for provider in self.providers:
+            start_at = provider.get_start_time()
+            if start_at is not None:
+                self.source = provider.name
+                return start_at
+        self.source = None
+        return None
+
+
+def make_default_start_time_provider(
+    is_github_action: bool,
+    now: T.Callable[[], datetime] = get_utc_now,
+) -> ChainedStartTimeProvider:
+    """
+    创建默认的 provider:
+
+    - GitHub Action 中: 环境变量 -> GitHub API -> 进程启动时间.
+    - 其他环境中: 环境变量 -> ``now()``. 和以前的行为一样, 从调用的时候开始计时.
+    """
+    if is_github_action:
+        providers = [
+            EnvStartTimeProvider(),
+            github_run_start_time_provider,
+            ProcessStartTimeProvider(),
+        ]
+    else:
+        providers = [
+            EnvStartTimeProvider(),
+            ClockStartTimeProvider(now=now),
+        ]
+    return ChainedStartTimeProvider(providers=providers)
+
+
+@dataclasses.dataclass(frozen=True)
+class Deadline:
+    """
+    这次运行的开始时间和截止时间.
+
+    :param source: 开始时间是由哪个 provider 提供的.
+    """
+
+    start_at: datetime = dataclasses.field()
+    end_at: datetime = dataclasses.field()
+    source: str = dataclasses.field()
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "start_at": self.start_at.isoformat(),
+            "end_at": self.end_at.isoformat(),
+            "source": self.source,
+        }
+
+
+def resolve_deadline(
+    provider: StartTimeProvider,
+    max_run_time: float,
+    now: T.Callable[[], datetime] = get_utc_now,
+) -> Deadline:
+    """
+    用 ``provider`` 决定开始时间, 再加上 ``max_run_time`` 秒得到截止时间.
+    如果 ``provider`` 不知道开始时间, 就从 ``now()`` 开始计时.
+    """
+    start_at = provider.get_start_time()
+    if start_at is None:
+        start_at, source = now(), "now"
+    elif isinstance(provider, ChainedStartTimeProvider):
+        source = provider.source
+    else:
+        source = provider.name
+    return Deadline(
+        start_at=start_at,
+        end_at=start_at + timedelta(seconds=max_run_time),
+        source=source,
+    )
@@ -4,7 +4,22 @@
 这个模块把 HTTP request 请求封装成函数, 用于下载网页.
 """
 
+import typing as T
+import hashlib
+import dataclasses
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from .constants import (
+    RATE_LIMIT_INITIAL,
+    RATE_LIMIT_MIN,
+    RATE_LIMIT_MAX,
+    CIRCUIT_BREAKER_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_TIMEOUT,
+)
+from .rate_limiter import AdaptiveRateLimiter
+from .circuit_breaker import CircuitBreaker
 
 
 headers = {
@@ -15,9 +30,13 @@ headers = {
 class HttpError(Exception):
     """
     当 HTTP status code 不对的时候抛出这个异常.
+
+    :param status_code: 响应的 HTTP status code, 如果不知道就是 None.
     """
 
-    pass
+    def __init__(self, *args, status_code: T.Optional[int] = None):
+        super().__init__(*args)
+        self.status_code = status_code
 
 
 class MalformedHtmlError(Exception):
@@ -28,16 +47,245 @@ class MalformedHtmlError(Exception):
     pass
 
 
-def get_video_detail_html(url: str) -> str:
+@dataclasses.dataclass
+class HttpClient:
+    """
+    持有一个带连接池的 :class:`requests.Session`. 同一个 host 的多次请求会复用
+    keep-alive 连接, 避免每次请求都重新进行 TCP + TLS 握手. 这个对象可以在多个线程之间共享,
+    ``pool_size`` 应该不小于并发数, 否则多出来的线程需要等待空闲连接.
+
+    注: requests 不支持 HTTP/2, 所以这里只做了 HTTP/1.1 的连接复用.
+
+    :param pool_size: 每个 host 最多保持多少个连接.
+    :param connect_timeout: 建立连接的超时时间 (秒).
+    :param read_timeout: 读取响应的超时时间 (秒).
+    :param rate_limiter: 如果给定, 每次请求前都会先从限速器拿令牌, 并且把请求的结果
+        (成功, 429, 5xx, 网络错误) 报告给限速器.
+    :param circuit_breaker: 如果给定, :func:`get_video_detail_html` 会在请求之前检查
+        熔断器, 并把结果报告给熔断器.
+    """
+
+    pool_size: int = dataclasses.field(default=10)
+    connect_timeout: float = dataclasses.field(default=3)
+    read_timeout: float = dataclasses.field(default=3)
+    rate_limiter: T.Optional[AdaptiveRateLimiter] = dataclasses.field(default=None)
+    circuit_breaker: T.Optional[CircuitBreaker] = dataclasses.field(default=None)
+    session: requests.Session = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def timeout(self) -> T.Tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        用连接池中的连接发起 GET 请求, 参数和 :func:`requests.get` 一样.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if self.rate_limiter is None:
+            return self.session.get(url, **kwargs)
+
+        self.rate_limiter.acquire()
+        try:
+            res = self.session.get(url, **kwargs)
+        except requests.RequestException as e:
+            self.rate_limiter.on_throttle(reason=type(e).__name__)
+            raise e
+        if res.status_code == 429 or res.status_code >= 500:
+            self.rate_limiter.on_throttle(reason=f"HTTP {res.status_code}")
+        elif res.status_code < 400:
+            self.rate_limiter.on_success()
+        return res
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# missav site package 中默认共享的 HTTP client, 所有对 missav.com 的请求共享同一个限速器
+http_client = HttpClient(
+    rate_limiter=AdaptiveRateLimiter(
+        rate=RATE_LIMIT_INITIAL,
+        min_rate=RATE_LIMIT_MIN,
+        max_rate=RATE_LIMIT_MAX,
+    ),
+    circuit_breaker=CircuitBreaker(
+        failure_threshold=CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ),
+)
+
+
+# 正常的影片详情页的 <head> 中一定有这个标签, 而验证码页面或者错误页面没有
+PRELOAD_IMAGE_MARKER = b'<link rel="preload" as="image"'
+HEAD_END_MARKER = b"</head>"
+CHUNK_SIZE = 16 * 1024
+
+
+@dataclasses.dataclass
+class HtmlValidators:
+    """
+    用于判断页面是否有变化的信息, 保存在 DynamoDB 中, 重新抓取时用来发送条件请求.
+
+    :param etag: 响应的 ``ETag`` header.
+    :param last_modified: 响应的 ``Last-Modified`` header.
+    :param md5: HTML 原始 bytes 的 md5. 如果服务器不支持条件请求, 也可以通过比较 md5
+        知道页面没有变化, 从而不用重复写入 S3.
+    """
+
+    etag: T.Optional[str] = dataclasses.field(default=None)
+    last_modified: T.Optional[str] = dataclasses.field(default=None)
+    md5: T.Optional[str] = dataclasses.field(default=None)
+
+    def to_request_headers(self) -> T.Dict[str, str]:
+        request_headers = dict()
+        if self.etag:
+            request_headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            request_headers["If-Modified-Since"] = self.last_modified
+        return request_headers
+
+
+@dataclasses.dataclass
+class FetchResult:
+    """
+    :func:`fetch_video_detail_html` 的返回值.
+
+    :param content: HTML 原始的 bytes. 如果页面没有变化, 则为 None.
+    :param validators: 这次响应的 validators.
+    """
+
+    content: T.Optional[bytes] = dataclasses.field(repr=False)
+    validators: HtmlValidators = dataclasses.field()
+
+    @property
+    def is_modified(self) -> bool:
+        return self.content is not None
+
+
+def fetch_video_detail_html(
+    url: str,
+    client: T.Optional[HttpClient] = None,
+    validators: T.Optional[HtmlValidators] = None,
+) -> FetchResult:
     """
     下载影片详细信息的 HTML. 例如 https://missav.com/cn/abf-106
+
+    响应是以流的方式读取的. 如果在 ``</head>`` 之前还没有看到
+    ``<link rel="preload" as="image"``, 就说明这是一个验证码页面或者错误页面, 此时会
+    立刻断开连接并抛出 :class:`MalformedHtmlError`, 不会再下载剩下的内容.
+
+    :param client: 用于发起请求的 :class:`HttpClient`, 默认使用 :data:`http_client`.
+        如果它有熔断器, 请求之前会先检查熔断器, 熔断时会阻塞或者抛出
+        :class:`~.circuit_breaker.CircuitOpenError`. 404 说明网站是正常的, 只是这个
+        页面不存在, 所以不算作熔断器的失败.
+    :param validators: 上次下载时的 validators. 如果给定, 会发送条件请求
+        (``If-None-Match`` / ``If-Modified-Since``). 服务器返回 304, 或者返回的 HTML 的
+        md5 和上次一样时, 认为页面没有变化, 返回的 ``content`` 为 None.
     """
-    res = requests.get(url, headers=headers, timeout=3)
-    if res.status_code == 200:
-        html = res.text
-        if '<link rel="preload" as="image"' in html:
-            return html
+    if client is None:
+        client = http_client
+    breaker = client.circuit_breaker
+    if breaker is None:
+        return _fetch_video_detail_html(url, client, validators)
+    breaker.before_request()
+    try:
+        result = _fetch_video_detail_html(url, client, validators)
+    except HttpError as e:
+        if e.status_code == 404:
+            breaker.on_success()
         else:
+            breaker.on_failure(reason=repr(e))
+        raise e
+    except Exception as e:
+        breaker.on_failure(reason=repr(e))
+        raise e
+    breaker.on_success()
+    return result
+
+
+def _fetch_video_detail_html(
+    url: str,
+    client: HttpClient,
+    validators: T.Optional[HtmlValidators],
+) -> FetchResult:
+    request_headers = None if validators is None else validators.to_request_headers()
+    res = client.get(url, stream=True, headers=request_headers)
+    # if we don't read the whole body, closing the response drops the connection
+    # instead of putting it back to the pool
+    with res:
+        if res.status_code == 304 and request_headers:
+            return FetchResult(
+                content=None,
+                validators=HtmlValidators(
+                    etag=res.headers.get("ETag", validators.etag),
+                    last_modified=res.headers.get(
+                        "Last-Modified", validators.last_modified
+                    ),
+                    md5=validators.md5,
+                ),
+            )
+        content = _read_video_detail_html(url, res)
+    new_validators = HtmlValidators(
+        etag=res.headers.get("ETag"),
+        last_modified=res.headers.get("Last-Modified"),
+        md5=hashlib.md5(content).hexdigest(),
+    )
+    if validators is not None and validators.md5 == new_validators.md5:
+        content = None
+    return FetchResult(content=content, validators=new_validators)
+
+
+def _read_video_detail_html(url: str, res: requests.Response) -> bytes:
+    if res.status_code != 200:
+        raise HttpError(f"HTTP Error: {res.status_code}", status_code=res.status_code)
+    buffer = bytearray()
+    is_marker_found = False
+    for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+        # the marker may be split across two chunks
+        start = max(0, len(buffer) - len(PRELOAD_IMAGE_MARKER))
+        buffer.extend(chunk)
+        if is_marker_found:
+            continue
+        if buffer.find(PRELOAD_IMAGE_MARKER, start) != -1:
+            is_marker_found = True
+        elif buffer.find(HEAD_END_MARKER, start) != -1:
             raise MalformedHtmlError(f"Malformed HTML: {url}")
-    else:
-        raise HttpError(f"HTTP Error: {res.status_code}")
+    if is_marker_found is False:
+        raise MalformedHtmlError(f"Malformed HTML: {url}")
+    return bytes(buffer)
+
+
+def get_video_detail_html_bytes(
+    url: str,
+    client: T.Optional[HttpClient] = None,
+) -> bytes:
+    """
+    下载影片详细信息的 HTML, 返回原始的 bytes. 详细说明见 :func:`fetch_video_detail_html`.
+    """
+    return fetch_video_detail_html(url, client=client).content
+
+
+def get_video_detail_html(
+    url: str,
+    client: T.Optional[HttpClient] = None,
+) -> str:
+    """
+    和 :func:`get_video_detail_html_bytes` 一样, 但是返回解码后的字符串.
+    """
+    return get_video_detail_html_bytes(url, client=client).decode("utf-8")
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+收到停止信号时优雅地结束爬虫.
+
+GitHub Action 的 job 被取消或者超时的时候, runner 会先发送 SIGINT, 再发送 SIGTERM,
+几秒钟之后直接 kill 进程. 如果这时有任务正在处理, 它们会一直停留在 in_progress 状态并
+持有锁. 由于我们只查询 pending 和 failed 状态的任务, 这些任务再也不会被处理了.
+
+:class:`GracefulDrain` 在收到信号之后进入 drain 阶段:
+
+1. ``should_stop`` 返回 True, 引擎和流水线不再开始新的任务.
+2. 正在处理的任务有 ``grace_period`` 秒的时间正常结束.
+3. 超过 ``grace_period`` 之后调用 ``on_timeout``, 把还没有结束的任务恢复到获取锁之前的
+   状态并释放锁 (见 ``DownloadJob.release_all``), 下一次运行可以立刻重新处理它们.
+   如果在这期间又收到了一次信号, 就立刻调用 ``on_timeout``.
+
+:class:`InFlightTracker` 用来记录哪些任务还没有结束.
+"""
+
+import typing as T
+import signal
+import threading
+import dataclasses
+
+from ...logger import logger
+
+T_ITEM = T.TypeVar("T_ITEM")
+
+
+@dataclasses.dataclass
+class InFlightTracker(T.Generic[T_ITEM]):
+    """
+    记录还没有结束的 item. 用 ``id(item)`` 区分不同的 item, 所以 item 不需要是 hashable.
+    这个对象是线程安全的.
+    """
+
+    _items: T.Dict[int, T_ITEM] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def add(self, item: T_ITEM):
+        with self._lock:
+            self._items[id(item)] = item
+
+    def discard(self, item: T_ITEM):
+        with self._lock:
+            self._items.pop(id(item), None)
+
+    def pop_all(self) -> T.List[T_ITEM]:
+        """
+        取出所有还没有结束的 item, 之后这个 tracker 是空的.
+        """
+        with self._lock:
+            items, self._items = list(self._items.values()), dict()
+        return items
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+
+@dataclasses.dataclass
+class GracefulDrain:
+    """
+    收到 ``signals`` 中的信号时进入 drain 阶段, 而不是直接退出. 用法::
+
+        with GracefulDrain(grace_period=5, on_timeout=release_in_flight) as drain:
+            run_crawl_engine(..., should_stop=drain.should_stop)
+
+    只有主线程可以注册信号处理函数. 如果不是在主线程中, 就不注册, 但是仍然可以调用
+    :meth:`request` 手动进入 drain 阶段.
+
+    :param grace_period: 进入 drain 阶段之后, 等待多少秒再调用 ``on_timeout``.
+    :param on_timeout: 等待超时之后调用的函数, 只会被调用一次.
+    :param signals: 要处理的信号.
+    """
+
+    grace_period: float = dataclasses.field(default=5)
+    on_timeout: T.Optional[T.Callable[[], T.Any]] = dataclasses.field(
+        default=None, repr=False
+    )
+    signals: T.Tuple[int, ...] = dataclasses.field(
+        default=(signal.SIGTERM, signal.SIGINT)
+    )
+
+    reason: T.Optional[str] = dataclasses.field(default=None, init=False)
+    _event: threading.Event = dataclasses.field(
+        default_factory=threading.Event, init=False, repr=False
+    )
+    _timer: T.Optional[threading.Timer] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+    _is_fired: bool = dataclasses.field(default=False, init=False, repr=False)
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+    _old_handlers: T.Dict[int, T.Any] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    @property
+    def is_draining(self) -> bool:
+        return self._event.is_set()
+
+    def should_stop(self) -> bool:
+        return self._event.is_set()
+
+    def request(self, reason: str):
+        """
+        进入 drain 阶段. 如果已经在 drain 阶段了, 就立刻调用 ``on_timeout``.
+        """
+        with self._lock:
+            is_first = not self._event.is_set()
+            if is_first:
+                self.reason = reason
+                self._event.set()
+                self._timer = threading.Timer(self.grace_period, self._fire)
+                self._timer.daemon = True
+        if is_first:
+            logger.info(
+                f"start draining ({reason}), in-flight tasks have "
+                f"{self.grace_period} seconds to finish"
+            )
+            self._timer.start()
+        else:
+            logger.info(f"stop waiting for in-flight tasks ({reason})")
+            self._fire()
+
+    def _fire(self):
+        with self._lock:
+            if self._is_fired:
+                return
+            self._is_fired = True
+        if self.on_timeout is not None:
+            self.on_timeout()
+
+    def _handle_signal(self, signum, frame):
+        name = signal.Signals(signum).name
+        # the next signal falls back to the default behavior,
+        # in case the drain itself hangs
+        if self.is_draining:
+            self._restore_handlers()
+        self.request(f"received {name}")
+
+    def _restore_handlers(self):
+        old_handlers, self._old_handlers = self._old_handlers, dict()
+        for signum, handler in old_handlers.items():
+            signal.signal(signum, handler)
+
+    def install(self):
+        """
+        注册信号处理函数.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            logger.info("not in the main thread, signal handlers are not installed")
+            return
+        for signum in self.signals:
+            self._old_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+    def uninstall(self):
+        """
+        恢复原来的信号处理函数, 并取消还没有触发的 ``on_timeout``.
+        """
+        if threading.current_thread() is threading.main_thread():
+            self._restore_handlers()
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def __enter__(self) -> "GracefulDrain":
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uninstall()
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "is_draining": self.is_draining,
+            "reason": self.reason,
+        }
@@ -6,16 +6,12 @@ DynamoDB 是用来追踪 HTML 的下载进度的. 由于爬虫是运行在 GitHu
 """
 
 import typing as T
-import gzip
+import time
 import base64
 import hashlib
+import dataclasses
+from datetime import datetime, timedelta
 
-from tenacity import (
-    retry,
-    wait_exponential,
-    retry_if_exception_type,
-    stop_after_attempt,
-)
 from s3pathlib import S3Path, ContentTypeEnum
 from boto_session_manager import BotoSesManager
 import pynamodb_mate.api as pm
@@ -28,8 +24,29 @@ from ...logger import logger
 from ..constants import SiteEnum
 
 from .constants import LangCodeEnum, N_PENDING_SHARD
-from .downloader import HttpError, MalformedHtmlError, get_video_detail_html
-
+from .downloader import (
+    HttpError,
+    MalformedHtmlError,
+    HttpClient,
+    HtmlValidators,
+    FetchResult,
+    fetch_video_detail_html,
+)
+from .pipeline import Stage
+from .retry import RetryPolicy
+from .telemetry import CrawlTelemetry
+from .codec import HtmlCodec
+from .segment import is_segment_uri, SegmentPointer, SegmentWriter
+from .lease import (
+    TaskLeaser,
+    CompletionBatcher,
+    set_succeeded,
+    set_failed,
+    set_released,
+    get_queried_status,
+    commit_tasks,
+    MAX_TRANSACTION_SIZE,
+)
 
 st = pm.patterns.status_tracker
 large_attribute = pm.patterns.large_attribute
@@ -82,6 +99,10 @@ class BaseTask(
     """
 
     html: pm.OPTIONAL_STR = pm.UnicodeAttribute(null=True)
+    # validators of the last download, see HtmlValidators
+    etag: pm.OPTIONAL_STR = pm.UnicodeAttribute(null=True)
+    last_modified: pm.OPTIONAL_STR = pm.UnicodeAttribute(null=True)
+    html_md5: pm.OPTIONAL_STR = pm.UnicodeAttribute(null=True)
 
     status_and_update_time_index = StatusAndUpdateTimeIndex()
 
@@ -97,32 +118,581 @@ class BaseTask(
     def url(self):
         return self.task_id
 
-    @retry(
-        wait=wait_exponential(multiplier=1, min=2, max=60),
-        stop=stop_after_attempt(10),
-        retry=retry_if_exception_type(HttpError),
-        reraise=True,
-    )
-    def do_download_task(self):
-        html = get_video_detail_html(self.url)
-        content = gzip.compress(html.encode("utf-8"))
+    @property
+    def lock_expire_at(self) -> T.Optional[datetime]:
+        """
+        任务的锁过期的时间. 如果任务没有被锁, 返回 None.
+        """
+        # the default value of the lock attribute means "not locked"
+        if self.lock == self.__class__.lock.default:
+            return None
+        return self.lock_time + timedelta(seconds=self.config.lock_expire_seconds)
+
+    def get_retry_deadline(
+        self,
+        end_at: T.Optional[datetime] = None,
+    ) -> T.Optional[datetime]:
+        """
+        重试的截止时间, 也就是任务的锁过期的时间和 ``end_at`` 中更早的那个.
+        """
+        deadline_list = [dt for dt in [self.lock_expire_at, end_at] if dt is not None]
+        return min(deadline_list) if deadline_list else None
+
+    @property
+    def validators(self) -> HtmlValidators:
+        """
+        上次下载时保存的 validators.
+        """
+        return HtmlValidators(
+            etag=self.etag,
+            last_modified=self.last_modified,
+            md5=self.html_md5,
+        )
+
+    @property
+    def stored_validators(self) -> T.Optional[HtmlValidators]:
+        """
+        如果已经下载过 HTML, 返回上次下载时的 validators, 否则返回 None.
+        下载时用它来判断页面有没有变化, 没有变化就不用重复压缩和写入 S3.
+        """
+        return self.validators if self.html else None
+
+    def _get_validators_update_actions(
+        self,
+        validators: T.Optional[HtmlValidators],
+    ) -> list:
+        if validators is None:
+            return []
+        actions = list()
+        for attr, value in [
+            (self.__class__.etag, validators.etag),
+            (self.__class__.last_modified, validators.last_modified),
+            (self.__class__.html_md5, validators.md5),
+        ]:
+            actions.append(attr.remove() if value is None else attr.set(value))
+        return actions
+
+    def fetch(
+        self,
+        client: T.Optional[HttpClient] = None,
+        retry_policy: T.Optional[RetryPolicy] = None,
+        end_at: T.Optional[datetime] = None,
+        validators: T.Optional[HtmlValidators] = None,
+    ) -> FetchResult:
+        """
+        下载 HTML, 遇到 :class:`~.downloader.HttpError` 会按照 ``retry_policy`` 重试,
+        但不会在任务的锁过期或者 ``end_at`` 之后开始新的尝试
+        (见 :class:`~.retry.RetryPolicy`).
+
+        :param end_at: 这次运行的结束时间.
+        :param validators: 如果给定, 发送条件请求, 见
+            :func:`~.downloader.fetch_video_detail_html`.
+        """
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        return retry_policy.call(
+            lambda: fetch_video_detail_html(
+                self.url,
+                client=client,
+                validators=validators,
+            ),
+            deadline=self.get_retry_deadline(end_at=end_at),
+        )
+
+    def fetch_html(
+        self,
+        client: T.Optional[HttpClient] = None,
+        retry_policy: T.Optional[RetryPolicy] = None,
+        end_at: T.Optional[datetime] = None,
+    ) -> bytes:
+        """
+        下载 HTML (bytes), 参数的含义见 :meth:`fetch`.
+        """
+        return self.fetch(
+            client=client,
+            retry_policy=retry_policy,
+            end_at=end_at,
+        ).content
+
+    @staticmethod
+    def compress_html(
+        html: bytes,
+        codec: T.Optional[HtmlCodec] = None,
+    ) -> bytes:
+        """
+        压缩下载的 HTML. 这里直接压缩原始的 bytes, 不需要先解码再编码.
+
+        :param codec: 压缩格式, 默认使用 gzip, 见 :class:`~.codec.HtmlCodec`.
+        """
+        if codec is None:
+            codec = HtmlCodec()
+        return codec.compress(html)
+
+    def put_html(
+        self,
+        content: bytes,
+        update_at: datetime,
+        content_type: str = ContentTypeEnum.app_gzip,
+    ) -> large_attribute.PutS3Response:
+        """
+        把压缩后的 HTML 写入 S3. 由于 S3 key 中包含了内容的 md5, 如果同样的内容已经存在,
+        就不会重复写入.
+
+        :param content_type: 和压缩格式对应的 ContentType, 见 :attr:`~.codec.HtmlCodec.content_type`.
+        """
+        html_attr = self.__class__.html.attr_name
         s3dir_missav_downloads = config.env.s3dir_missav_downloads
-        new_model = self.update_large_attribute_item(
+        return self.put_s3(
             s3_client=bsm.s3_client,
             pk=self.key,
             sk=None,
-            kvs={self.__class__.html.attr_name: content},
+            kvs={html_attr: content},
             bucket=s3dir_missav_downloads.bucket,
             prefix=s3dir_missav_downloads.key,
-            update_at=get_utc_now(),
+            update_at=update_at,
             s3_put_object_kwargs={
-                "ContentType": ContentTypeEnum.app_gzip,
+                html_attr: {"ContentType": content_type},
             },
             s3_key_getter=s3_key_getter,
-            clean_up_when_failed=True,
         )
-        s3path = S3Path(new_model.html)
+
+    def update_html(
+        self,
+        put_s3_res: large_attribute.PutS3Response,
+        validators: T.Optional[HtmlValidators] = None,
+    ):
+        """
+        把 DynamoDB item 中的 html 属性指向 :meth:`put_html` 写入的 S3 object.
+        更新成功后删除旧的 S3 object, 失败则删除新写入的 S3 object.
+        这和 ``update_large_attribute_item`` 中 DynamoDB 的部分是一样的.
+
+        :param validators: 如果给定, 同时保存这次下载的 validators.
+        """
+        old_html = self.html
+        try:
+            self.update(
+                actions=(
+                    put_s3_res.to_update_actions(model_klass=self.__class__)
+                    + self._get_validators_update_actions(validators)
+                )
+            )
+        except Exception as e:
+            put_s3_res.clean_up_created_s3_object_when_update_dynamodb_item_failed(
+                s3_client=bsm.s3_client,
+            )
+            raise e
+        for action in put_s3_res.actions:
+            if action.put_executed and old_html and old_html != action.s3_uri:
+                self._delete_old_html(old_html)
+
+    def _delete_old_html(self, old_html: str):
+        # segments are shared by many pages, they are never deleted here
+        if not is_segment_uri(old_html):
+            S3Path(old_html).delete(bsm=bsm)
+
+    def update_html_pointer(
+        self,
+        uri: str,
+        validators: T.Optional[HtmlValidators] = None,
+    ):
+        """
+        打包模式下, 把 DynamoDB item 中的 html 属性指向 segment 中的一段
+        (见 :class:`~.segment.SegmentPointer`). 更新成功后删除旧的单独的 S3 object.
+        """
+        old_html = self.html
+        self.update(
+            actions=[self.__class__.html.set(uri)]
+            + self._get_validators_update_actions(validators)
+        )
+        if old_html and old_html != uri:
+            self._delete_old_html(old_html)
+
+    def download_and_compress(
+        self,
+        client: T.Optional[HttpClient] = None,
+        retry_policy: T.Optional[RetryPolicy] = None,
+        end_at: T.Optional[datetime] = None,
+        telemetry: T.Optional[CrawlTelemetry] = None,
+        codec: T.Optional[HtmlCodec] = None,
+        validators: T.Optional[HtmlValidators] = None,
+    ) -> FetchResult:
+        """
+        下载并压缩 HTML, 参数的含义见 :meth:`do_download_task`.
+        返回的 ``content`` 是压缩后的 HTML, 如果页面没有变化则为 None.
+        """
+        if telemetry is None:
+            telemetry = CrawlTelemetry()
+        if validators is None:
+            validators = self.stored_validators
+        with telemetry.timer("http"):
+            result = self.fetch(
+                client=client,
+                retry_policy=retry_policy,
+                end_at=end_at,
+                validators=validators,
+            )
+        if not result.is_modified:
+            telemetry.incr("unchanged")
+            return result
+        telemetry.observe("http_bytes", len(result.content))
+        with telemetry.timer("compress"):
+            content = self.compress_html(result.content, codec=codec)
+        return FetchResult(content=content, validators=result.validators)
+
+    def update_validators(self, validators: HtmlValidators):
+        """
+        页面没有变化时, 只更新 validators, 不写入 S3.
+        """
+        self.update(actions=self._get_validators_update_actions(validators))
+
+    def do_download_task(
+        self,
+        client: T.Optional[HttpClient] = None,
+        retry_policy: T.Optional[RetryPolicy] = None,
+        end_at: T.Optional[datetime] = None,
+        telemetry: T.Optional[CrawlTelemetry] = None,
+        codec: T.Optional[HtmlCodec] = None,
+        validators: T.Optional[HtmlValidators] = None,
+    ) -> bool:
+        """
+        依次执行下载, 压缩, 写入 S3, 更新 DynamoDB. 如果要让这些步骤在多个任务之间
+        并行执行, 请使用 :meth:`make_download_stages`.
+
+        ``retry_policy`` 和 ``end_at`` 的含义见 :meth:`fetch_html`.
+
+        :param telemetry: 如果给定, 每个步骤的耗时和下载的字节数会记录在这里.
+        :param codec: 压缩格式, 默认使用 gzip.
+        :param validators: 用于发送条件请求和比较 md5 的 validators, 默认使用
+            :attr:`stored_validators`. 如果页面没有变化 (HTTP 304 或者 md5 和上次一样),
+            只更新 DynamoDB 中的 validators, 不压缩也不写入 S3, 并在 ``telemetry``
+            中记录一次 ``unchanged``.
+
+        :return: 页面是否有变化 (是否写入了 S3).
+        """
+        if telemetry is None:
+            telemetry = CrawlTelemetry()
+        if codec is None:
+            codec = HtmlCodec()
+        result = self.download_and_compress(
+            client=client,
+            retry_policy=retry_policy,
+            end_at=end_at,
+            telemetry=telemetry,
+            codec=codec,
+            validators=validators,
+        )
+        if not result.is_modified:
+            with telemetry.timer("dynamodb_update"):
+                self.update_validators(result.validators)
+            logger.info(f"Html is not modified: {self.url}")
+            return False
+        with telemetry.timer("s3_put"):
+            put_s3_res = self.put_html(
+                content=result.content,
+                update_at=get_utc_now(),
+                content_type=codec.content_type,
+            )
+        with telemetry.timer("dynamodb_update"):
+            self.update_html(put_s3_res, validators=result.validators)
+        s3path = S3Path(self.html)
         logger.info(f"Html is stored at: {s3path.console_url}")
+        return True
+
+    @classmethod
+    def make_download_stages(
+        cls,
+        client: T.Optional[HttpClient] = None,
+        retry_policy: T.Optional[RetryPolicy] = None,
+        end_at: T.Optional[datetime] = None,
+        telemetry: T.Optional[CrawlTelemetry] = None,
+        codec: T.Optional[HtmlCodec] = None,
+        segment_writer: T.Optional[SegmentWriter] = None,
+        leaser: T.Optional[TaskLeaser] = None,
+        n_download_worker: int = 1,
+        n_compress_worker: int = 1,
+        n_s3_worker: int = 1,
+        n_dynamodb_worker: int = 1,
+    ) -> T.List[Stage]:
+        """
+        把 :meth:`do_download_task` 拆成 4 个 stage, 用于 :func:`~.pipeline.run_pipeline`.
+        流水线中传递的是 :class:`DownloadJob` 对象. 第一个 stage 会先获取任务的锁,
+        最后一个 stage 会把任务标记为成功并释放锁. 任何一个 stage 失败时, 需要调用
+        :meth:`DownloadJob.fail` 把任务标记为失败并释放锁. 每个任务用它自己的类获取锁,
+        所以同一组 stage 可以处理多个语言 (多个表) 的任务.
+
+        ``telemetry`` 和 ``codec`` 的含义见 :meth:`do_download_task`. DynamoDB 加锁和
+        解锁的耗时由 :attr:`DownloadJob.telemetry` 记录. 和 :meth:`do_download_task`
+        一样, 如果页面没有变化, 中间的 stage 会直接跳过这个任务, 最后一个 stage 只更新
+        validators 并把任务标记为成功.
+
+        如果给定了 ``segment_writer`` (打包模式, 见 :mod:`.segment`), 写入 S3 和更新
+        DynamoDB 这两个 stage 会被替换为一个把 HTML 追加到 segment 中的 stage.
+        这时流水线结束时任务还没有完成 (除非 :attr:`DownloadJob.is_unchanged`),
+        segment 写入 S3 之后, ``segment_writer`` 的 ``on_flush`` 需要调用
+        :meth:`DownloadJob.finish_with_pointer`.
+
+        如果给定了 ``leaser`` (批量加锁模式, 见 :mod:`.lease`), 第一个 stage 从
+        ``leaser`` 中拿到预先获取的锁, 而不是单独获取锁.
+        """
+        if telemetry is None:
+            telemetry = CrawlTelemetry()
+        if codec is None:
+            codec = HtmlCodec()
+
+        def download(job: DownloadJob) -> DownloadJob:
+            # don't lock the task if we already know the site is down
+            if client is not None and client.circuit_breaker is not None:
+                client.circuit_breaker.raise_if_broken()
+            logger.info(f"====== Working on {job.task.url} ======")
+            if leaser is None:
+                job.start(klass=job.task.__class__)
+            else:
+                job.start_with_lease(leaser)
+            task = job.exec_ctx.task
+            with telemetry.timer("http"):
+                result = task.fetch(
+                    client=client,
+                    retry_policy=retry_policy,
+                    end_at=end_at,
+                    validators=task.stored_validators,
+                )
+            job.html, job.validators = result.content, result.validators
+            if result.is_modified:
+                telemetry.observe("http_bytes", len(job.html))
+            else:
+                job.is_unchanged = True
+                telemetry.incr("unchanged")
+            return job
+
+        def compress(job: DownloadJob) -> DownloadJob:
+            if job.is_unchanged:
+                return job
+            with telemetry.timer("compress"):
+                job.content = cls.compress_html(job.html, codec=codec)
+            job.html = None
+            return job
+
+        def upload(job: DownloadJob) -> DownloadJob:
+            if job.is_unchanged:
+                return job
+            with telemetry.timer("s3_put"):
+                job.put_s3_res = job.exec_ctx.task.put_html(
+                    content=job.content,
+                    update_at=get_utc_now(),
+                    content_type=codec.content_type,
+                )
+            job.content = None
+            return job
+
+        def update(job: DownloadJob) -> DownloadJob:
+            if job.is_unchanged:
+                job.finish_unchanged()
+                return job
+            with telemetry.timer("dynamodb_update"):
+                job.exec_ctx.task.update_html(
+                    job.put_s3_res,
+                    validators=job.validators,
+                )
+            job.succeed()
+            return job
+
+        def pack(job: DownloadJob) -> DownloadJob:
+            # there is nothing to pack, the job is done here
+            if job.is_unchanged:
+                job.finish_unchanged()
+                return job
+            content, job.content = job.content, None
+            job.append_to_segment(segment_writer, content)
+            return job
+
+        if segment_writer is not None:
+            return [
+                Stage(name="download", func=download, n_worker=n_download_worker),
+                Stage(name="compress", func=compress, n_worker=n_compress_worker),
+                Stage(name="pack", func=pack, n_worker=1),
+            ]
+        return [
+            Stage(name="download", func=download, n_worker=n_download_worker),
+            Stage(name="compress", func=compress, n_worker=n_compress_worker),
+            Stage(name="s3", func=upload, n_worker=n_s3_worker),
+            Stage(name="dynamodb", func=update, n_worker=n_dynamodb_worker),
+        ]
+
+
+@dataclasses.dataclass
+class DownloadJob:
+    """
+    在流水线的各个 stage 之间传递的一个下载任务的上下文. 由于任务的锁是在第一个 stage
+    获取, 在最后一个 stage 释放的, 所以这里需要手动调用 ``BaseTask.start`` 这个
+    context manager 的 ``__enter__`` 和 ``__exit__``. 非流水线模式下也用这个对象来
+    管理锁, 这样两种模式可以用同样的方式记录统计数据.
+
+    批量加锁模式下 (见 :mod:`.lease`), 用 :meth:`start_with_lease` 代替 :meth:`start`,
+    任务结束时的状态更新交给 ``completion_batcher`` 批量提交.
+
+    :param task: 从 DynamoDB 中查询到的任务. 通常是从 index 中查询到的, 只有部分属性.
+    :param telemetry: 用于记录 DynamoDB 加锁和解锁的耗时.
+    :param completion_batcher: 批量加锁模式下, 用于提交任务的状态.
+        如果为 None, 每个任务结束时单独提交.
+    """
+
+    task: BaseTask = dataclasses.field()
+    telemetry: CrawlTelemetry = dataclasses.field(
+        default_factory=CrawlTelemetry, repr=False
+    )
+    completion_batcher: T.Optional[CompletionBatcher] = dataclasses.field(
+        default=None, repr=False
+    )
+    start_time: T.Optional[float] = dataclasses.field(default=None)
+    end_time: T.Optional[float] = dataclasses.field(default=None)
+    exec_ctx: T.Optional[st.ExecutionContext] = dataclasses.field(default=None)
+    previous_status: T.Optional[int] = dataclasses.field(default=None)
+    html: T.Optional[bytes] = dataclasses.field(default=None, repr=False)
+    content: T.Optional[bytes] = dataclasses.field(default=None, repr=False)
+    validators: T.Optional[HtmlValidators] = dataclasses.field(default=None)
+    is_unchanged: bool = dataclasses.field(default=False)
+    put_s3_res: T.Optional[large_attribute.PutS3Response] = dataclasses.field(
+        default=None
+    )
+    _lock_context: T.Optional[T.ContextManager] = dataclasses.field(
+        default=None, repr=False
+    )
+    _is_leased: bool = dataclasses.field(default=False, repr=False)
+    _is_released: bool = dataclasses.field(default=False, repr=False)
+
+    def start(
+        self,
+        klass: T.Type[BaseTask],
+        debug: bool = False,
+        more_pending_status: T.Optional[int] = None,
+    ):
+        """
+        获取锁, 并把任务的状态设为 in_progress.
+
+        :param more_pending_status: 除了 pending 和 failed 以外, 还允许从哪个状态开始.
+            例如重新抓取已经成功的任务时, 传入 succeeded 状态.
+        """
+        self.start_time = time.perf_counter()
+        # BaseTask.start doesn't return the old item, use the queried status
+        self.previous_status = get_queried_status(self.task)
+        lock_context = klass.start(
+            task_id=self.task.task_id,
+            more_pending_status=more_pending_status,
+            debug=debug,
+        )
+        with self.telemetry.timer("dynamodb_lock"):
+            self.exec_ctx = lock_context.__enter__()
+        self._lock_context = lock_context
+
+    def start_with_lease(self, leaser: TaskLeaser):
+        """
+        批量加锁模式下, 从 ``leaser`` 中拿到这个任务预先获取的锁.
+        """
+        self.start_time = time.perf_counter()
+        with self.telemetry.timer("dynamodb_lock"):
+            claim = leaser.get(self.task)
+        self.exec_ctx = claim.exec_ctx
+        self.previous_status = claim.previous_status
+        self._is_leased = True
+
+    def _commit(self):
+        self._is_leased = False
+        if self.completion_batcher is None:
+            with self.telemetry.timer("dynamodb_unlock"):
+                errors = commit_tasks([self.exec_ctx])
+            if errors:
+                raise errors[0][1]
+        else:
+            self.completion_batcher.add(self.exec_ctx)
+
+    def succeed(self):
+        """
+        把任务标记为成功并释放锁. 如果任务已经被 :meth:`release_all` 交还了,
+        就什么也不做.
+        """
+        if self._is_released:
+            return
+        if self._is_leased:
+            set_succeeded(self.exec_ctx)
+            self._commit()
+            return
+        lock_context, self._lock_context = self._lock_context, None
+        with self.telemetry.timer("dynamodb_unlock"):
+            lock_context.__exit__(None, None, None)
+
+    def finish_with_pointer(self, pointer: SegmentPointer):
+        """
+        打包模式下, segment 写入 S3 之后, 把 DynamoDB item 中的 html 属性指向
+        segment 中的这个页面, 然后把任务标记为成功并释放锁.
+        """
+        with self.telemetry.timer("dynamodb_update"):
+            self.exec_ctx.task.update_html_pointer(
+                pointer.uri,
+                validators=self.validators,
+            )
+        self.succeed()
+
+    def finish_unchanged(self):
+        """
+        页面没有变化时, 只更新 DynamoDB 中的 validators, 然后把任务标记为成功并释放锁.
+        """
+        self.end_time = time.perf_counter()
+        with self.telemetry.timer("dynamodb_update"):
+            self.exec_ctx.task.update_validators(self.validators)
+        self.succeed()
+
+    def fail(self, e: Exception):
+        """
+        把任务标记为失败并释放锁. 如果还没有拿到锁, 就什么也不做.
+        """
+        if self._is_leased:
+            set_failed(self.exec_ctx, e)
+            self._commit()
+            return
+        if self._lock_context is None:
+            return
+        lock_context, self._lock_context = self._lock_context, None
+        with self.telemetry.timer("dynamodb_unlock"):
+            lock_context.__exit__(type(e), e, e.__traceback__)
+
+    @classmethod
+    def release_all(cls, job_list: T.Iterable["DownloadJob"]) -> int:
+        """
+        把还持有锁的任务恢复到获取锁之前的状态并释放锁, 不改变重试次数. 用于提前结束运行时
+        交还正在处理的任务, 下一次运行可以立刻重新处理它们, 不用等待锁过期. 之后这些任务的
+        :meth:`succeed` 和 :meth:`fail` 不会有任何效果.
+
+        :return: 交还了多少个任务.
+        """
+        exec_ctx_list = list()
+        for job in job_list:
+            if job._lock_context is None and not job._is_leased:
+                continue
+            job._lock_context = None
+            job._is_leased = False
+            job._is_released = True
+            set_released(job.exec_ctx, job.previous_status)
+            exec_ctx_list.append(job.exec_ctx)
+        n_released = 0
+        for i in range(0, len(exec_ctx_list), MAX_TRANSACTION_SIZE):
+            batch = exec_ctx_list[i : i + MAX_TRANSACTION_SIZE]
+            n_released += len(batch) - len(commit_tasks(batch))
+        return n_released
+
+    def append_to_segment(self, segment_writer: SegmentWriter, content: bytes):
+        """
+        打包模式下, 把压缩后的 HTML 追加到 segment 中. 任务的耗时到这里就结束了,
+        不包括在 segment 中等待写入 S3 的时间.
+        """
+        self.end_time = time.perf_counter()
+        segment_writer.append(self, key=self.task.key, content=content)
+
+    @property
+    def elapsed(self) -> T.Optional[float]:
+        if self.start_time is None:
+            return None
+        end_time = time.perf_counter() if self.end_time is None else self.end_time
+        return end_time - self.start_time
 
 
 class TaskJaJp(BaseTask):
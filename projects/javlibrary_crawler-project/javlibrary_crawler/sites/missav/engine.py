@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+基于 asyncio 的并发爬虫引擎.
+
+下载一个页面的时间主要花在等待网络 IO 上 (HTTP 请求, S3 put, DynamoDB update), 而这些
+IO 所用的库 (requests, boto3, pynamodb) 都是同步的. 所以我们用 asyncio 来做调度, 把每个
+task 放到线程池中执行, 同时保证:
+
+1. 同一时间最多只有 ``concurrency`` 个 task 在执行.
+2. 如果剩余时间不够处理一个 task 了, 就不再启动新的 task.
+
+对 missav.com 的请求频率由 :class:`~.rate_limiter.AdaptiveRateLimiter` 控制, 和并发数无关.
+"""
+
+import typing as T
+import time
+import asyncio
+import dataclasses
+import collections
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from ...utils import get_utc_now
+from ...logger import logger
+
+from .downloader import MalformedHtmlError
+
+
+T_TASK = T.TypeVar("T_TASK")
+
+
+def get_task_interval(
+    concurrency: int,
+    politeness_interval: float,
+    task_processing_time: float,
+) -> float:
+    """
+    估算在给定并发数下, 平均每隔多少秒能完成一个 task. 由于所有请求都是发往同一个 host 的,
+    所以不管并发数有多大, 这个值都不会小于两次请求之间的间隔 ``politeness_interval``.
+    """
+    return max(task_processing_time / concurrency, politeness_interval)
+
+
+@dataclasses.dataclass
+class CrawlResult:
+    """
+    一次爬虫运行的统计结果.
+
+    :param n_total: 一共拿到了多少个 task.
+    :param n_succeeded: 成功处理的 task 数量.
+    :param n_ignored: 因为可以忽略的错误 (例如 :class:`MalformedHtmlError`) 而失败的 task 数量.
+    :param is_time_up: 是否因为时间不够了而提前结束.
+    :param is_stopped: 是否因为 ``should_stop`` (例如收到 SIGTERM) 而提前结束.
+    :param elapsed: 总耗时 (秒).
+    """
+
+    n_total: int = dataclasses.field(default=0)
+    n_succeeded: int = dataclasses.field(default=0)
+    n_ignored: int = dataclasses.field(default=0)
+    is_time_up: bool = dataclasses.field(default=False)
+    is_stopped: bool = dataclasses.field(default=False)
+    elapsed: float = dataclasses.field(default=0.0)
+
+    @property
+    def n_not_started(self) -> int:
+        return self.n_total - self.n_succeeded - self.n_ignored
+
+    def log(self):
+        if self.is_time_up:
+            logger.info("Time is up!")
+        if self.is_stopped:
+            logger.info("Stopped before all tasks are processed!")
+        logger.info(
+            f"processed {self.n_succeeded + self.n_ignored}/{self.n_total} tasks "
+            f"in {self.elapsed:.2f} seconds, "
+            f"succeeded = {self.n_succeeded}, ignored = {self.n_ignored}"
+        )
+
+
+async def crawl_async(
+    task_list: T.Iterable[T_TASK],
+    process_task: T.Callable[[T_TASK], T.Any],
+    end_at: datetime,
+    concurrency: int = 1,
+    task_processing_time: float = 0,
+    ignore_errors: T.Tuple[T.Type[Exception], ...] = (MalformedHtmlError,),
+    now: T.Callable[[], datetime] = get_utc_now,
+    should_stop: T.Callable[[], bool] = lambda: False,
+) -> CrawlResult:
+    """
+    并发执行 ``task_list`` 中的所有 task, 直到全部完成或者时间用完为止.
+
+    :param task_list: 待处理的 task 列表.
+    :param process_task: 处理单个 task 的函数, 它会在线程池中执行, 所以可以是同步阻塞的.
+    :param end_at: 这次运行必须在这个时间之前结束.
+    :param concurrency: 最多同时执行多少个 task.
+    :param task_processing_time: 处理一个 task 所需的时间. 如果剩余时间小于这个值,
+        就不再启动新的 task.
+    :param ignore_errors: 遇到这些异常时只记录, 不会终止整个运行. 遇到其他异常时,
+        会停止启动新的 task, 等待正在执行的 task 结束后再将异常抛出.
+    :param now: 返回当前 UTC 时间的函数, 用于和 ``end_at`` 比较. 测试和 benchmark
+        可以传入自己的时钟.
+    :param should_stop: 每次开始一个新的 task 之前都会调用这个函数, 如果返回 True,
+        就不再启动新的 task, 等待正在执行的 task 结束后返回. 例如用来响应 SIGTERM,
+        见 :class:`~.drain.GracefulDrain`.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency has to be at least 1, got {concurrency}")
+    queue = collections.deque(task_list)
+    result = CrawlResult(n_total=len(queue))
+    errors: T.List[Exception] = list()
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+
+    async def worker(executor: ThreadPoolExecutor):
+        while queue and not errors:
+            how_many_time_left = (end_at - now()).total_seconds()
+            if how_many_time_left < task_processing_time:
+                result.is_time_up = True
+                return
+            if should_stop():
+                result.is_stopped = True
+                return
+            task = queue.popleft()
+            try:
+                await loop.run_in_executor(executor, process_task, task)
+                result.n_succeeded += 1
+            except ignore_errors:
+                result.n_ignored += 1
+            except Exception as e:
+                errors.append(e)
+                return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*[worker(executor) for _ in range(concurrency)])
+
+    result.elapsed = time.monotonic() - start
+    result.log()
+    if errors:
+        raise errors[0]
+    return result
+
+
+def crawl(
+    task_list: T.Iterable[T_TASK],
+    process_task: T.Callable[[T_TASK], T.Any],
+    end_at: datetime,
+    concurrency: int = 1,
+    task_processing_time: float = 0,
+    ignore_errors: T.Tuple[T.Type[Exception], ...] = (MalformedHtmlError,),
+    now: T.Callable[[], datetime] = get_utc_now,
+    should_stop: T.Callable[[], bool] = lambda: False,
+) -> CrawlResult:
+    """
+    :func:`crawl_async` 的同步版本.
+    """
+    return asyncio.run(
+        crawl_async(
+            task_list=task_list,
+            process_task=process_task,
+            end_at=end_at,
+            concurrency=concurrency,
+            task_processing_time=task_processing_time,
+            ignore_errors=ignore_errors,
+            now=now,
+            should_stop=should_stop,
+        )
+    )
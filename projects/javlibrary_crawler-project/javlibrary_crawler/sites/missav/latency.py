@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+记录每个下载任务的实际耗时, 并跨多次运行持久化到 S3 中.
+
+``constants.TASK_PROCESSING_TIME`` 只是一个静态的估计值. 实际的耗时会随着网站的响应速度,
+并发数, 限速器的速率而变化. 我们在每次运行结束时把这次运行的任务耗时和历史数据合并,
+只保留最近的 ``max_samples`` 个样本, 然后在下一次运行开始时用它们来:
+
+1. 用 p50 估算吞吐量, 决定从 DynamoDB 中读取多少个任务.
+2. 用 p95 作为 "还够不够处理一个任务" 的判断标准, 决定什么时候停止启动新任务.
+"""
+
+import typing as T
+import json
+import math
+import threading
+import dataclasses
+
+from s3pathlib import S3Path, ContentTypeEnum
+from boto_session_manager import BotoSesManager
+
+from ...logger import logger
+
+
+@dataclasses.dataclass
+class LatencyStats:
+    """
+    最近一段时间的任务耗时样本 (秒). 这个对象是线程安全的.
+
+    :param samples: 按时间顺序排列的耗时样本, 越新的样本越靠后.
+    :param max_samples: 最多保留多少个样本.
+    :param min_samples: 至少需要多少个样本才认为统计结果可信.
+    """
+
+    samples: T.List[float] = dataclasses.field(default_factory=list)
+    max_samples: int = dataclasses.field(default=1000)
+    min_samples: int = dataclasses.field(default=20)
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            if len(self.samples) > self.max_samples:
+                del self.samples[: len(self.samples) - self.max_samples]
+
+    def merge(self, other: "LatencyStats") -> "LatencyStats":
+        """
+        把 ``other`` 中的样本当作比自己更新的样本合并进来, 返回一个新的对象.
+        """
+        samples = (self.samples + other.samples)[-self.max_samples :]
+        return self.__class__(
+            samples=samples,
+            max_samples=self.max_samples,
+            min_samples=self.min_samples,
+        )
+
+    @property
+    def is_reliable(self) -> bool:
+        return len(self.samples) >= self.min_samples
+
+    def percentile(self, q: float) -> float:
+        """
+        计算第 q 百分位数 (0 <= q <= 100), 用线性插值, 和 ``numpy.percentile`` 的默认行为一致.
+        """
+        if not self.samples:
+            raise ValueError("no samples")
+        with self._lock:
+            data = sorted(self.samples)
+        rank = (len(data) - 1) * q / 100
+        low = math.floor(rank)
+        high = math.ceil(rank)
+        return data[low] + (data[high] - data[low]) * (rank - low)
+
+    @property
+    def p50(self) -> float:
+        return self.percentile(50)
+
+    @property
+    def p95(self) -> float:
+        return self.percentile(95)
+
+    @property
+    def p99(self) -> float:
+        return self.percentile(99)
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "max_samples": self.max_samples,
+            "min_samples": self.min_samples,
+            "samples": self.samples,
+        }
+
+    @classmethod
+    def from_dict(cls, dct: T.Dict[str, T.Any]) -> "LatencyStats":
+        return cls(
+            samples=dct["samples"],
+            max_samples=dct["max_samples"],
+            min_samples=dct["min_samples"],
+        )
+
+    @classmethod
+    def load(cls, s3path: S3Path, bsm: BotoSesManager) -> "LatencyStats":
+        """
+        从 S3 中读取历史数据, 如果还没有历史数据就返回一个空的对象.
+        """
+        if s3path.exists(bsm=bsm):
+            return cls.from_dict(json.loads(s3path.read_text(bsm=bsm)))
+        else:
+            return cls()
+
+    def dump(self, s3path: S3Path, bsm: BotoSesManager):
+        s3path.write_text(
+            json.dumps(self.to_dict()),
+            content_type=ContentTypeEnum.app_json,
+            bsm=bsm,
+        )
+
+    def estimate(
+        self,
+        default: float,
+    ) -> T.Tuple[float, float]:
+        """
+        估算一个任务的典型耗时和 "保险" 耗时.
+
+        :param default: 如果样本数量不够, 两个值都用这个默认值.
+
+        :return: (p50, p95)
+        """
+        if self.is_reliable:
+            p50, p95 = self.p50, self.p95
+            logger.info(
+                f"task latency from {len(self.samples)} samples: "
+                f"p50 = {p50:.2f}s, p95 = {p95:.2f}s, p99 = {self.p99:.2f}s"
+            )
+            return p50, p95
+        else:
+            logger.info(
+                f"only got {len(self.samples)} task latency samples, "
+                f"use default {default}s"
+            )
+            return default, default
@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+
+"""
+批量获取和提交 status tracker 任务的锁.
+
+``BaseTask.start`` 对每个任务都要访问两次 DynamoDB: 开始时用一次 conditional update 获取锁,
+结束时再用一次 update 更新状态并释放锁. 这两次往返都在处理任务的关键路径上. 这个模块把它们
+批量化:
+
+- :class:`TaskLeaser`: 按照任务列表的顺序, 每次预先获取 ``batch_size`` 个任务的锁.
+  一批任务的 conditional update 在线程池中同时执行 (见 :func:`claim_tasks`), 所以一批
+  任务只需要等待大约一次往返. 这里没有使用 TransactWriteItems, 因为只要有一个任务已经被
+  别的 worker 锁住了, 整个事务都会失败.
+- :class:`CompletionBatcher`: 收集已经结束的任务, 攒够 ``batch_size`` 个或者第一个任务
+  等待了 ``max_age`` 秒之后, 用一次 TransactWriteItems 提交它们的状态并释放锁
+  (见 :func:`commit_tasks`). 如果事务失败了 (例如某个任务的锁已经过期被别人拿走了),
+  就退回到逐个提交, 不影响其他任务.
+
+任务的状态变化和 ``BaseTask.start`` 完全一样: 成功时变为 succeeded, 失败时变为 failed,
+失败次数达到 ``max_retry`` 时变为 ignored. 预先获取了锁但是没有处理的任务 (例如时间到了)
+会在 :meth:`TaskLeaser.close` 中恢复到原来的状态并释放锁, 否则它们会一直停留在
+in_progress 状态, 再也不会被查询到.
+
+注意通过 ``status_and_update_time-index`` 查询到的任务只有 index 中投影的属性,
+``status`` 是 None. 所以 "原来的状态" 不能取自查询到的任务, 而是取自获取锁时 DynamoDB
+返回的旧的 item (见 :class:`Claim`).
+"""
+
+import typing as T
+import time
+import uuid
+import threading
+import traceback
+import dataclasses
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pynamodb_mate.api as pm
+from pynamodb.constants import ALL_OLD
+from pynamodb.exceptions import UpdateError
+
+from ...utils import get_utc_now
+from ...logger import logger
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .dynamodb import BaseTask
+
+st = pm.patterns.status_tracker
+
+# TransactWriteItems accepts at most 100 items
+MAX_TRANSACTION_SIZE = 100
+
+
+def _get_ready_to_start_status_list(
+    klass: T.Type["BaseTask"],
+    more_pending_status: T.Optional[T.Union[int, T.List[int]]] = None,
+) -> T.List[int]:
+    if more_pending_status is None:
+        more_pending_status = klass.config.more_pending_status
+    elif isinstance(more_pending_status, int):
+        more_pending_status = [more_pending_status]
+    return [
+        klass.config.pending_status,
+        klass.config.failed_status,
+        *more_pending_status,
+    ]
+
+
+@dataclasses.dataclass(frozen=True)
+class Claim:
+    """
+    成功获取了一个任务的锁.
+
+    :param exec_ctx: 获取锁之后的 ExecutionContext, 其中的任务是完整的 item.
+    :param previous_status: 获取锁之前的状态, 放弃这个任务时恢复到这个状态
+        (见 :func:`set_released`).
+    """
+
+    exec_ctx: st.ExecutionContext = dataclasses.field()
+    previous_status: int = dataclasses.field()
+
+
+def claim_task(
+    task: "BaseTask",
+    more_pending_status: T.Optional[T.Union[int, T.List[int]]] = None,
+) -> T.Optional[Claim]:
+    """
+    获取一个任务的锁, 并把状态设为 in_progress. 条件和 ``BaseTask.start`` 一样.
+
+    ``task`` 可以是从 index 中查询到的只有部分属性的任务. 这里让 DynamoDB 返回更新之前的
+    完整的 item, 从中拿到获取锁之前的状态, 再在本地应用这次更新, 得到更新之后的 item.
+
+    :return: 如果任务已经被锁住了, 或者状态不允许开始, 返回 None.
+    """
+    klass = task.__class__
+    lock = uuid.uuid4().hex
+    lock_time = get_utc_now()
+    value = klass.make_value(
+        status=klass.config.in_progress_status,
+        _task_id=task.task_id,
+    )
+    is_ready_to_start = None
+    for status in _get_ready_to_start_status_list(klass, more_pending_status):
+        condition = klass.status == status
+        is_ready_to_start = (
+            condition if is_ready_to_start is None else is_ready_to_start | condition
+        )
+    lock_expire_time = lock_time - timedelta(seconds=klass.config.lock_expire_seconds)
+    try:
+        res = klass._get_connection().update_item(
+            klass.make_key(task.task_id),
+            actions=[
+                klass.value.set(value),
+                klass.status.set(klass.config.in_progress_status),
+                klass.lock.set(lock),
+                klass.lock_time.set(lock_time),
+            ],
+            condition=(
+                (
+                    (klass.lock == klass.lock.default)
+                    | (klass.lock == lock)
+                    | (klass.lock_time < lock_expire_time)
+                )
+                & is_ready_to_start
+            ),
+            return_values=ALL_OLD,
+        )
+    except UpdateError as e:
+        if e.cause_response_code == "ConditionalCheckFailedException":
+            return None
+        raise e
+    claimed_task = klass.from_raw_data(res["Attributes"])
+    previous_status = claimed_task.status
+    claimed_task.value = value
+    claimed_task.status = klass.config.in_progress_status
+    claimed_task.lock = lock
+    claimed_task.lock_time = lock_time
+    return Claim(
+        exec_ctx=st.ExecutionContext(task=claimed_task),
+        previous_status=previous_status,
+    )
+
+
+def claim_tasks(
+    task_list: T.Sequence["BaseTask"],
+    more_pending_status: T.Optional[T.Union[int, T.List[int]]] = None,
+    max_workers: T.Optional[int] = None,
+) -> T.List[T.Optional[Claim]]:
+    """
+    用线程池同时获取一批任务的锁, 见 :func:`claim_task`. 任务可以来自不同的表.
+
+    :return: 和 ``task_list`` 一一对应的 :class:`Claim`, 没有拿到锁的任务对应 None.
+    """
+    if not task_list:
+        return []
+    if max_workers is None:
+        max_workers = len(task_list)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                lambda task: claim_task(task, more_pending_status),
+                task_list,
+            )
+        )
+
+
+def get_queried_status(task: "BaseTask") -> int:
+    """
+    返回查询到的任务的状态. 从 ``status_and_update_time-index`` 中查询到的任务的
+    ``status`` 是 None, 这时从 index 的 hash key ``value`` 中解析出状态.
+    """
+    if task.status is not None:
+        return task.status
+    return int(task.value.rsplit(task.config.sep, 2)[1])
+
+
+def set_succeeded(exec_ctx: st.ExecutionContext):
+    """
+    准备 "任务成功" 的更新, 和 ``BaseTask.start`` 正常退出时一样. 需要再调用
+    :func:`commit_tasks` 写入 DynamoDB.
+    """
+    klass = exec_ctx.task.__class__
+    with exec_ctx.begin_update():
+        exec_ctx._set_status(klass.config.succeeded_status)
+        exec_ctx._set_update_time()
+        exec_ctx._set_unlock()
+        exec_ctx._set_retry_as_zero()
+
+
+def set_failed(exec_ctx: st.ExecutionContext, e: Exception):
+    """
+    准备 "任务失败" 的更新, 和 ``BaseTask.start`` 遇到异常时一样: 重试次数加一, 记录错误,
+    达到 ``max_retry`` 时状态变为 ignored, 否则变为 failed.
+    """
+    task = exec_ctx.task
+    klass = task.__class__
+    update_time = get_utc_now()
+    errors = {"history": list(task.errors["history"])}
+    errors["history"].append(
+        {
+            "nth_retry": task.retry + 1,
+            "update_time": update_time.isoformat(),
+            "error": repr(e),
+            "traceback": "".join(
+                traceback.format_exception(
+                    type(e),
+                    e,
+                    e.__traceback__,
+                    limit=klass.config.traceback_stack_limit,
+                )
+            ),
+        }
+    )
+    with exec_ctx.begin_update():
+        exec_ctx._set_update_time(update_time)
+        exec_ctx._set_unlock()
+        exec_ctx._set_retry_plus_one()
+        exec_ctx._set_errors(errors)
+        if (task.retry + 1) >= klass.config.max_retry:
+            exec_ctx._set_status(klass.config.ignored_status)
+        else:
+            exec_ctx._set_status(klass.config.failed_status)
+
+
+def set_released(exec_ctx: st.ExecutionContext, status: int):
+    """
+    准备 "放弃这个任务" 的更新: 恢复到获取锁之前的状态 ``status`` 并释放锁,
+    不改变 update_time 和重试次数.
+    """
+    with exec_ctx.begin_update():
+        exec_ctx._set_status(status)
+        exec_ctx._set_unlock()
+
+
+def _commit_one(exec_ctx: st.ExecutionContext) -> T.Optional[Exception]:
+    try:
+        exec_ctx.update()
+    except Exception as e:
+        logger.error(f"failed to commit task {exec_ctx.task.task_id!r}: {e!r}")
+        return e
+    return None
+
+
+def commit_tasks(
+    exec_ctx_list: T.Sequence[st.ExecutionContext],
+) -> T.List[T.Tuple[st.ExecutionContext, Exception]]:
+    """
+    用一次 TransactWriteItems 把一批任务的更新写入 DynamoDB. 每个更新的条件都是锁没有
+    被别人拿走. 任务可以来自不同的表. 如果事务失败了, 就逐个提交.
+
+    :return: 提交失败的任务和对应的异常.
+    """
+    if not exec_ctx_list:
+        return []
+    if len(exec_ctx_list) > MAX_TRANSACTION_SIZE:
+        raise ValueError(
+            f"can't commit more than {MAX_TRANSACTION_SIZE} tasks at once, "
+            f"got {len(exec_ctx_list)}"
+        )
+    connection = exec_ctx_list[0].task.__class__._get_connection().connection
+    try:
+        with pm.TransactWrite(connection=connection) as transaction:
+            for exec_ctx in exec_ctx_list:
+                klass = exec_ctx.task.__class__
+                transaction.update(
+                    exec_ctx.task,
+                    actions=exec_ctx.to_update_actions(),
+                    condition=klass.lock == exec_ctx.task.lock,
+                )
+        return []
+    except Exception as e:
+        logger.info(f"transaction failed, commit tasks one by one: {e!r}")
+    with ThreadPoolExecutor(max_workers=len(exec_ctx_list)) as executor:
+        errors = list(executor.map(_commit_one, exec_ctx_list))
+    return [
+        (exec_ctx, error)
+        for exec_ctx, error in zip(exec_ctx_list, errors)
+        if error is not None
+    ]
+
+
+@dataclasses.dataclass
+class TaskLeaser:
+    """
+    按照 ``task_list`` 的顺序, 每次预先获取 ``batch_size`` 个任务的锁. 这个对象是线程安全的.
+    用法::
+
+        leaser = TaskLeaser(task_list=task_list, batch_size=10)
+        try:
+            for task in task_list:
+                exec_ctx = leaser.get(task).exec_ctx
+                ...
+        finally:
+            leaser.close(batcher)
+
+    注意预先获取的锁从获取的时候就开始计时了, 所以 ``batch_size`` 不能太大, 要保证一批
+    任务能在锁过期之前开始处理.
+
+    :param task_list: 待处理的任务, 通常是查询出来的任务列表.
+    :param batch_size: 每次获取多少个任务的锁.
+    :param more_pending_status: 除了 pending 和 failed 以外, 还允许从哪个状态开始,
+        和 ``BaseTask.start`` 的同名参数一样.
+    """
+
+    task_list: T.Sequence["BaseTask"] = dataclasses.field(repr=False)
+    batch_size: int = dataclasses.field(default=10)
+    more_pending_status: T.Optional[T.Union[int, T.List[int]]] = dataclasses.field(
+        default=None
+    )
+
+    n_claimed: int = dataclasses.field(default=0, init=False)
+    n_rejected: int = dataclasses.field(default=0, init=False)
+    n_released: int = dataclasses.field(default=0, init=False)
+    _position: T.Dict[T.Tuple[str, str], int] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _next: int = dataclasses.field(default=0, init=False, repr=False)
+    # (table name, task id) -> claim, None if the claim is rejected
+    _leases: T.Dict[T.Tuple[str, str], T.Optional[Claim]] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if self.batch_size < 1:
+            raise ValueError(f"batch_size has to be at least 1, got {self.batch_size}")
+        for ith, task in enumerate(self.task_list):
+            self._position[self._get_key(task)] = ith
+
+    @staticmethod
+    def _get_key(task: "BaseTask") -> T.Tuple[str, str]:
+        return (task.Meta.table_name, task.key)
+
+    def _claim_next_batch(self):
+        task_list = self.task_list[self._next : self._next + self.batch_size]
+        self._next += len(task_list)
+        claim_list = claim_tasks(task_list, self.more_pending_status)
+        for task, claim in zip(task_list, claim_list):
+            self._leases[self._get_key(task)] = claim
+            if claim is None:
+                self.n_rejected += 1
+            else:
+                self.n_claimed += 1
+
+    def get(self, task: "BaseTask") -> Claim:
+        """
+        返回这个任务的 :class:`Claim`. 如果还没有获取这个任务的锁, 就从它开始获取下一批.
+
+        :raises TaskIsNotReadyToStartError: 没有拿到锁, 和 ``BaseTask.start`` 一样.
+        """
+        key = self._get_key(task)
+        with self._lock:
+            if key not in self._leases:
+                # skip the tasks before this one, they are never asked for
+                self._next = max(self._next, self._position[key])
+                self._claim_next_batch()
+            claim = self._leases.pop(key)
+        if claim is None:
+            raise st.TaskIsNotReadyToStartError.make(
+                use_case_id=task.config.use_case_id,
+                task_id=task.task_id,
+            )
+        return claim
+
+    def close(self, batcher: T.Optional["CompletionBatcher"] = None):
+        """
+        把预先获取了锁但是没有处理的任务恢复到原来的状态并释放锁.
+
+        :param batcher: 如果给定, 用它来提交, 否则直接提交.
+        """
+        with self._lock:
+            leases, self._leases = self._leases, dict()
+        exec_ctx_list = list()
+        for claim in leases.values():
+            if claim is not None:
+                set_released(claim.exec_ctx, claim.previous_status)
+                exec_ctx_list.append(claim.exec_ctx)
+        self.n_released += len(exec_ctx_list)
+        if exec_ctx_list:
+            logger.info(f"release {len(exec_ctx_list)} unprocessed tasks")
+        for exec_ctx in exec_ctx_list:
+            if batcher is None:
+                _commit_one(exec_ctx)
+            else:
+                batcher.add(exec_ctx)
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "batch_size": self.batch_size,
+            "n_claimed": self.n_claimed,
+            "n_rejected": self.n_rejected,
+            "n_released": self.n_released,
+        }
+
+
+@dataclasses.dataclass
+class CompletionBatcher:
+    """
+    收集已经准备好更新 (见 :func:`set_succeeded`, :func:`set_failed`) 的任务, 攒够
+    ``batch_size`` 个或者第一个任务等待了 ``max_age`` 秒之后, 用 :func:`commit_tasks`
+    一次提交. 这个对象是线程安全的. 用法::
+
+        with CompletionBatcher(batch_size=25, max_age=5) as batcher:
+            set_succeeded(exec_ctx)
+            batcher.add(exec_ctx)
+
+    由于任务的锁在提交之前不会释放, ``max_age`` 必须比锁的过期时间短.
+
+    :param batch_size: 每次最多提交多少个任务, 不能超过 100.
+    :param max_age: 第一个任务最多等待多少秒.
+    :param clock: 返回当前时间 (秒) 的函数, 用于测试.
+    """
+
+    batch_size: int = dataclasses.field(default=25)
+    max_age: float = dataclasses.field(default=5)
+    clock: T.Callable[[], float] = dataclasses.field(default=time.monotonic, repr=False)
+
+    n_batch: int = dataclasses.field(default=0, init=False)
+    n_committed: int = dataclasses.field(default=0, init=False)
+    n_error: int = dataclasses.field(default=0, init=False)
+    _pending: T.List[st.ExecutionContext] = dataclasses.field(
+        default_factory=list, init=False, repr=False
+    )
+    _opened_at: float = dataclasses.field(default=0.0, init=False, repr=False)
+    _closed: bool = dataclasses.field(default=False, init=False, repr=False)
+    _cond: threading.Condition = dataclasses.field(
+        default_factory=threading.Condition, init=False, repr=False
+    )
+    _flush_lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+    _thread: T.Optional[threading.Thread] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if not (1 <= self.batch_size <= MAX_TRANSACTION_SIZE):
+            raise ValueError(
+                f"batch_size has to be in [1, {MAX_TRANSACTION_SIZE}], "
+                f"got {self.batch_size}"
+            )
+
+    def add(self, exec_ctx: st.ExecutionContext):
+        """
+        添加一个准备好更新的任务. 如果攒够了 ``batch_size`` 个, 在当前线程中提交.
+        """
+        with self._cond:
+            if not self._pending:
+                self._opened_at = self.clock()
+                self._cond.notify_all()
+            self._pending.append(exec_ctx)
+            is_full = len(self._pending) >= self.batch_size
+        if is_full:
+            self.flush()
+
+    def flush(self):
+        """
+        提交所有等待中的任务.
+        """
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = self._pending[: self.batch_size]
+                    self._pending = self._pending[self.batch_size :]
+                    if self._pending:
+                        self._opened_at = self.clock()
+                if not batch:
+                    return
+                errors = commit_tasks(batch)
+                self.n_batch += 1
+                self.n_committed += len(batch) - len(errors)
+                self.n_error += len(errors)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                remaining = self._opened_at + self.max_age - self.clock()
+                if remaining > 0:
+                    self._cond.wait(timeout=remaining)
+                    continue
+            self.flush()
+
+    def start(self):
+        """
+        启动后台线程, 提交等待时间超过 ``max_age`` 的任务.
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="completion-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def close(self):
+        """
+        停止后台线程, 并提交剩下的任务.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self) -> "CompletionBatcher":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "n_batch": self.n_batch,
+            "n_committed": self.n_committed,
+            "n_error": self.n_error,
+        }
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+多阶段流水线.
+
+一个下载任务由几个串行的步骤组成: 下载 HTML, 压缩, 写入 S3, 更新 DynamoDB. 如果每个任务
+都从头到尾串行执行, 那么在上传 S3 和更新 DynamoDB 的时候, 网络带宽和下一次 HTTP 请求都
+是空闲的. 这个模块把每个步骤变成一个 :class:`Stage`, 每个 stage 有自己的 worker 线程,
+stage 之间用有界队列连接:
+
+- 每个 stage 的 worker 数量可以单独设定, 例如 HTTP 下载 1 个, S3 上传 2 个.
+- 队列满了以后上游的 worker 会阻塞 (backpressure), 所以在途的任务数量是有上限的.
+"""
+
+import typing as T
+import time
+import queue
+import threading
+import dataclasses
+from datetime import datetime
+
+from ...utils import get_utc_now
+from ...logger import logger
+
+from .downloader import MalformedHtmlError
+from .engine import CrawlResult
+
+T_ITEM = T.TypeVar("T_ITEM")
+
+_STOP = object()
+
+
+@dataclasses.dataclass
+class Stage:
+    """
+    流水线中的一个阶段.
+
+    :param name: stage 的名字, 用于日志.
+    :param func: 处理一个 item 的函数, 返回值会被传给下一个 stage.
+    :param n_worker: 这个 stage 有多少个 worker 线程.
+    """
+
+    name: str = dataclasses.field()
+    func: T.Callable[[T.Any], T.Any] = dataclasses.field()
+    n_worker: int = dataclasses.field(default=1)
+
+
+def run_pipeline(
+    items: T.Iterable[T_ITEM],
+    stages: T.List[Stage],
+    queue_size: int = 4,
+    is_time_up: T.Callable[[], bool] = lambda: False,
+    should_stop: T.Callable[[], bool] = lambda: False,
+    on_success: T.Optional[T.Callable[[T.Any], T.Any]] = None,
+    on_error: T.Optional[T.Callable[[T.Any, Exception], T.Any]] = None,
+    ignore_errors: T.Tuple[T.Type[Exception], ...] = (MalformedHtmlError,),
+) -> CrawlResult:
+    """
+    让所有的 item 依次通过所有的 stage.
+
+    :param items: 输入的 item 列表.
+    :param stages: 按顺序排列的 stage 列表.
+    :param queue_size: 每个 stage 的输入队列最多能放多少个 item.
+    :param is_time_up: 第一个 stage 在开始处理每个 item 之前都会调用这个函数,
+        如果返回 True, 就不再处理剩下的 item, 并设置 ``result.is_time_up``.
+        通常是 :func:`make_deadline_checker` 创建的函数.
+    :param should_stop: 和 ``is_time_up`` 一样, 但设置的是 ``result.is_stopped``.
+        例如用来响应 SIGTERM, 见 :class:`~.drain.GracefulDrain`.
+    :param on_success: 一个 item 通过最后一个 stage 之后会调用这个函数.
+    :param on_error: 一个 item 在任何一个 stage 失败时会调用这个函数, 例如用来释放锁.
+        失败的 item 不会再进入下一个 stage.
+    :param ignore_errors: 遇到这些异常时只记录. 遇到其他异常时, 会停止处理新的 item,
+        等待已经开始的 item 全部结束后再将异常抛出.
+    """
+    if not stages:
+        raise ValueError("stages cannot be empty")
+    item_list = list(items)
+    result = CrawlResult(n_total=len(item_list))
+    errors: T.List[Exception] = list()
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    n_running = [stage.n_worker for stage in stages]
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def is_done() -> bool:
+        if errors:
+            return True
+        if is_time_up():
+            with lock:
+                result.is_time_up = True
+            return True
+        if should_stop():
+            with lock:
+                result.is_stopped = True
+            return True
+        return False
+
+    def handle_error(item, e: Exception):
+        try:
+            if on_error is not None:
+                on_error(item, e)
+        except Exception as e_on_error:  # pragma: no cover
+            with lock:
+                errors.append(e_on_error)
+        with lock:
+            if isinstance(e, ignore_errors):
+                result.n_ignored += 1
+            else:
+                errors.append(e)
+
+    def worker(ith: int):
+        stage = stages[ith]
+        q_in = queues[ith]
+        q_out = queues[ith + 1] if ith + 1 < len(stages) else None
+        while True:
+            item = q_in.get()
+            if item is _STOP:
+                break
+            # only the first stage decides whether to start a new item
+            if ith == 0 and is_done():
+                continue
+            try:
+                output = stage.func(item)
+            except Exception as e:
+                handle_error(item, e)
+                continue
+            if q_out is None:
+                try:
+                    if on_success is not None:
+                        on_success(output)
+                except Exception as e:  # pragma: no cover
+                    handle_error(output, e)
+                    continue
+                with lock:
+                    result.n_succeeded += 1
+            else:
+                q_out.put(output)
+        # the last worker of this stage tells the next stage to stop
+        with lock:
+            n_running[ith] -= 1
+            is_last = n_running[ith] == 0
+        if is_last and q_out is not None:
+            for _ in range(stages[ith + 1].n_worker):
+                q_out.put(_STOP)
+
+    thread_list = [
+        threading.Thread(
+            target=worker,
+            args=(ith,),
+            name=f"pipeline-{stage.name}-{i}",
+            daemon=True,
+        )
+        for ith, stage in enumerate(stages)
+        for i in range(stage.n_worker)
+    ]
+    for thread in thread_list:
+        thread.start()
+
+    # feed the first stage, it blocks when the first queue is full
+    for item in item_list:
+        if is_done():
+            break
+        queues[0].put(item)
+    for _ in range(stages[0].n_worker):
+        queues[0].put(_STOP)
+
+    for thread in thread_list:
+        thread.join()
+
+    result.elapsed = time.monotonic() - start
+    result.log()
+    if errors:
+        raise errors[0]
+    return result
+
+
+def make_deadline_checker(
+    end_at: datetime,
+    task_processing_time: float,
+    now: T.Callable[[], datetime] = get_utc_now,
+) -> T.Callable[[], bool]:
+    """
+    创建一个 ``is_time_up`` 函数, 当剩余时间不够处理一个任务时返回 True.
+
+    :param now: 返回当前 UTC 时间的函数.
+    """
+
+    def is_time_up() -> bool:
+        return (end_at - now()).total_seconds() < task_processing_time
+
+    return is_time_up
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+并行查询 status GSI 的所有 shard.
+
+``pynamodb_mate`` 的 ``BaseTask.query_for_unfinished`` 会按顺序依次查询 pending 和
+failed 这两个 status 的每一个 shard (在 :func:`~.dynamodb.make_config` 中一共是
+10 + 5 = 15 个), 所以在开始处理第一个任务之前需要等待 15 次查询的往返时间. 这个模块把
+每个 shard 的查询放到线程池中同时执行, 然后按照 ``update_time`` 把结果归并起来,
+总的等待时间约等于一次查询的往返时间.
+
+**Worker 分片**
+
+如果同时运行多个爬虫 (例如 GitHub Action 的 matrix, 或者本地的多个进程), 它们都查询所有的
+shard 的话会拿到同样的任务, 然后在 ``BaseTask.start`` 获取锁的时候互相冲突. 所以每个
+查询函数都有 ``worker_index`` 和 ``n_worker`` 参数, 第 i 个 worker 只查询
+``(shard_id - 1) % n_worker == i`` 的 shard. 不同的 worker 查询的 shard 互不相交,
+所以不会拿到同一个任务.
+"""
+
+import typing as T
+import heapq
+from concurrent.futures import ThreadPoolExecutor, Future
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from .dynamodb import BaseTask
+
+
+T_TASK = T.TypeVar("T_TASK", bound="BaseTask")
+
+
+def validate_worker(worker_index: int, n_worker: int):
+    if n_worker < 1:
+        raise ValueError(f"n_worker has to be at least 1, got {n_worker}")
+    if not (0 <= worker_index < n_worker):
+        raise ValueError(
+            f"worker_index has to be in [0, {n_worker}), got {worker_index}"
+        )
+
+
+def get_status_shard_list(
+    klass: T.Type["BaseTask"],
+    status_list: T.Iterable[int],
+    worker_index: int = 0,
+    n_worker: int = 1,
+) -> T.List[T.Tuple[int, int]]:
+    """
+    列出给定的 status 对应的所有 (status, shard_id). shard_id 从 1 开始.
+
+    :param worker_index: 当前 worker 的编号, 从 0 开始.
+    :param n_worker: 一共有多少个 worker. 每个 status 的 shard 按照
+        ``(shard_id - 1) % n_worker`` 分给各个 worker, 只返回属于当前 worker 的 shard.
+        如果 ``n_worker`` 比某个 status 的 shard 数量还多, 有的 worker 不会分到这个
+        status 的 shard.
+    """
+    validate_worker(worker_index, n_worker)
+    return [
+        (status, shard_id)
+        for status in status_list
+        for shard_id in range(1, 1 + klass.config.status_shards[status])
+        if (shard_id - 1) % n_worker == worker_index
+    ]
+
+
+def _query_one_shard(
+    klass: T.Type[T_TASK],
+    status: int,
+    shard_id: int,
+    limit: int,
+    older_task_first: bool,
+) -> T.List[T_TASK]:
+    index = klass._get_status_index()
+    return list(
+        index.query(
+            hash_key=klass.make_value(status=status, _shard_id=shard_id),
+            scan_index_forward=older_task_first,
+            limit=limit,
+        )
+    )
+
+
+def _iter_future(future: "Future[T.List[T_TASK]]") -> T.Iterator[T_TASK]:
+    yield from future.result()
+
+
+def query_by_status_in_parallel(
+    klass: T.Type[T_TASK],
+    status_list: T.Iterable[int],
+    limit: int = 10,
+    older_task_first: bool = True,
+    max_workers: T.Optional[int] = None,
+    worker_index: int = 0,
+    n_worker: int = 1,
+) -> T.Iterator[T_TASK]:
+    """
+    同时查询所有给定 status 的所有 shard, 并按照 ``update_time`` 归并排序.
+
+    :param klass: DynamoDB ORM 类, 例如 :class:`~.dynamodb.DownloadZhCN`.
+    :param status_list: 要查询的 status code 列表.
+    :param limit: 每个 shard 最多返回多少个任务.
+    :param older_task_first: True 表示按照 update_time 从旧到新排序, False 反之.
+    :param max_workers: 线程池的大小, 默认等于 shard 的数量.
+    :param worker_index: 见 :func:`get_status_shard_list`.
+    :param n_worker: 见 :func:`get_status_shard_list`.
+
+    :return: 一个按照 update_time 排好序的迭代器.
+    """
+    status_shard_list = get_status_shard_list(
+        klass,
+        status_list,
+        worker_index=worker_index,
+        n_worker=n_worker,
+    )
+    if not status_shard_list:
+        return
+    if max_workers is None:
+        max_workers = len(status_shard_list)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_list = [
+            executor.submit(
+                _query_one_shard,
+                klass,
+                status,
+                shard_id,
+                limit,
+                older_task_first,
+            )
+            for status, shard_id in status_shard_list
+        ]
+        # 每个 shard 的结果已经按照 update_time 排好序了, 所以可以直接用 heapq.merge
+        yield from heapq.merge(
+            *[_iter_future(future) for future in future_list],
+            key=lambda task: task.update_time,
+            reverse=not older_task_first,
+        )
+
+
+def query_for_unfinished_in_parallel(
+    klass: T.Type[T_TASK],
+    limit: int = 10,
+    older_task_first: bool = True,
+    max_workers: T.Optional[int] = None,
+    worker_index: int = 0,
+    n_worker: int = 1,
+) -> T.Iterator[T_TASK]:
+    """
+    :func:`query_by_status_in_parallel` 的快捷方式, 查询 pending 和 failed 的任务.
+    和 ``BaseTask.query_for_unfinished`` 的参数含义一致.
+    """
+    return query_by_status_in_parallel(
+        klass=klass,
+        status_list=[
+            klass.config.pending_status,
+            klass.config.failed_status,
+        ],
+        limit=limit,
+        older_task_first=older_task_first,
+        max_workers=max_workers,
+        worker_index=worker_index,
+        n_worker=n_worker,
+    )
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+自适应的令牌桶限速器.
+
+我们不知道 missav.com 能容忍多快的请求频率, 所以不用一个写死的间隔, 而是用 AIMD
+(Additive Increase, Multiplicative Decrease) 策略动态调整速率:
+
+- 每次请求成功, 速率增加一个固定值 ``increase``.
+- 每次遇到 429, 5xx 或者网络错误, 速率乘以 ``decrease_factor``.
+
+这和 TCP 拥塞控制的思路一样, 速率会在网站能容忍的上限附近来回波动.
+"""
+
+import typing as T
+import time
+import threading
+import dataclasses
+
+from ...logger import logger
+
+
+@dataclasses.dataclass
+class AdaptiveRateLimiter:
+    """
+    线程安全的令牌桶限速器, 所有共享这个对象的线程加在一起的请求频率不会超过 ``rate``.
+
+    :param rate: 初始速率, 每秒允许多少个请求.
+    :param min_rate: 速率下限.
+    :param max_rate: 速率上限.
+    :param increase: 每次成功后速率增加多少.
+    :param decrease_factor: 每次被限流后速率乘以多少.
+    :param burst: 令牌桶的容量, 也就是空闲一段时间后最多允许连续发出多少个请求.
+    :param cooldown: 两次降速之间至少间隔多少秒. 同一波失败通常会连续报告好几次,
+        只降速一次就够了.
+    :param clock: 返回当前时间 (秒) 的函数, 用于测试.
+    :param sleep: 用于等待的函数, 用于测试.
+    """
+
+    rate: float = dataclasses.field(default=1.0)
+    min_rate: float = dataclasses.field(default=0.2)
+    max_rate: float = dataclasses.field(default=8.0)
+    increase: float = dataclasses.field(default=0.05)
+    decrease_factor: float = dataclasses.field(default=0.5)
+    burst: float = dataclasses.field(default=1.0)
+    cooldown: float = dataclasses.field(default=2.0)
+    clock: T.Callable[[], float] = dataclasses.field(
+        default=time.monotonic, repr=False
+    )
+    sleep: T.Callable[[float], T.Any] = dataclasses.field(
+        default=time.sleep, repr=False
+    )
+
+    n_success: int = dataclasses.field(default=0, init=False)
+    n_throttle: int = dataclasses.field(default=0, init=False)
+    _tokens: float = dataclasses.field(init=False, repr=False)
+    _last_refill: float = dataclasses.field(init=False, repr=False)
+    _last_decrease: float = dataclasses.field(init=False, repr=False)
+    _last_logged_rate: float = dataclasses.field(init=False, repr=False)
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        if not (0 < self.min_rate <= self.rate <= self.max_rate):
+            raise ValueError(
+                f"expect 0 < min_rate <= rate <= max_rate, "
+                f"got {self.min_rate}, {self.rate}, {self.max_rate}"
+            )
+        now = self.clock()
+        self._tokens = self.burst
+        self._last_refill = now
+        self._last_decrease = now - self.cooldown
+        self._last_logged_rate = self.rate
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def acquire(self) -> float:
+        """
+        拿一个令牌, 如果没有令牌就阻塞等待.
+
+        :return: 实际等待的秒数.
+        """
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def on_success(self):
+        """
+        报告一次成功的请求, 速率增加 ``increase``.
+        """
+        with self._lock:
+            self.n_success += 1
+            self._refill(self.clock())
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            if self.rate >= self._last_logged_rate * 1.1:
+                self._log_rate(reason="success")
+
+    def on_throttle(self, reason: str):
+        """
+        报告一次被限流 (429, 5xx, 网络错误) 的请求, 速率乘以 ``decrease_factor``.
+
+        :param reason: 被限流的原因, 会打印在日志中.
+        """
+        with self._lock:
+            self.n_throttle += 1
+            now = self.clock()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._log_rate(reason=reason)
+
+    def _log_rate(self, reason: str):
+        logger.info(
+            f"rate limiter: {self._last_logged_rate:.2f} -> {self.rate:.2f} req/s "
+            f"({reason}), success = {self.n_success}, throttle = {self.n_throttle}"
+        )
+        self._last_logged_rate = self.rate
+
+    @property
+    def interval(self) -> float:
+        """
+        当前速率下, 两次请求之间的平均间隔秒数.
+        """
+        return 1.0 / self.rate
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "rate": self.rate,
+            "n_success": self.n_success,
+            "n_throttle": self.n_throttle,
+        }
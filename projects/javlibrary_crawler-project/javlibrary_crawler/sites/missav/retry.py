@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+知道截止时间的重试策略.
+
+原来的 ``do_download_task`` 用 tenacity 对 :class:`~.downloader.HttpError` 最多重试
+10 次, 每次最多等待 60 秒. 这有两个问题:
+
+1. 一个坏掉的 URL 可能耗掉好几分钟, 而一次运行只有 870 秒.
+2. 重试的时间可能超过任务的锁的有效期 (``lock_expire_seconds``), 这时候另一个 worker
+   可能已经拿到了同一个任务的锁.
+
+:class:`RetryPolicy` 在每次重试之前都会检查 "等待 + 再尝试一次" 是否会超过截止时间
+(任务的锁过期的时间和这次运行结束的时间中更早的那个). 如果会超过, 就放弃重试, 抛出
+:class:`RetryGiveUpError`, 任务会被标记为失败, 留给下一次运行处理.
+
+:class:`RetryBudget` 是整个运行共享的重试预算. 重试的次数不能超过请求次数的一定比例,
+这样一段时间内网站不稳定, 也不会让重试把所有的时间都占用掉. 预算用完之后不再重试,
+而是抛出 :class:`RetryGiveUpError`, 只有当前的任务会被标记为失败, 其他任务照常处理.
+网站真的挂了的情况由 :class:`~.circuit_breaker.CircuitBreaker` 负责停止这次运行.
+
+重试次数用完, 或者遇到重试也不会成功的 4xx 错误 (例如 404) 时, 同样抛出
+:class:`RetryGiveUpError`.
+"""
+
+import typing as T
+import time
+import threading
+import dataclasses
+from datetime import datetime, timedelta
+
+from ...utils import get_utc_now
+from ...logger import logger
+
+from .downloader import HttpError
+
+
+class RetryGiveUpError(Exception):
+    """
+    因为重试次数用完, 剩余时间不够, 重试预算用完, 或者错误不值得重试而放弃重试时
+    抛出这个异常.
+    原始的异常可以通过 ``__cause__`` 获取.
+    """
+
+    pass
+
+
+@dataclasses.dataclass
+class RetryBudget:
+    """
+    整个运行共享的重试预算, 线程安全. 允许的重试次数为
+    ``min_retries + ratio * n_request``.
+
+    :param ratio: 重试次数最多是请求次数的多少倍.
+    :param min_retries: 不管请求次数是多少, 都允许的重试次数.
+    """
+
+    ratio: float = dataclasses.field(default=0.2)
+    min_retries: int = dataclasses.field(default=10)
+
+    n_request: int = dataclasses.field(default=0, init=False)
+    n_retry: int = dataclasses.field(default=0, init=False)
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def record_request(self):
+        """
+        报告一次新的请求 (不包括重试).
+        """
+        with self._lock:
+            self.n_request += 1
+
+    def try_spend(self) -> bool:
+        """
+        尝试花掉一次重试的预算, 如果预算已经用完返回 False.
+        """
+        with self._lock:
+            if self.n_retry >= self.min_retries + self.ratio * self.n_request:
+                return False
+            self.n_retry += 1
+            return True
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "n_request": self.n_request,
+            "n_retry": self.n_retry,
+        }
+
+
+T_RESULT = T.TypeVar("T_RESULT")
+
+# these 4xx status codes may succeed on retry, the other 4xx won't
+RETRYABLE_4XX_STATUS_CODES = (408, 429)
+
+
+def is_retryable(e: Exception) -> bool:
+    """
+    判断一个 ``retry_on`` 中的异常是否值得重试. 除了 408 和 429 以外的 4xx
+    :class:`~.downloader.HttpError` (例如 404) 重试也不会成功.
+    """
+    if isinstance(e, HttpError) and e.status_code is not None:
+        if 400 <= e.status_code < 500:
+            return e.status_code in RETRYABLE_4XX_STATUS_CODES
+    return True
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """
+    指数退避的重试策略, 第 n 次重试之前等待 ``multiplier * 2 ** (n - 1)`` 秒,
+    并限制在 ``[min_wait, max_wait]`` 之间. 这和原来的
+    ``wait_exponential(multiplier=1, min=2, max=60)`` 一致.
+
+    :param max_attempts: 最多尝试多少次 (包括第一次).
+    :param multiplier: 等待时间的系数.
+    :param min_wait: 最少等待多少秒.
+    :param max_wait: 最多等待多少秒.
+    :param attempt_time: 估计的一次尝试的耗时 (秒), 包括后续写入 S3 和 DynamoDB 的时间.
+        只有 "等待 + attempt_time" 不超过截止时间时才会重试.
+    :param retry_on: 遇到这些异常时才重试, 但是不重试 :func:`is_retryable` 返回 False 的异常.
+    :param budget: 整个运行共享的重试预算. 预算用完时抛出 :class:`RetryGiveUpError`.
+    :param now: 返回当前 UTC 时间的函数, 用于测试.
+    :param sleep: 用于等待的函数, 用于测试.
+    """
+
+    max_attempts: int = dataclasses.field(default=10)
+    multiplier: float = dataclasses.field(default=1)
+    min_wait: float = dataclasses.field(default=2)
+    max_wait: float = dataclasses.field(default=60)
+    attempt_time: float = dataclasses.field(default=10)
+    retry_on: T.Tuple[T.Type[Exception], ...] = dataclasses.field(default=(HttpError,))
+    budget: T.Optional[RetryBudget] = dataclasses.field(default=None)
+    now: T.Callable[[], datetime] = dataclasses.field(default=get_utc_now, repr=False)
+    sleep: T.Callable[[float], T.Any] = dataclasses.field(
+        default=time.sleep, repr=False
+    )
+
+    def get_wait(self, n_retry: int) -> float:
+        """
+        第 ``n_retry`` 次重试 (从 1 开始) 之前需要等待的秒数.
+        """
+        wait = self.multiplier * 2 ** (n_retry - 1)
+        return max(self.min_wait, min(self.max_wait, wait))
+
+    def call(
+        self,
+        func: T.Callable[[], T_RESULT],
+        deadline: T.Optional[datetime] = None,
+    ) -> T_RESULT:
+        """
+        执行 ``func``, 遇到 ``retry_on`` 中的异常时按照策略重试.
+
+        :param func: 要执行的函数, 没有参数.
+        :param deadline: 截止时间, 不会在这个时间之后开始新的尝试.
+
+        :raises RetryGiveUpError: 尝试了 ``max_attempts`` 次仍然失败, 剩余时间不够再尝试
+            一次, 重试预算用完了, 或者错误不值得重试. 原始的异常在 ``__cause__`` 中.
+        """
+        if self.budget is not None:
+            self.budget.record_request()
+        n_retry = 0
+        while True:
+            try:
+                return func()
+            except self.retry_on as e:
+                n_retry += 1
+                if is_retryable(e) is False:
+                    raise RetryGiveUpError(
+                        f"give up retry after {n_retry} attempts, "
+                        f"{e!r} is not retryable"
+                    ) from e
+                if n_retry >= self.max_attempts:
+                    raise RetryGiveUpError(
+                        f"give up retry after {n_retry} attempts, "
+                        "max attempts reached"
+                    ) from e
+                wait = self.get_wait(n_retry)
+                if deadline is not None:
+                    next_attempt_end = self.now() + timedelta(
+                        seconds=wait + self.attempt_time
+                    )
+                    if next_attempt_end > deadline:
+                        raise RetryGiveUpError(
+                            f"give up retry after {n_retry} attempts, "
+                            f"not enough time left before {deadline}"
+                        ) from e
+                if self.budget is not None and self.budget.try_spend() is False:
+                    logger.info(f"retry budget exhausted: {self.budget.to_dict()}")
+                    raise RetryGiveUpError(
+                        f"give up retry after {n_retry} attempts, "
+                        "retry budget exhausted"
+                    ) from e
+                logger.info(f"retry #{n_retry} in {wait:.1f} seconds, error: {e!r}")
+                self.sleep(wait)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+在一次运行中同时处理多个语言 (多个 DynamoDB 表) 的任务.
+
+每个语言的任务列表按照权重交错排列, 所有任务共享同一个限速器和同一个截止时间. 如果某个
+语言的任务先处理完了, 剩下的时间会自动分给其他语言, 而不是像每个语言单独运行一个
+workflow 那样白白空闲.
+"""
+
+import typing as T
+
+T_KEY = T.TypeVar("T_KEY")
+T_ITEM = T.TypeVar("T_ITEM")
+
+
+def interleave_by_weight(
+    item_lists: T.Dict[T_KEY, T.Sequence[T_ITEM]],
+    weights: T.Dict[T_KEY, float],
+) -> T.List[T_ITEM]:
+    """
+    按照权重把多个列表交错合并成一个列表, 每个列表内部的顺序保持不变.
+
+    使用 smooth weighted round-robin 算法 (和 nginx 的 upstream 负载均衡一样):
+    每一轮给每个列表的 "当前分数" 加上它的权重, 选出分数最高的列表取一个元素,
+    再把它的分数减去所有权重之和. 这样在任何一个前缀中, 每个列表被选中的次数都和权重成比例,
+    并且同一个列表的元素会被尽量均匀地分散开. 一个列表取完之后, 就不再参与分配.
+
+    :param item_lists: key 到列表的映射, 例如语言代码到这个语言的任务列表.
+    :param weights: key 到权重的映射, 权重必须大于 0.
+
+    Example::
+
+        >>> interleave_by_weight({"a": [1, 2, 3, 4], "b": [5, 6]}, {"a": 2, "b": 1})
+        [1, 5, 2, 3, 6, 4]
+    """
+    for key, weight in weights.items():
+        if weight <= 0:
+            raise ValueError(f"weight of {key!r} has to be positive, got {weight}")
+    iterators = {key: iter(item_lists[key]) for key in item_lists}
+    remaining = {key: len(item_lists[key]) for key in item_lists if item_lists[key]}
+    current = {key: 0.0 for key in remaining}
+    result = list()
+    while remaining:
+        total = sum(weights[key] for key in remaining)
+        for key in remaining:
+            current[key] += weights[key]
+        # ties are broken by the order of item_lists
+        best = max(remaining, key=lambda key: current[key])
+        current[best] -= total
+        result.append(next(iterators[best]))
+        remaining[best] -= 1
+        if remaining[best] == 0:
+            del remaining[best]
+    return result
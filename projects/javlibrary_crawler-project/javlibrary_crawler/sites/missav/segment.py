@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+"""
+把多个压缩后的 HTML 打包存到同一个 S3 object (segment) 中.
+
+默认情况下每个 HTML 都是一个单独的 S3 object. 几十万个页面意味着几十万次 PUT 和 GET,
+每次请求都有固定的延迟和费用. 打包模式下, :class:`SegmentWriter` 把压缩后的 HTML
+依次追加到内存中的 segment 中, segment 足够大或者足够旧时一次性写入 S3.
+DynamoDB 中的 ``html`` 属性保存一个指向 segment 中某一段的指针
+(见 :class:`SegmentPointer`), 读取单个页面时使用 S3 的 range GET, 批量解析时可以一次
+读取整个 segment (见 :func:`read_segment`).
+
+segment 的格式::
+
+    content_1 | content_2 | ... | content_n | index (JSON) | index 的长度 (8 字节, big endian)
+
+其中 index 是 ``{key: [offset, length]}``, 所以不需要 DynamoDB 也可以知道 segment 中
+有哪些页面.
+"""
+
+import typing as T
+import json
+import time
+import uuid
+import struct
+import threading
+import dataclasses
+from urllib.parse import urlsplit, parse_qs
+
+from s3pathlib import S3Path
+from boto_session_manager import BotoSesManager
+
+from ...logger import logger
+
+SEGMENT_EXT = ".seg"
+FOOTER_STRUCT = struct.Struct(">Q")
+
+T_ITEM = T.TypeVar("T_ITEM")
+
+
+@dataclasses.dataclass(frozen=True)
+class SegmentPointer:
+    """
+    指向 segment 中的一段数据, 以 ``s3://bucket/key.seg?offset=123&length=456``
+    的形式保存在 DynamoDB 中.
+    """
+
+    bucket: str = dataclasses.field()
+    key: str = dataclasses.field()
+    offset: int = dataclasses.field()
+    length: int = dataclasses.field()
+
+    @property
+    def uri(self) -> str:
+        return (
+            f"s3://{self.bucket}/{self.key}?offset={self.offset}&length={self.length}"
+        )
+
+    @classmethod
+    def from_uri(cls, uri: str) -> "SegmentPointer":
+        parts = urlsplit(uri)
+        query = parse_qs(parts.query)
+        return cls(
+            bucket=parts.netloc,
+            key=parts.path.lstrip("/"),
+            offset=int(query["offset"][0]),
+            length=int(query["length"][0]),
+        )
+
+    @property
+    def s3path(self) -> S3Path:
+        return S3Path(self.bucket, self.key)
+
+    def read(self, bsm: BotoSesManager) -> bytes:
+        """
+        用 range GET 读取这一段数据.
+        """
+        res = bsm.s3_client.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={self.offset}-{self.offset + self.length - 1}",
+        )
+        return res["Body"].read()
+
+
+def is_segment_uri(uri: str) -> bool:
+    return urlsplit(uri).path.endswith(SEGMENT_EXT) and "offset=" in uri
+
+
+def read_blob(uri: str, bsm: BotoSesManager) -> bytes:
+    """
+    读取 ``html`` 属性指向的数据, 可以是一个单独的 S3 object, 也可以是 segment 中的一段.
+    """
+    if is_segment_uri(uri):
+        return SegmentPointer.from_uri(uri).read(bsm=bsm)
+    return S3Path(uri).read_bytes(bsm=bsm)
+
+
+def pack_segment(
+    entries: T.List[T.Tuple[str, bytes]],
+) -> T.Tuple[bytes, T.List[T.Tuple[int, int]]]:
+    """
+    把 (key, content) 列表打包成一个 segment.
+
+    :return: segment 的内容, 以及每个 content 的 (offset, length).
+    """
+    position_list = list()
+    offset = 0
+    for _, content in entries:
+        position_list.append((offset, len(content)))
+        offset += len(content)
+    index = {key: list(position) for (key, _), position in zip(entries, position_list)}
+    index_bytes = json.dumps(index).encode("utf-8")
+    body = b"".join(content for _, content in entries)
+    return body + index_bytes + FOOTER_STRUCT.pack(len(index_bytes)), position_list
+
+
+def unpack_segment(data: bytes) -> T.Dict[str, bytes]:
+    """
+    :func:`pack_segment` 的逆操作, 返回 key 到 content 的映射.
+    """
+    (index_length,) = FOOTER_STRUCT.unpack(data[-FOOTER_STRUCT.size :])
+    index_end = len(data) - FOOTER_STRUCT.size
+    index = json.loads(data[index_end - index_length : index_end])
+    return {
+        key: data[offset : offset + length] for key, (offset, length) in index.items()
+    }
+
+
+def read_segment(s3path: S3Path, bsm: BotoSesManager) -> T.Dict[str, bytes]:
+    """
+    一次读取整个 segment, 用于批量解析. 返回 key 到压缩后的 content 的映射.
+    """
+    return unpack_segment(s3path.read_bytes(bsm=bsm))
+
+
+@dataclasses.dataclass
+class SegmentWriter(T.Generic[T_ITEM]):
+    """
+    把压缩后的 HTML 追加到 segment 中, segment 的大小超过 ``max_size`` 或者第一个页面
+    已经等待了 ``max_age`` 秒时, 把 segment 写入 S3. 这个对象是线程安全的. 用法::
+
+        with SegmentWriter(s3dir=s3dir, bsm=bsm, on_flush=on_flush, on_error=on_error) as writer:
+            writer.append(item, key, content)
+
+    写入成功后, 用 ``[(item, pointer), ...]`` 调用 ``on_flush``, 例如用来更新 DynamoDB
+    中的指针并把任务标记为成功. 写入失败时, 用 ``([item, ...], exception)`` 调用
+    ``on_error``. 由于任务的锁在 segment 写入之前不会释放, ``max_age`` 必须比锁的过期时间短.
+
+    :param s3dir: segment 保存在哪个 S3 目录下.
+    :param max_size: segment 的最大字节数.
+    :param max_age: segment 中的第一个页面最多等待多少秒.
+    :param clock: 返回当前时间 (秒) 的函数, 用于测试.
+    """
+
+    s3dir: S3Path = dataclasses.field()
+    bsm: BotoSesManager = dataclasses.field(repr=False)
+    on_flush: T.Callable[[T.List[T.Tuple[T_ITEM, SegmentPointer]]], T.Any] = (
+        dataclasses.field(repr=False)
+    )
+    on_error: T.Callable[[T.List[T_ITEM], Exception], T.Any] = dataclasses.field(
+        repr=False
+    )
+    max_size: int = dataclasses.field(default=8 * 1024 * 1024)
+    max_age: float = dataclasses.field(default=30)
+    clock: T.Callable[[], float] = dataclasses.field(default=time.monotonic, repr=False)
+
+    n_segment: int = dataclasses.field(default=0, init=False)
+    n_entry: int = dataclasses.field(default=0, init=False)
+    n_byte: int = dataclasses.field(default=0, init=False)
+    _prefix: str = dataclasses.field(default="", init=False, repr=False)
+    _items: T.List[T_ITEM] = dataclasses.field(
+        default_factory=list, init=False, repr=False
+    )
+    _entries: T.List[T.Tuple[str, bytes]] = dataclasses.field(
+        default_factory=list, init=False, repr=False
+    )
+    _size: int = dataclasses.field(default=0, init=False, repr=False)
+    _opened_at: float = dataclasses.field(default=0.0, init=False, repr=False)
+    _closed: bool = dataclasses.field(default=False, init=False, repr=False)
+    _cond: threading.Condition = dataclasses.field(
+        default_factory=threading.Condition, init=False, repr=False
+    )
+    _flush_lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+    _thread: T.Optional[threading.Thread] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        # different writers (job runs, workers) never write to the same segment
+        start = time.strftime("%Y-%m-%dT%H-%M-%S", time.gmtime())
+        self._prefix = f"{start}-{uuid.uuid4().hex[:8]}"
+
+    def append(self, item: T_ITEM, key: str, content: bytes):
+        """
+        把一个页面追加到当前的 segment 中. 如果 segment 满了, 在当前线程中写入 S3.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("segment writer is closed")
+            if not self._entries:
+                self._opened_at = self.clock()
+                self._cond.notify_all()
+            self._items.append(item)
+            self._entries.append((key, content))
+            self._size += len(content)
+            is_full = self._size >= self.max_size
+        if is_full:
+            self.flush()
+
+    def _take(self) -> T.Tuple[T.List[T_ITEM], T.List[T.Tuple[str, bytes]]]:
+        with self._cond:
+            items, self._items = self._items, list()
+            entries, self._entries = self._entries, list()
+            self._size = 0
+        return items, entries
+
+    def flush(self):
+        """
+        把当前的 segment 写入 S3. 如果 segment 是空的, 什么也不做.
+        """
+        # segments are written one by one, so that the sequence number
+        # follows the order of the pages
+        with self._flush_lock:
+            items, entries = self._take()
+            if not entries:
+                return
+            self.n_segment += 1
+            s3path = self.s3dir.joinpath(
+                f"{self._prefix}-{self.n_segment:06d}{SEGMENT_EXT}"
+            )
+            body, position_list = pack_segment(entries)
+            try:
+                s3path.write_bytes(body, bsm=self.bsm)
+            except Exception as e:
+                logger.error(f"failed to write segment {s3path.uri}: {e!r}")
+                self.on_error(items, e)
+                return
+            self.n_entry += len(entries)
+            self.n_byte += len(body)
+        self.on_flush(
+            [
+                (
+                    item,
+                    SegmentPointer(
+                        bucket=s3path.bucket,
+                        key=s3path.key,
+                        offset=offset,
+                        length=length,
+                    ),
+                )
+                for item, (offset, length) in zip(items, position_list)
+            ]
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if not self._entries:
+                    self._cond.wait()
+                    continue
+                remaining = self._opened_at + self.max_age - self.clock()
+                if remaining > 0:
+                    self._cond.wait(timeout=remaining)
+                    continue
+            self.flush()
+
+    def start(self):
+        """
+        启动后台线程, 把等待时间超过 ``max_age`` 的 segment 写入 S3.
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="segment-writer", daemon=True
+        )
+        self._thread.start()
+
+    def close(self):
+        """
+        停止后台线程, 并把剩下的页面写入 S3.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __enter__(self) -> "SegmentWriter":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "n_segment": self.n_segment,
+            "n_entry": self.n_entry,
+            "n_byte": self.n_byte,
+        }
@@ -3,26 +3,181 @@
 """
 这个模块负责把 https://missav.com/sitemap.xml 以及里面列出的其他所有的 .xml 文件下载下来.
 这些 xml 文件里面包含了所有待爬取的页面的 URL.
+
+sitemap.xml 里面列出了几百个 .xml 文件, :meth:`SiteMapSnapshot.download` 用多个线程
+同时下载它们, 共享 :class:`~.downloader.HttpClient` 的连接池和限速器. 每个文件先写入
+临时文件再 rename, 写完之后再写一个 ``.done`` 标记文件, 里面是压缩后的内容的 MD5.
+中断之后重新运行时, 只有标记文件存在并且 MD5 一致的文件才会被跳过, 写了一半的文件会被
+重新下载.
+
+**增量快照**
+
+sitemap.xml 每次更新, 它的 MD5 就会变, 于是会创建一个新的快照目录. 但是几百个
+sitemap_items_*.xml 中通常只有最新的几个发生了变化. 每个快照在 ``snapshot.json`` 中记录
+了它的父快照 (默认是创建时最新的快照). 下载时, 如果某个文件在 sitemap.xml 中的
+``<lastmod>`` 和父快照中的一样, 并且父快照中的文件是完整的, 就直接从父快照 hard link
+(不支持时复制) 过来, 不需要下载. 由于所有的文件都是先写临时文件再 rename 的, 不会原地修改,
+所以 hard link 的文件不会被另一个快照改掉.
 """
 
 import typing as T
+import os
+import json
 import gzip
+import uuid
+import shutil
 import dataclasses
+from datetime import datetime, timezone
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-# import xml.etree.ElementTree as ET
 import lxml.etree
+import requests
 
 import bs4
-import requests
 from pathlib_mate import Path
 from ...vendor.hashes import hashes, HashAlgoEnum
+from ...logger import logger
+from ...utils import get_utc_now
 
 from .paths import dir_missav_sitemap
-from .constants import LangCodeEnum
+from .constants import (
+    LangCodeEnum,
+    SITEMAP_DOWNLOAD_CONCURRENCY,
+    SITEMAP_DOWNLOAD_MAX_ATTEMPTS,
+)
+from .downloader import HttpError, HttpClient, http_client
+from .retry import RetryPolicy
+
+SITEMAP_NAMESPACES = {"ns": "http://www.sitemaps.org/schemas/sitemap/0.9"}
+URL_TAG = "{http://www.sitemaps.org/schemas/sitemap/0.9}url"
+XHTML_LINK_TAG = "{http://www.w3.org/1999/xhtml}link"
+DONE_EXT = ".done"
+SNAPSHOT_METADATA_FILENAME = "snapshot.json"
+# the closing tag of a complete sitemap file is always in the last few bytes
+XML_END_MARKERS = (b"</urlset>", b"</sitemapindex>")
+XML_TAIL_SIZE = 1024
+
+
+class IncompleteXmlError(Exception):
+    """
+    当 HTTP status code 对, 但是下载的 xml 文件不完整的时候抛出这个异常.
+    """
+
+    pass
+
+
+def write_bytes_atomic(path: Path, data: bytes):
+    """
+    先写入同一个目录下的临时文件, 再 rename 成目标文件. 这样目标文件要么不存在,
+    要么是完整的.
+    """
+    path_tmp = path.parent / f".{path.basename}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        path_tmp.write_bytes(data)
+        os.replace(path_tmp.abspath, path.abspath)
+    finally:
+        if path_tmp.exists():
+            path_tmp.remove()
 
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36",
-}
+
+def link_or_copy_atomic(src: Path, dst: Path):
+    """
+    把 ``src`` hard link 到 ``dst``, 如果不支持 hard link (例如跨文件系统) 就复制.
+    和 :func:`write_bytes_atomic` 一样, ``dst`` 要么不存在, 要么是完整的.
+    """
+    path_tmp = dst.parent / f".{dst.basename}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        try:
+            os.link(src.abspath, path_tmp.abspath)
+        except OSError:
+            shutil.copyfile(src.abspath, path_tmp.abspath)
+        os.replace(path_tmp.abspath, dst.abspath)
+    finally:
+        if path_tmp.exists():
+            path_tmp.remove()
+
+
+def get_done_marker(path: Path) -> Path:
+    return path.parent / f"{path.basename}{DONE_EXT}"
+
+
+def is_downloaded(path: Path) -> bool:
+    """
+    判断一个文件是否已经完整下载. 只有标记文件存在, 并且文件内容的 MD5 和标记文件中的
+    一致时才返回 True.
+    """
+    path_marker = get_done_marker(path)
+    if not (path_marker.exists() and path.exists()):
+        return False
+    md5 = hashes.of_bytes(path.read_bytes(), algo=HashAlgoEnum.md5)
+    return md5 == path_marker.read_text().strip()
+
+
+def make_sitemap_retry_policy() -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=SITEMAP_DOWNLOAD_MAX_ATTEMPTS,
+        retry_on=(HttpError, IncompleteXmlError, requests.RequestException),
+    )
+
+
+def download_sitemap_file(
+    url: str,
+    path: Path,
+    client: HttpClient = http_client,
+    retry_policy: T.Optional[RetryPolicy] = None,
+) -> bool:
+    """
+    下载一个 .xml 文件, 压缩后保存到 ``path``. 如果已经完整下载过了就跳过.
+
+    :param url: .xml 文件的 URL.
+    :param path: 保存的位置, 一般以 .xml.gz 结尾.
+    :param client: 用于下载的 :class:`~.downloader.HttpClient`.
+    :param retry_policy: 遇到 HTTP 错误, 网络错误或者文件不完整时的重试策略.
+
+    :return: 如果真的下载了返回 True, 如果跳过了返回 False.
+
+    :raises RetryGiveUpError: 重试之后仍然失败, 原始的异常在 ``__cause__`` 中.
+    """
+    if is_downloaded(path):
+        return False
+    if retry_policy is None:
+        retry_policy = make_sitemap_retry_policy()
+
+    def fetch() -> bytes:
+        res = client.get(url)
+        if res.status_code != 200:
+            raise HttpError(
+                f"HTTP {res.status_code} for {url}", status_code=res.status_code
+            )
+        tail = res.content[-XML_TAIL_SIZE:]
+        if not any(marker in tail for marker in XML_END_MARKERS):
+            raise IncompleteXmlError(f"incomplete xml from {url}")
+        return res.content
+
+    content = retry_policy.call(fetch)
+    data = gzip.compress(content, mtime=0)
+    write_bytes_atomic(path, data)
+    md5 = hashes.of_bytes(data, algo=HashAlgoEnum.md5)
+    write_bytes_atomic(get_done_marker(path), md5.encode("utf-8"))
+    return True
+
+
+@dataclasses.dataclass(frozen=True)
+class SitemapEntry:
+    """
+    sitemap.xml 中列出的一个 .xml 文件.
+
+    :param url: .xml 文件的 URL.
+    :param lastmod: ``<lastmod>`` 的值, 也就是这个文件最后修改的时间. 没有的话是 None.
+    """
+
+    url: str = dataclasses.field()
+    lastmod: T.Optional[str] = dataclasses.field(default=None)
+
+    @property
+    def filename(self) -> str:
+        return self.url.split("/")[-1] + ".gz"
 
 
 @dataclasses.dataclass
@@ -41,6 +196,89 @@ class SiteMapSnapshot:
     def path_missav_sitemap_xml_gz(self) -> Path:
         return self.dir_sitemap_snapshot / "sitemap.xml.gz"
 
+    @property
+    def path_snapshot_json(self) -> Path:
+        return self.dir_sitemap_snapshot / SNAPSHOT_METADATA_FILENAME
+
+    def read_metadata(self) -> T.Dict[str, T.Any]:
+        """
+        读取 ``snapshot.json``. 以前创建的快照没有这个文件, 返回空字典.
+        """
+        if not self.path_snapshot_json.exists():
+            return {}
+        return json.loads(self.path_snapshot_json.read_text())
+
+    def write_metadata(self, parent_md5: T.Optional[str]):
+        metadata = {
+            "md5": self.md5,
+            "parent_md5": parent_md5,
+            "create_time": get_utc_now().isoformat(),
+        }
+        write_bytes_atomic(
+            self.path_snapshot_json, json.dumps(metadata, indent=4).encode("utf-8")
+        )
+
+    @property
+    def parent_md5(self) -> T.Optional[str]:
+        return self.read_metadata().get("parent_md5")
+
+    @property
+    def parent(self) -> T.Optional["SiteMapSnapshot"]:
+        """
+        父快照, 如果没有, 或者父快照的目录已经被删除了, 返回 None.
+        """
+        parent_md5 = self.parent_md5
+        if parent_md5 is None:
+            return None
+        parent = self.__class__(md5=parent_md5)
+        if not parent.path_missav_sitemap_xml_gz.exists():
+            return None
+        return parent
+
+    def get_lineage(self) -> T.List[str]:
+        """
+        返回从自己开始, 一直到最早的祖先的快照 MD5 列表.
+        """
+        lineage = [self.md5]
+        snapshot = self
+        while True:
+            parent_md5 = snapshot.parent_md5
+            if parent_md5 is None or parent_md5 in lineage:
+                return lineage
+            lineage.append(parent_md5)
+            snapshot = self.__class__(md5=parent_md5)
+
+    @classmethod
+    def list_snapshots(cls) -> T.List["SiteMapSnapshot"]:
+        """
+        返回本地所有的快照, 按照创建时间从旧到新排序. 没有 ``snapshot.json`` 的旧快照
+        用 sitemap.xml.gz 的修改时间作为创建时间.
+        """
+        if not dir_missav_sitemap.exists():
+            return []
+        snapshot_list = list()
+        for dir_snapshot in dir_missav_sitemap.select_dir(recursive=False):
+            snapshot = cls(md5=dir_snapshot.basename)
+            if snapshot.path_missav_sitemap_xml_gz.exists():
+                snapshot_list.append(snapshot)
+
+        def sort_key(snapshot: "SiteMapSnapshot") -> str:
+            create_time = snapshot.read_metadata().get("create_time")
+            if create_time is None:
+                mtime = snapshot.path_missav_sitemap_xml_gz.stat().st_mtime
+                create_time = datetime.fromtimestamp(mtime, tz=timezone.utc).isoformat()
+            return create_time
+
+        return sorted(snapshot_list, key=sort_key)
+
+    @classmethod
+    def latest(cls) -> T.Optional["SiteMapSnapshot"]:
+        """
+        返回最新创建的快照, 如果一个都没有返回 None.
+        """
+        snapshot_list = cls.list_snapshots()
+        return snapshot_list[-1] if snapshot_list else None
+
     def get_item_xml(self, ith: int) -> Path:
         return self.dir_sitemap_snapshot / f"sitemap_items_{ith}.xml.gz"
 
@@ -103,22 +341,31 @@ class SiteMapSnapshot:
     def new(
         cls,
         md5: T.Optional[str] = None,
+        client: HttpClient = http_client,
+        parent_md5: T.Optional[str] = None,
     ):
         """
         创建一个新的 SiteMapSnapshot 对象. 创建的过程中会去读取最新的 sitemap.xml 的内容,
          并且用内容的 MD5 hash 作为唯一的 ID.
 
         :param md5: 如果 MD5 没给定, 说明这是一个全新的
+        :param client: 用于下载 sitemap.xml 的 :class:`~.downloader.HttpClient`.
+        :param parent_md5: 创建全新的快照时, 把哪个快照作为父快照, 默认是本地最新的快照.
         """
         if md5 is None:
-            res = requests.get("https://missav.com/sitemap.xml", headers=headers)
+            res = client.get("https://missav.com/sitemap.xml")
             xml_content = res.text
             md5 = hashes.of_str(xml_content, algo=HashAlgoEnum.md5)
             snapshot = cls(md5=md5)
-            snapshot.dir_sitemap_snapshot.mkdir_if_not_exists()
             if not snapshot.path_missav_sitemap_xml_gz.exists():
-                snapshot.path_missav_sitemap_xml_gz.write_bytes(
-                    gzip.compress(res.content)
+                if parent_md5 is None:
+                    latest = cls.latest()
+                    parent_md5 = None if latest is None else latest.md5
+                snapshot.dir_sitemap_snapshot.mkdir_if_not_exists()
+                snapshot.write_metadata(parent_md5=parent_md5)
+                write_bytes_atomic(
+                    snapshot.path_missav_sitemap_xml_gz,
+                    gzip.compress(res.content, mtime=0),
                 )
         else:
             snapshot = cls(md5=md5)
@@ -129,24 +376,125 @@ class SiteMapSnapshot:
                 )
         return snapshot
 
-    def download(self):
+    def get_xml_entry_list(self) -> T.List[SitemapEntry]:
         """
-        将 sitemap.xml 里面列出的所有 .xml 文件下载下来并压缩保存为 .xml.gz 文件
+        返回 sitemap.xml 里面列出的所有 .xml 文件.
         """
-        root = ET.fromstring(
-            gzip.decompress(self.path_missav_sitemap_xml_gz.read_bytes()).decode(
-                "utf-8"
-            )
+        root = lxml.etree.fromstring(
+            gzip.decompress(self.path_missav_sitemap_xml_gz.read_bytes())
         )
-        namespaces = {"ns": "http://www.sitemaps.org/schemas/sitemap/0.9"}
-        for loc in root.findall(".//ns:loc", namespaces):
-            url = loc.text
-            filename = url.split("/")[-1] + ".gz"
-            path_xml_gz = self.dir_sitemap_snapshot / filename
-            if not path_xml_gz.exists():
-                print(f"download {url} to {path_xml_gz} ...")
-                res = requests.get(url, headers=headers)
-                path_xml_gz.write_bytes(gzip.compress(res.content))
+        entry_list = list()
+        for sitemap in root.iterfind("ns:sitemap", namespaces=SITEMAP_NAMESPACES):
+            lastmod = sitemap.findtext("ns:lastmod", namespaces=SITEMAP_NAMESPACES)
+            entry_list.append(
+                SitemapEntry(
+                    url=sitemap.findtext(
+                        "ns:loc", namespaces=SITEMAP_NAMESPACES
+                    ).strip(),
+                    lastmod=None if lastmod is None else lastmod.strip(),
+                )
+            )
+        return entry_list
+
+    def get_xml_url_list(self) -> T.List[str]:
+        """
+        返回 sitemap.xml 里面列出的所有 .xml 文件的 URL.
+        """
+        return [entry.url for entry in self.get_xml_entry_list()]
+
+    def reuse_from_parent(
+        self,
+        entry: SitemapEntry,
+        parent: "SiteMapSnapshot",
+        parent_lastmod_mapping: T.Dict[str, T.Optional[str]],
+    ) -> bool:
+        """
+        如果 ``entry`` 在父快照中的 ``<lastmod>`` 和现在一样, 并且父快照中的文件是完整的,
+        就把父快照中的文件和标记文件 hard link 过来.
+
+        :return: 如果复用了父快照中的文件返回 True.
+        """
+        if entry.lastmod is None:
+            return False
+        if parent_lastmod_mapping.get(entry.url) != entry.lastmod:
+            return False
+        path_parent = parent.dir_sitemap_snapshot / entry.filename
+        if not is_downloaded(path_parent):
+            return False
+        path = self.dir_sitemap_snapshot / entry.filename
+        link_or_copy_atomic(path_parent, path)
+        link_or_copy_atomic(get_done_marker(path_parent), get_done_marker(path))
+        return True
+
+    def download(
+        self,
+        client: HttpClient = http_client,
+        concurrency: int = SITEMAP_DOWNLOAD_CONCURRENCY,
+        retry_policy: T.Optional[RetryPolicy] = None,
+    ) -> T.Dict[str, int]:
+        """
+        将 sitemap.xml 里面列出的所有 .xml 文件下载下来并压缩保存为 .xml.gz 文件.
+        已经完整下载过的文件会被跳过, 所以中断之后可以直接重新运行. 没有变化的文件会从
+        父快照中复用 (见 :meth:`reuse_from_parent`).
+
+        某个文件重试之后仍然失败时, 其他文件会继续下载, 全部结束之后再抛出第一个异常.
+
+        :param client: 用于下载的 :class:`~.downloader.HttpClient`.
+        :param concurrency: 最多同时下载多少个文件.
+        :param retry_policy: 每个文件的重试策略, 默认见 :func:`make_sitemap_retry_policy`.
+
+        :return: 一共有多少个文件, 下载了多少个, 从父快照复用了多少个, 跳过了多少个,
+            失败了多少个.
+        """
+        if retry_policy is None:
+            retry_policy = make_sitemap_retry_policy()
+        entry_list = self.get_xml_entry_list()
+        parent = self.parent
+        if parent is None:
+            parent_lastmod_mapping = dict()
+        else:
+            parent_lastmod_mapping = {
+                entry.url: entry.lastmod for entry in parent.get_xml_entry_list()
+            }
+        error_list: T.List[T.Tuple[str, Exception]] = list()
+
+        def download_one(entry: SitemapEntry) -> str:
+            path_xml_gz = self.dir_sitemap_snapshot / entry.filename
+            try:
+                if is_downloaded(path_xml_gz):
+                    return "skipped"
+                if parent is not None and self.reuse_from_parent(
+                    entry, parent, parent_lastmod_mapping
+                ):
+                    return "reused"
+                download_sitemap_file(
+                    url=entry.url,
+                    path=path_xml_gz,
+                    client=client,
+                    retry_policy=retry_policy,
+                )
+                return "downloaded"
+            except Exception as e:
+                logger.error(f"failed to download {entry.url}: {e!r}")
+                error_list.append((entry.url, e))
+                return "failed"
+
+        logger.info(f"download {len(entry_list)} xml files, {concurrency = }")
+        if parent is not None:
+            logger.info(f"reuse unchanged files from parent snapshot {parent.md5}")
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            counter = Counter(executor.map(download_one, entry_list))
+        stats = {
+            "n_total": len(entry_list),
+            "n_downloaded": counter["downloaded"],
+            "n_reused": counter["reused"],
+            "n_skipped": counter["skipped"],
+            "n_failed": counter["failed"],
+        }
+        logger.info(f"sitemap snapshot download stats: {stats}")
+        if error_list:
+            raise error_list[0][1]
+        return stats
 
     def remove_uncompressed(self):
         """
@@ -185,6 +533,26 @@ class ItemUrl:
             if item_url.lang == expected_lang_code
         ]
 
+    @classmethod
+    def group_by_lang(
+        cls,
+        item_url_list: T.Iterable["ItemUrl"],
+        lang_code_list: T.Iterable[LangCodeEnum],
+    ) -> T.Dict[LangCodeEnum, T.List["ItemUrl"]]:
+        """
+        只遍历一次 ``item_url_list``, 把每个 URL 分到它的语言对应的列表中, 其他语言的
+        URL 直接丢弃. 结果和对每个语言分别调用 :meth:`filter_by_lang` 一样, 但是
+        ``item_url_list`` 可以是只能遍历一次的 generator.
+        """
+        mapping: T.Dict[int, T.List["ItemUrl"]] = {
+            lang_code.value: list() for lang_code in lang_code_list
+        }
+        for item_url in item_url_list:
+            lst = mapping.get(item_url.lang)
+            if lst is not None:
+                lst.append(item_url)
+        return {LangCodeEnum.get_by_value(lang): lst for lang, lst in mapping.items()}
+
 
 def _parse_actress_or_item_xml_v1(p: Path) -> T.List[T.Tuple[str, int]]:
     """
@@ -221,20 +589,47 @@ def _parse_actress_or_item_xml_v2(p: Path) -> T.List[T.Tuple[str, int]]:
     return lst
 
 
-_parse_actress_or_item_xml = _parse_actress_or_item_xml_v2
-
+def _parse_actress_or_item_xml_v3(p: Path) -> T.Iterator[T.Tuple[str, int]]:
+    """
+    从 sitemap_actresses_123.xml.gz 或者 sitemap_items_123.xml.gz 中提取出所有的
+    URL 和对应的语言代码, 结果和 v2 一样.
 
-def parse_actresses_xml(p: Path) -> T.List[ActressUrl]:
+    v2 需要同时在内存中保存压缩的内容, 解压后的内容和完整的 DOM 树. 这里用
+    ``lxml.etree.iterparse`` 边解压边解析, 每处理完一个 ``<url>`` 就把它从树中删掉,
+    所以内存中只有一个 ``<url>`` 元素和已经见过的 URL 集合 (用于去重).
+    """
+    seen: T.Set[str] = set()
+    with gzip.open(p.abspath, "rb") as f:
+        for _, elem in lxml.etree.iterparse(
+            f, events=("end",), tag=(URL_TAG, XHTML_LINK_TAG)
+        ):
+            if elem.tag == XHTML_LINK_TAG:
+                url = elem.get("href")
+                if url not in seen:
+                    seen.add(url)
+                    yield url, LangCodeEnum[elem.get("hreflang")].value
+            else:
+                # the <url> element and all the processed siblings are not needed anymore
+                elem.clear()
+                parent = elem.getparent()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+
+_parse_actress_or_item_xml = _parse_actress_or_item_xml_v3
+
+
+def parse_actresses_xml(p: Path) -> T.Iterator[ActressUrl]:
     """
-    从 sitemap_actresses_123.xml.gz 中提取出所有的 Actress URL
+    从 sitemap_actresses_123.xml.gz 中提取出所有的 Actress URL. 这是一个 generator.
     """
-    return [
-        ActressUrl(url=url, lang=lang) for url, lang in _parse_actress_or_item_xml(p)
-    ]
+    for url, lang in _parse_actress_or_item_xml(p):
+        yield ActressUrl(url=url, lang=lang)
 
 
-def parse_item_xml(p: Path) -> T.List[ItemUrl]:
+def parse_item_xml(p: Path) -> T.Iterator[ItemUrl]:
     """
-    从 解析 sitemap_items_123.xml.gz 中提取出所有的 Item URL
+    从 解析 sitemap_items_123.xml.gz 中提取出所有的 Item URL. 这是一个 generator.
     """
-    return [ItemUrl(url=url, lang=lang) for url, lang in _parse_actress_or_item_xml(p)]
+    for url, lang in _parse_actress_or_item_xml(p):
+        yield ItemUrl(url=url, lang=lang)
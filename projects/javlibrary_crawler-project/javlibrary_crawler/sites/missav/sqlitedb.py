@@ -5,7 +5,6 @@ Sqlite 数据库是用来追踪 Parse HTML 的任务状态的.
 """
 
 import typing as T
-import gzip
 import enum
 import base64
 from functools import cached_property
@@ -14,7 +13,6 @@ import sqlalchemy as sa
 import sqlalchemy.orm as orm
 import sqlalchemy_mate.api as sam
 
-from s3pathlib import S3Path
 from boto_session_manager import BotoSesManager
 
 from javlibrary_crawler.vendor.better_enum import BetterIntEnum
@@ -22,6 +20,8 @@ from javlibrary_crawler.vendor.better_enum import BetterIntEnum
 from ..constants import SiteEnum
 from .constants import LangCodeEnum
 from .parser import VideoDetail, parse_video_detail_html
+from .codec import HtmlCodec
+from .segment import read_blob
 
 
 Base = orm.declarative_base()
@@ -72,9 +72,16 @@ class Job(
     def read_html(
         self,
         bsm: BotoSesManager,
+        codec: T.Optional[HtmlCodec] = None,
     ) -> str:
-        s3path = S3Path(self.html)
-        return gzip.decompress(s3path.read_bytes(bsm=bsm)).decode("utf-8")
+        """
+        读取并解压 S3 中的 HTML. gzip 和 zstd 格式会自动识别, 如果 HTML 是用 zstd 字典
+        压缩的, ``codec`` 必须能读取这个字典 (见 :class:`~.codec.HtmlCodec`).
+        HTML 可以是一个单独的 S3 object, 也可以是 segment 中的一段 (见 :mod:`.segment`).
+        """
+        if codec is None:
+            codec = HtmlCodec()
+        return codec.decompress(read_blob(self.html, bsm=bsm)).decode("utf-8")
 
     @classmethod
     def start_parse_html_job(
@@ -106,6 +113,7 @@ class Job(
         lang: LangCodeEnum,
         skip_error: bool = False,
         debug: bool = False,
+        codec: T.Optional[HtmlCodec] = None,
     ):
         job: "Job"
         with cls.start_parse_html_job(
@@ -114,7 +122,7 @@ class Job(
             skip_error=skip_error,
             debug=debug,
         ) as (job, updates):
-            html = job.read_html(bsm=bsm)
+            html = job.read_html(bsm=bsm, codec=codec)
             video_detail = parse_video_detail_html(lang=lang, html=html)
             if video_detail is None:
                 raise NotImplementedError
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""
+一次爬虫运行的结构化统计数据.
+
+以前我们只能从 ``now`` 这样的日志中推断每一步花了多少时间. 这个模块为下载任务的每一个
+步骤 (HTTP 请求, 压缩, 写入 S3, DynamoDB 加锁 / 更新 / 解锁) 维护一个流式的
+直方图, 并统计成功, 失败, HTML 格式不对的任务数量. 运行结束时把这些数据写成一个 JSON
+报告存到 S3 中, 用来根据实际数据调整并发数和 ``constants`` 中的各种参数.
+
+直方图使用对数分桶, 不需要保存每一个样本, 内存占用和样本数量无关, 分位数的相对误差不超过
+``precision``.
+"""
+
+import typing as T
+import json
+import math
+import time
+import threading
+import contextlib
+import dataclasses
+
+from s3pathlib import S3Path, ContentTypeEnum
+from boto_session_manager import BotoSesManager
+
+
+@dataclasses.dataclass
+class Histogram:
+    """
+    对数分桶的流式直方图, 线程安全. 只能记录非负数.
+
+    :param precision: 相邻两个桶的边界的相对差距, 也就是分位数的最大相对误差.
+    """
+
+    precision: float = dataclasses.field(default=0.01)
+
+    count: int = dataclasses.field(default=0, init=False)
+    total: float = dataclasses.field(default=0.0, init=False)
+    min: T.Optional[float] = dataclasses.field(default=None, init=False)
+    max: T.Optional[float] = dataclasses.field(default=None, init=False)
+    _buckets: T.Dict[int, int] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def _get_bucket(self, value: float) -> int:
+        # all values <= 1 micro second go to the same bucket
+        if value <= 1e-6:
+            return 0
+        return max(1, math.ceil(math.log(value / 1e-6, 1 + self.precision)))
+
+    def _get_bucket_value(self, bucket: int) -> float:
+        if bucket == 0:
+            return 0.0
+        return 1e-6 * (1 + self.precision) ** bucket
+
+    def add(self, value: float):
+        bucket = self._get_bucket(value)
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+            self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, q: float) -> T.Optional[float]:
+        """
+        估算第 q 百分位数 (0 <= q <= 100). 如果没有样本, 返回 None.
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = max(1, math.ceil(self.count * q / 100))
+            n = 0
+            for bucket in sorted(self._buckets):
+                n += self._buckets[bucket]
+                if n >= rank:
+                    value = self._get_bucket_value(bucket)
+                    return min(max(value, self.min), self.max)
+            # only reachable when q > 100
+            return self.max
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+@dataclasses.dataclass
+class CrawlTelemetry:
+    """
+    一次爬虫运行的统计数据, 线程安全.
+
+    - 直方图: 每个步骤的耗时 (秒) 和下载的字节数, 见 :meth:`timer` 和 :meth:`observe`.
+    - 计数器: 成功, 失败, HTML 格式不对的任务数量等, 见 :meth:`incr`.
+    """
+
+    histograms: T.Dict[str, Histogram] = dataclasses.field(default_factory=dict)
+    counters: T.Dict[str, int] = dataclasses.field(default_factory=dict)
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def observe(self, name: str, value: float):
+        """
+        在名为 ``name`` 的直方图中记录一个值.
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[name] = histogram
+        histogram.add(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """
+        记录 ``with`` 语句块的耗时. 就算语句块抛出了异常也会记录.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def incr(self, name: str, n: int = 1):
+        """
+        把名为 ``name`` 的计数器加 ``n``.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self) -> T.Dict[str, T.Any]:
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {
+            "counters": counters,
+            "histograms": {
+                name: histogram.to_dict()
+                for name, histogram in sorted(histograms.items())
+            },
+        }
+
+    def dump_report(
+        self,
+        s3path: S3Path,
+        bsm: BotoSesManager,
+        extra: T.Optional[T.Dict[str, T.Any]] = None,
+    ) -> T.Dict[str, T.Any]:
+        """
+        把统计数据写成 JSON 报告存到 S3 中.
+
+        :param extra: 额外的信息, 例如这次运行的参数, 限速器的状态等, 会被合并到报告中.
+
+        :return: 写入 S3 的报告.
+        """
+        report = self.to_dict()
+        if extra:
+            report.update(extra)
+        s3path.write_text(
+            json.dumps(report, indent=4),
+            content_type=ContentTypeEnum.app_json,
+            bsm=bsm,
+        )
+        return report
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+"""
+sitemap 快照的列式 URL 索引.
+
+``create_dynamodb_import_data_files``, ``insert_pending_tasks`` 等每次都要重新解析
+sitemap_items_*.xml.gz, 并且为每个 URL 创建一个 :class:`~.sitemap.ItemUrl` 对象,
+再用 list comprehension 按照语言过滤. :class:`UrlIndex` 把一个快照中所有的
+Item URL 解析一次, 按列保存在快照目录下的 ``url_index.bin`` 中, 之后用 ``mmap`` 直接
+读取, 不需要再解析 XML, 也不需要把所有的 URL 都读入内存.
+
+每一行是一个 URL, 有以下几列:
+
+- ``lang``: 语言代码, uint8.
+- ``file_ith``: 来自第几个 sitemap_items_*.xml.gz 文件, uint32.
+- ``position``: 在这个文件中是第几个 URL (从 0 开始), uint32.
+- ``url``: URL 本身, 用 ``url_offsets`` (uint64, 比行数多一个) 和 ``url_data``
+  (所有 URL 的 UTF-8 编码拼接在一起) 两列保存.
+
+行按照 ``(file_ith, position)`` 排序, 所以同一个文件的 URL 是连续的. 索引的 header
+中记录了每个文件的 MD5 和它对应的行的范围. 任何一个文件的 MD5 变了 (或者增加, 删除了文件),
+索引就会被重新生成.
+
+项目没有依赖 numpy / pyarrow, 所以每一列都是标准库的 :class:`array.array` 格式,
+读取时用 ``memoryview.cast`` 直接映射. 按照语言过滤时, 用 ``bytes.translate`` 把
+``lang`` 列一次性转换成 0 / 1 的 mask, 再用 :func:`itertools.compress` 取出行号,
+这两步都是在 C 中完成的.
+
+文件格式::
+
+    MAGIC (8 字节) | header 的长度 (8 字节, little endian) | header (JSON) | 各列的数据
+
+每一列的起始位置都按照 8 字节对齐.
+"""
+
+import typing as T
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import shutil
+import tempfile
+import itertools
+import dataclasses
+
+from pathlib_mate import Path
+
+from ...vendor.hashes import hashes, HashAlgoEnum
+from ...logger import logger
+
+from .constants import LangCodeEnum
+from .sitemap import SiteMapSnapshot, ItemUrl, parse_item_xml
+
+MAGIC = b"MAVURLX1"
+HEADER_LENGTH_STRUCT = struct.Struct("<Q")
+URL_INDEX_FILENAME = "url_index.bin"
+ALIGNMENT = 8
+
+# column name -> array typecode
+COLUMN_TYPECODES = {
+    "lang": "B",
+    "file_ith": "I",
+    "position": "I",
+    "url_offsets": "Q",
+    "url_data": "B",
+}
+
+
+def get_file_ith(p: Path) -> int:
+    """
+    sitemap_items_123.xml.gz -> 123
+    """
+    return int(p.basename.split("_")[-1].split(".")[0])
+
+
+def get_file_md5_list(path_list: T.List[Path]) -> T.List[T.Tuple[str, str]]:
+    return [
+        (
+            p.basename,
+            hashes.of_file(p.abspath, chunk_size=1024 * 1024, algo=HashAlgoEnum.md5),
+        )
+        for p in path_list
+    ]
+
+
+def _pad(f: T.BinaryIO):
+    remainder = f.tell() % ALIGNMENT
+    if remainder:
+        f.write(b"\x00" * (ALIGNMENT - remainder))
+
+
+def write_url_index(path_list: T.List[Path], path_index: Path):
+    """
+    解析 ``path_list`` 中的所有 sitemap_items_*.xml.gz 文件, 生成索引文件.
+
+    解析的过程中每一列先分别写入临时文件, 所以内存中最多只有一个 XML 文件的数据.
+    索引文件先写入临时文件再 rename, 所以读取的一方不会读到写了一半的索引.
+    """
+    path_list = sorted(path_list, key=get_file_ith)
+    with tempfile.TemporaryDirectory(dir=path_index.parent.abspath) as dir_temp:
+        column_files = {
+            name: open(Path(dir_temp, name).abspath, "w+b") for name in COLUMN_TYPECODES
+        }
+        try:
+            n_row = 0
+            url_data_size = 0
+            array.array("Q", [0]).tofile(column_files["url_offsets"])
+            file_list = list()
+            for p, (basename, md5) in zip(path_list, get_file_md5_list(path_list)):
+                file_ith = get_file_ith(p)
+                lang = array.array("B")
+                url_offsets = array.array("Q")
+                url_data = bytearray()
+                for item_url in parse_item_xml(p):
+                    lang.append(item_url.lang)
+                    url_data.extend(item_url.url.encode("utf-8"))
+                    url_offsets.append(url_data_size + len(url_data))
+                n = len(lang)
+                lang.tofile(column_files["lang"])
+                array.array("I", itertools.repeat(file_ith, n)).tofile(
+                    column_files["file_ith"]
+                )
+                array.array("I", range(n)).tofile(column_files["position"])
+                url_offsets.tofile(column_files["url_offsets"])
+                column_files["url_data"].write(url_data)
+                file_list.append(
+                    {
+                        "name": basename,
+                        "ith": file_ith,
+                        "md5": md5,
+                        "start": n_row,
+                        "stop": n_row + n,
+                    }
+                )
+                n_row += n
+                url_data_size += len(url_data)
+
+            header = {
+                "byteorder": sys.byteorder,
+                "n_row": n_row,
+                "files": file_list,
+                "columns": dict(),
+            }
+            # the column offsets depend on the header length, and vice versa,
+            # repeat until the header length doesn't change anymore
+            column_sizes = {name: f.tell() for name, f in column_files.items()}
+
+            def make_header(base: int) -> bytes:
+                offset = base
+                for name in COLUMN_TYPECODES:
+                    header["columns"][name] = [offset, column_sizes[name]]
+                    offset += column_sizes[name]
+                    offset += (-offset) % ALIGNMENT
+                return json.dumps(header).encode("utf-8")
+
+            prefix_size = len(MAGIC) + HEADER_LENGTH_STRUCT.size
+            header_bytes = make_header(0)
+            while True:
+                base = prefix_size + len(header_bytes)
+                base += (-base) % ALIGNMENT
+                new_header_bytes = make_header(base)
+                if len(new_header_bytes) == len(header_bytes):
+                    header_bytes = new_header_bytes
+                    break
+                header_bytes = new_header_bytes
+
+            path_temp = Path(dir_temp, URL_INDEX_FILENAME)
+            with open(path_temp.abspath, "wb") as f_out:
+                f_out.write(MAGIC)
+                f_out.write(HEADER_LENGTH_STRUCT.pack(len(header_bytes)))
+                f_out.write(header_bytes)
+                _pad(f_out)
+                for name in COLUMN_TYPECODES:
+                    f_in = column_files[name]
+                    f_in.seek(0)
+                    shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+                    _pad(f_out)
+        finally:
+            for f in column_files.values():
+                f.close()
+        os.replace(path_temp.abspath, path_index.abspath)
+    logger.info(f"built url index of {n_row} urls from {len(path_list)} files")
+
+
+@dataclasses.dataclass
+class UrlIndex:
+    """
+    用 ``mmap`` 读取的 URL 索引, 用 :meth:`open` 创建. 用法::
+
+        with UrlIndex.open(path_index) as index:
+            for item_url in index.iter_item_urls([LangCodeEnum.cn]):
+                ...
+
+    :param header: 索引文件的 header.
+    """
+
+    header: T.Dict[str, T.Any] = dataclasses.field(repr=False)
+    lang: memoryview = dataclasses.field(repr=False)
+    file_ith: memoryview = dataclasses.field(repr=False)
+    position: memoryview = dataclasses.field(repr=False)
+    url_offsets: memoryview = dataclasses.field(repr=False)
+    url_data: memoryview = dataclasses.field(repr=False)
+    _mmap: T.Optional[mmap.mmap] = dataclasses.field(default=None, repr=False)
+
+    @classmethod
+    def read_header(cls, path_index: Path) -> T.Optional[T.Dict[str, T.Any]]:
+        """
+        读取索引文件的 header. 如果文件不存在或者格式不对, 返回 None.
+        """
+        if not path_index.exists():
+            return None
+        with open(path_index.abspath, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (header_length,) = HEADER_LENGTH_STRUCT.unpack(
+                f.read(HEADER_LENGTH_STRUCT.size)
+            )
+            return json.loads(f.read(header_length))
+
+    @classmethod
+    def open(cls, path_index: Path) -> "UrlIndex":
+        header = cls.read_header(path_index)
+        if header is None:
+            raise ValueError(f"{path_index} is not a url index file")
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path_index} is built on a machine of another byteorder")
+        with open(path_index.abspath, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        columns = dict()
+        for name, typecode in COLUMN_TYPECODES.items():
+            offset, size = header["columns"][name]
+            columns[name] = view[offset : offset + size].cast(typecode)
+        view.release()
+        return cls(header=header, _mmap=mm, **columns)
+
+    def close(self):
+        for name in COLUMN_TYPECODES:
+            getattr(self, name).release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> "UrlIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.header["n_row"]
+
+    def get_row_range(self, file_ith: int) -> T.Tuple[int, int]:
+        """
+        返回第 ``file_ith`` 个文件的行的范围 ``(start, stop)``. 如果没有这个文件,
+        返回 ``(0, 0)``.
+        """
+        for file in self.header["files"]:
+            if file["ith"] == file_ith:
+                return file["start"], file["stop"]
+        return 0, 0
+
+    def get_url(self, i: int) -> str:
+        return str(
+            self.url_data[self.url_offsets[i] : self.url_offsets[i + 1]], "utf-8"
+        )
+
+    def get_item_url(self, i: int) -> ItemUrl:
+        return ItemUrl(url=self.get_url(i), lang=self.lang[i])
+
+    def mask(
+        self,
+        lang_code_list: T.Iterable[LangCodeEnum],
+        start: int = 0,
+        stop: T.Optional[int] = None,
+    ) -> bytes:
+        """
+        返回 ``[start, stop)`` 这些行的 mask, 语言在 ``lang_code_list`` 中的行为 1,
+        否则为 0.
+        """
+        table = bytearray(256)
+        for lang_code in lang_code_list:
+            table[lang_code.value] = 1
+        return self.lang[start:stop].tobytes().translate(table)
+
+    def select(
+        self,
+        lang_code_list: T.Optional[T.Iterable[LangCodeEnum]] = None,
+        file_ith: T.Optional[int] = None,
+    ) -> T.Iterator[int]:
+        """
+        返回符合条件的行号, 按照 ``(file_ith, position)`` 的顺序.
+
+        :param lang_code_list: 只返回这些语言的行, 默认返回所有语言.
+        :param file_ith: 只返回第 ``file_ith`` 个文件的行, 默认返回所有文件.
+        """
+        if file_ith is None:
+            start, stop = 0, len(self)
+        else:
+            start, stop = self.get_row_range(file_ith)
+        if lang_code_list is None:
+            return iter(range(start, stop))
+        return itertools.compress(
+            range(start, stop), self.mask(lang_code_list, start, stop)
+        )
+
+    def iter_item_urls(
+        self,
+        lang_code_list: T.Optional[T.Iterable[LangCodeEnum]] = None,
+        file_ith: T.Optional[int] = None,
+    ) -> T.Iterator[ItemUrl]:
+        """
+        参数和 :meth:`select` 一样, 返回符合条件的 :class:`~.sitemap.ItemUrl`.
+        """
+        for i in self.select(lang_code_list, file_ith):
+            yield self.get_item_url(i)
+
+    def group_by_lang(
+        self,
+        lang_code_list: T.Iterable[LangCodeEnum],
+        file_ith: T.Optional[int] = None,
+    ) -> T.Dict[LangCodeEnum, T.List[ItemUrl]]:
+        """
+        和 :meth:`~.sitemap.ItemUrl.group_by_lang` 的结果一样, 但不需要解析 XML.
+        """
+        return {
+            lang_code: list(self.iter_item_urls([lang_code], file_ith))
+            for lang_code in lang_code_list
+        }
+
+
+def get_path_url_index(snapshot: SiteMapSnapshot) -> Path:
+    return snapshot.dir_sitemap_snapshot / URL_INDEX_FILENAME
+
+
+def is_url_index_fresh(path_index: Path, path_list: T.List[Path]) -> bool:
+    """
+    判断索引是否是根据 ``path_list`` 中的文件的当前内容生成的.
+    """
+    header = UrlIndex.read_header(path_index)
+    if header is None or header["byteorder"] != sys.byteorder:
+        return False
+    indexed = [(file["name"], file["md5"]) for file in header["files"]]
+    path_list = sorted(path_list, key=get_file_ith)
+    return indexed == get_file_md5_list(path_list)
+
+
+def open_url_index(snapshot: SiteMapSnapshot) -> UrlIndex:
+    """
+    打开快照的 URL 索引. 如果索引不存在或者已经过期, 先重新生成.
+    """
+    path_index = get_path_url_index(snapshot)
+    path_list = snapshot.get_item_xml_list()
+    if not is_url_index_fresh(path_index, path_list):
+        logger.info(f"build url index for sitemap snapshot {snapshot.md5}")
+        write_url_index(path_list, path_index)
+    return UrlIndex.open(path_index)
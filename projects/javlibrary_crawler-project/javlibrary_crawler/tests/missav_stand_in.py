@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+用于离线测试和 benchmark 的 missav.com 替身.
+
+- :class:`MissavStandInServer`: 一个本地 HTTP 服务器, 对任何 URL 都返回同一个 fixture
+  页面, 可以设定响应延迟, 错误率和 HTML 格式不对的比例.
+- :class:`ScaledClock`: 一个比真实时间走得更快的时钟, 可以用几秒钟模拟一次完整的
+  ``GITHUB_ACTION_RUN_INTERVAL`` 运行.
+"""
+
+import typing as T
+import time
+import random
+import threading
+import dataclasses
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CHALLENGE_HTML = (
+    b"<html><head><title>Just a moment...</title></head><body></body></html>"
+)
+
+
+@dataclasses.dataclass
+class MissavStandInServer:
+    """
+    本地的 missav.com 替身. 用法::
+
+        with MissavStandInServer(html=html, latency=0.05, error_rate=0.1) as server:
+            url = server.make_url("abf-106")
+
+    :param html: 正常情况下返回的 HTML.
+    :param latency: 每个请求在返回之前等待多少秒.
+    :param error_rate: 有多大的概率返回 HTTP 503.
+    :param malformed_ratio: 有多大的概率返回一个验证码页面 (HTTP 200, 但是格式不对).
+    :param seed: 随机数种子, 用于让 benchmark 可以复现.
+    """
+
+    html: bytes = dataclasses.field()
+    latency: float = dataclasses.field(default=0.0)
+    error_rate: float = dataclasses.field(default=0.0)
+    malformed_ratio: float = dataclasses.field(default=0.0)
+    seed: T.Optional[int] = dataclasses.field(default=None)
+
+    n_request: int = dataclasses.field(default=0, init=False)
+    n_error: int = dataclasses.field(default=0, init=False)
+    n_malformed: int = dataclasses.field(default=0, init=False)
+    _server: T.Optional[ThreadingHTTPServer] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+    _random: random.Random = dataclasses.field(init=False, repr=False)
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    def _pick_response(self) -> T.Tuple[int, bytes]:
+        with self._lock:
+            self.n_request += 1
+            dice = self._random.random()
+            if dice < self.error_rate:
+                self.n_error += 1
+                return 503, b""
+            elif dice < self.error_rate + self.malformed_ratio:
+                self.n_malformed += 1
+                return 200, CHALLENGE_HTML
+            else:
+                return 200, self.html
+
+    def _make_handler(self) -> T.Type[BaseHTTPRequestHandler]:
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                status, content = stand_in._pick_response()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                try:
+                    self.wfile.write(content)
+                except OSError:  # the client aborted the transfer
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "MissavStandInServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def make_url(self, video_id: str, lang: str = "cn") -> str:
+        return f"{self.endpoint}/{lang}/{video_id}"
+
+
+@dataclasses.dataclass
+class ScaledClock:
+    """
+    从创建时刻开始, 比真实时间快 ``speed`` 倍的 UTC 时钟. 它可以作为 ``now`` 参数传给
+    ``crawl_pending_tasks``.
+
+    :param speed: 时钟的速度是真实时间的多少倍.
+    """
+
+    speed: float = dataclasses.field(default=1.0)
+
+    _start_at: datetime = dataclasses.field(init=False, repr=False)
+    _start_perf: float = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._start_at = datetime.utcnow().replace(tzinfo=timezone.utc)
+        self._start_perf = time.perf_counter()
+
+    def __call__(self) -> datetime:
+        elapsed = (time.perf_counter() - self._start_perf) * self.speed
+        return self._start_at + timedelta(seconds=elapsed)
@@ -46,6 +46,8 @@ class BaseMockTest:
 
     @classmethod
     def setup_moto(cls):
+        # each test class has its own mockers, don't stop the ones of other classes
+        cls._mock_list = []
         if cls.use_mock:
             for mock_abc in cls.mock_list:
                 mocker = mock_abc()
@@ -3,11 +3,17 @@
 """
 这个脚本是用于在 GitHub Action 中运行爬虫程序的脚本. 我们只在 prd 环境中真正下载大量数据.
 在 sbx 和 tst 环境中我们只下载少量数据.
+
+如果用 GitHub Action 的 matrix 同时运行多个爬虫, 用环境变量 ``MISSAV_WORKER_INDEX``
+和 ``MISSAV_N_WORKER`` 告诉每个爬虫它是第几个 worker, 以及一共有多少个 worker.
 """
 
+import os
+
 import javlibrary_crawler.sites.missav.api as missav
 
 missav.crawl_pending_tasks(
     lang_code=missav.LangCodeEnum.cn,
+    worker_index=int(os.environ.get("MISSAV_WORKER_INDEX", "0")),
+    n_worker=int(os.environ.get("MISSAV_N_WORKER", "1")),
 )
-
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+
+from javlibrary_crawler.sites.missav.circuit_breaker import (
+    CircuitOpenError,
+    CircuitBreaker,
+)
+
+
+class TestCircuitBreaker:
+    def test_trip(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        breaker.on_failure(reason="HTTP 500")
+        breaker.on_failure(reason="HTTP 500")
+        breaker.on_success()
+        breaker.on_failure(reason="HTTP 500")
+        breaker.on_failure(reason="HTTP 500")
+        assert breaker.state == "closed"
+        breaker.before_request()
+
+        breaker.on_failure(reason="HTTP 403")
+        assert breaker.state == "open"
+        assert breaker.n_trip == 1
+        assert breaker.trip_reason == "3 consecutive failures, last error: HTTP 403"
+        # not broken yet, we still want to probe
+        breaker.raise_if_broken()
+
+    def test_probe_succeeded(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.on_failure(reason="HTTP 500")
+        released = list()
+
+        def wait():
+            breaker.before_request()
+            released.append(breaker.state)
+
+        # the first caller becomes the probe after reset_timeout
+        start = time.monotonic()
+        breaker.before_request()
+        assert time.monotonic() - start >= 0.04
+        assert breaker.state == "half_open"
+
+        # other callers wait for the probe
+        thread_list = [threading.Thread(target=wait) for _ in range(3)]
+        for thread in thread_list:
+            thread.start()
+        time.sleep(0.05)
+        assert released == []
+
+        breaker.on_success()
+        for thread in thread_list:
+            thread.join()
+        assert released == ["closed"] * 3
+
+    def test_probe_failed(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.on_failure(reason="HTTP 500")
+        breaker.before_request()
+        errors = list()
+
+        def wait():
+            try:
+                breaker.before_request()
+            except CircuitOpenError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        breaker.on_failure(reason="HTTP 503")
+        thread.join()
+        assert len(errors) == 1
+        assert breaker.is_broken is True
+        assert breaker.to_dict()["trip_reason"] == "probe request failed: HTTP 503"
+        with pytest.raises(CircuitOpenError):
+            breaker.raise_if_broken()
+
+        # the next run starts with a closed breaker
+        breaker.reset()
+        breaker.before_request()
+        assert breaker.to_dict() == {
+            "state": "closed",
+            "is_broken": False,
+            "n_trip": 0,
+            "trip_reason": None,
+        }
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(
+        __file__, "javlibrary_crawler.sites.missav.circuit_breaker", preview=False
+    )
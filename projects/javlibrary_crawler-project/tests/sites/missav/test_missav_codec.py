@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import threading
+from pathlib import Path
+
+import pytest
+
+from javlibrary_crawler.sites.missav.codec import (
+    GZIP,
+    ZSTD,
+    detect_compression,
+    get_zstd_dict_id,
+    train_zstd_dictionary,
+    HtmlCodec,
+)
+
+dir_here = Path(__file__).absolute().parent
+html = gzip.decompress(dir_here.joinpath("abf-106-cn.html.gz").read_bytes())
+
+
+def make_samples(n: int):
+    return [
+        html.replace(b"abf-106", f"xyz-{i:03d}".encode()).replace(
+            b"ABF-106", f"XYZ-{i:03d}".encode()
+        )
+        for i in range(n)
+    ]
+
+
+def test_gzip():
+    codec = HtmlCodec()
+    content = codec.compress(html)
+    assert detect_compression(content) == GZIP
+    # no timestamp in the header, the same html is always compressed to
+    # the same bytes
+    assert content == gzip.compress(html, compresslevel=9, mtime=0)
+    assert codec.decompress(content) == html
+    # compatible with the html compressed before the codec was introduced
+    assert codec.decompress(gzip.compress(html)) == html
+
+    with pytest.raises(ValueError):
+        detect_compression(html)
+    with pytest.raises(ValueError):
+        HtmlCodec(compression="brotli")
+    with pytest.raises(ValueError):
+        HtmlCodec(dict_id=1, dictionary_loader=lambda dict_id: b"")
+
+
+def test_zstd():
+    dictionaries = {
+        100001: train_zstd_dictionary(
+            make_samples(100), dict_id=100001, dict_size=16384
+        ),
+    }
+    with pytest.raises(ValueError):
+        train_zstd_dictionary(make_samples(100), dict_id=0)
+    with pytest.raises(ValueError):
+        HtmlCodec(compression=ZSTD, dict_id=100001)
+
+    codec = HtmlCodec(
+        compression=ZSTD,
+        dict_id=100001,
+        dictionary_loader=dictionaries.__getitem__,
+    )
+    assert codec.content_type == "application/zstd"
+    content = codec.compress(html)
+    assert detect_compression(content) == ZSTD
+    assert get_zstd_dict_id(content) == 100001
+    assert len(content) < len(gzip.compress(html))
+    assert codec.decompress(content) == html
+
+    # html compressed with gzip or without dictionary is still readable
+    assert codec.decompress(gzip.compress(html)) == html
+    no_dict_codec = HtmlCodec(compression=ZSTD)
+    no_dict_content = no_dict_codec.compress(html)
+    assert get_zstd_dict_id(no_dict_content) == 0
+    assert codec.decompress(no_dict_content) == html
+
+    # the dictionary is required to decompress
+    with pytest.raises(ValueError):
+        no_dict_codec.decompress(content)
+
+    # html compressed with the old dictionary is readable after the rotation
+    dictionaries[100002] = train_zstd_dictionary(
+        make_samples(100)[::-1], dict_id=100002, dict_size=16384
+    )
+    new_codec = HtmlCodec(
+        compression=ZSTD,
+        dict_id=100002,
+        dictionary_loader=dictionaries.__getitem__,
+    )
+    assert get_zstd_dict_id(new_codec.compress(html)) == 100002
+    assert new_codec.decompress(content) == html
+
+
+def test_zstd_thread_safe():
+    samples = make_samples(50)
+    codec = HtmlCodec(compression=ZSTD)
+    errors = list()
+
+    def run(sample: bytes):
+        try:
+            for _ in range(5):
+                assert codec.decompress(codec.compress(sample)) == sample
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    thread_list = [threading.Thread(target=run, args=(s,)) for s in samples[:8]]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    assert errors == []
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.codec", preview=False)
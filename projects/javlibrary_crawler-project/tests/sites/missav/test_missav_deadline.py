@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timezone
+
+import pytest
+
+from javlibrary_crawler.sites.missav.deadline import (
+    parse_start_time,
+    EnvStartTimeProvider,
+    ProcessStartTimeProvider,
+    ClockStartTimeProvider,
+    GitHubRunStartTimeProvider,
+    ChainedStartTimeProvider,
+    make_default_start_time_provider,
+    resolve_deadline,
+)
+
+START_AT = datetime(2024, 1, 1, 8, 0, 0, tzinfo=timezone.utc)
+NOW = datetime(2024, 1, 1, 8, 5, 0, tzinfo=timezone.utc)
+
+
+def now() -> datetime:
+    return NOW
+
+
+def test_parse_start_time():
+    assert parse_start_time(str(int(START_AT.timestamp()))) == START_AT
+    assert parse_start_time("2024-01-01T08:00:00Z") == START_AT
+    assert parse_start_time("2024-01-01T08:00:00") == START_AT
+    assert parse_start_time(" 2024-01-01T16:00:00+08:00\n") == START_AT
+    with pytest.raises(ValueError):
+        parse_start_time("yesterday")
+
+
+def test_env_provider():
+    provider = EnvStartTimeProvider(env_var="STARTED_AT", environ={})
+    assert provider.get_start_time() is None
+    provider.environ = {"STARTED_AT": "2024-01-01T08:00:00Z"}
+    assert provider.get_start_time() == START_AT
+    provider.environ = {"STARTED_AT": "yesterday"}
+    assert provider.get_start_time() is None
+
+
+def test_github_provider():
+    calls = list()
+
+    def fetch(repo: str, run_id: int) -> datetime:
+        calls.append((repo, run_id))
+        return START_AT
+
+    provider = GitHubRunStartTimeProvider(repo="a/b", environ={}, fetch=fetch)
+    assert provider.get_start_time() is None
+    assert calls == []
+
+    provider.environ = {"GITHUB_RUN_ID": "123"}
+    assert provider.get_start_time() == START_AT
+    assert provider.get_start_time() == START_AT
+    assert calls == [("a/b", 123)]
+
+    # the failure is cached too, we don't want to hit the rate limit again
+    def fetch_rate_limited(repo: str, run_id: int) -> datetime:
+        calls.append((repo, run_id))
+        raise Exception("API rate limit exceeded")
+
+    calls.clear()
+    provider = GitHubRunStartTimeProvider(
+        environ={"GITHUB_RUN_ID": "123"}, fetch=fetch_rate_limited
+    )
+    assert provider.get_start_time() is None
+    assert provider.get_start_time() is None
+    assert len(calls) == 1
+
+
+def test_chained_provider():
+    def fetch(repo: str, run_id: int) -> datetime:
+        raise AssertionError("should not call the API")
+
+    provider = ChainedStartTimeProvider(
+        providers=[
+            EnvStartTimeProvider(env_var="X", environ={"X": "1"}),
+            GitHubRunStartTimeProvider(environ={"GITHUB_RUN_ID": "1"}, fetch=fetch),
+        ]
+    )
+    deadline = resolve_deadline(provider, max_run_time=60, now=now)
+    assert deadline.start_at == datetime.fromtimestamp(1, tz=timezone.utc)
+    assert deadline.source == "EnvStartTimeProvider"
+
+    # nobody knows the start time, start counting from now
+    deadline = resolve_deadline(ChainedStartTimeProvider(), max_run_time=60, now=now)
+    assert deadline.start_at == NOW
+    assert deadline.source == "now"
+    assert (deadline.end_at - deadline.start_at).total_seconds() == 60
+
+    deadline = resolve_deadline(
+        ProcessStartTimeProvider(started_at=START_AT), max_run_time=60
+    )
+    assert deadline.to_dict() == {
+        "start_at": "2024-01-01T08:00:00+00:00",
+        "end_at": "2024-01-01T08:01:00+00:00",
+        "source": "ProcessStartTimeProvider",
+    }
+
+
+def test_make_default_start_time_provider():
+    provider = make_default_start_time_provider(is_github_action=False, now=now)
+    provider.providers[0].environ = {}
+    assert provider.get_start_time() == NOW
+    assert isinstance(provider.providers[-1], ClockStartTimeProvider)
+
+    provider = make_default_start_time_provider(is_github_action=True)
+    assert [p.name for p in provider.providers] == [
+        "EnvStartTimeProvider",
+        "GitHubRunStartTimeProvider",
+        "ProcessStartTimeProvider",
+    ]
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.deadline", preview=False)
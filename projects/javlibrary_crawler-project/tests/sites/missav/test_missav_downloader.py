@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from javlibrary_crawler.sites.missav.downloader import (
+    HttpError,
+    MalformedHtmlError,
+    HttpClient,
+    CHUNK_SIZE,
+    get_video_detail_html,
+    get_video_detail_html_bytes,
+    HtmlValidators,
+    fetch_video_detail_html,
+)
+from javlibrary_crawler.sites.missav.rate_limiter import AdaptiveRateLimiter
+from javlibrary_crawler.sites.missav.circuit_breaker import (
+    CircuitOpenError,
+    CircuitBreaker,
+)
+
+GOOD_HTML = '<html><head><link rel="preload" as="image" href="cover.jpg"></head></html>'
+BAD_HTML = "<html><head><title>Just a moment...</title></head></html>"
+# the marker is split across the first two chunks
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+LARGE_HTML = (
+    "<html><head>"
+    + " " * (CHUNK_SIZE - 12 - 10)
+    + '<link rel="preload" as="image" href="cover.jpg"></head>'
+    + "<body>"
+    + "a" * CHUNK_SIZE * 3
+    + "</body></html>"
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ports = set()
+
+    def do_GET(self):
+        Handler.ports.add(self.client_address[1])
+        if self.path == "/slow-bad":
+            return self.send_slow_bad()
+        if self.path == "/etag":
+            return self.send_etag()
+        if self.path == "/good":
+            status, body = 200, GOOD_HTML
+        elif self.path == "/large":
+            status, body = 200, LARGE_HTML
+        elif self.path == "/bad":
+            status, body = 200, BAD_HTML
+        elif self.path == "/missing":
+            status, body = 404, ""
+        else:
+            status, body = 500, ""
+        content = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_etag(self):
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+        content = GOOD_HTML.encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_slow_bad(self):
+        # the first chunk has the whole <head>, the rest of the body is slow
+        head = BAD_HTML.encode("utf-8").ljust(CHUNK_SIZE)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(head) * 2))
+        self.end_headers()
+        self.wfile.write(head)
+        self.wfile.flush()
+        time.sleep(1)
+        try:
+            self.wfile.write(head)
+        except OSError:  # the client has closed the connection
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpClient:
+    server: ThreadingHTTPServer
+    endpoint: str
+
+    @classmethod
+    def setup_class(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.endpoint = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+
+    def test_get_video_detail_html(self):
+        with HttpClient(pool_size=1) as client:
+            Handler.ports.clear()
+            for _ in range(3):
+                html = get_video_detail_html(f"{self.endpoint}/good", client=client)
+                assert html == GOOD_HTML
+            # keep-alive connection is reused
+            assert len(Handler.ports) == 1
+
+            with pytest.raises(MalformedHtmlError):
+                get_video_detail_html(f"{self.endpoint}/bad", client=client)
+            with pytest.raises(HttpError):
+                get_video_detail_html(f"{self.endpoint}/error", client=client)
+
+    def test_get_video_detail_html_bytes(self):
+        with HttpClient() as client:
+            content = get_video_detail_html_bytes(
+                f"{self.endpoint}/large", client=client
+            )
+            assert content == LARGE_HTML.encode("utf-8")
+
+            # abort the transfer as soon as we see </head> without the marker
+            start = time.monotonic()
+            with pytest.raises(MalformedHtmlError):
+                get_video_detail_html_bytes(f"{self.endpoint}/slow-bad", client=client)
+            assert time.monotonic() - start < 0.5
+
+    def test_fetch_video_detail_html(self):
+        with HttpClient(pool_size=1) as client:
+            result = fetch_video_detail_html(f"{self.endpoint}/etag", client=client)
+            assert result.is_modified is True
+            assert result.content == GOOD_HTML.encode("utf-8")
+            assert result.validators.etag == ETAG
+            assert result.validators.last_modified == LAST_MODIFIED
+            assert result.validators.md5 is not None
+
+            # the server answers 304, the old md5 is kept
+            result_1 = fetch_video_detail_html(
+                f"{self.endpoint}/etag",
+                client=client,
+                validators=result.validators,
+            )
+            assert result_1.is_modified is False
+            assert result_1.validators == result.validators
+
+            # the server doesn't support conditional request, compare the md5
+            result_2 = fetch_video_detail_html(
+                f"{self.endpoint}/good",
+                client=client,
+                validators=HtmlValidators(md5=result.validators.md5),
+            )
+            assert result_2.is_modified is False
+            assert result_2.validators.etag is None
+            result_3 = fetch_video_detail_html(
+                f"{self.endpoint}/good",
+                client=client,
+                validators=HtmlValidators(md5="0" * 32),
+            )
+            assert result_3.is_modified is True
+
+    def test_rate_limiter(self):
+        limiter = AdaptiveRateLimiter(rate=100, max_rate=200, cooldown=0)
+        with HttpClient(rate_limiter=limiter) as client:
+            get_video_detail_html(f"{self.endpoint}/good", client=client)
+            assert limiter.n_success == 1
+            assert limiter.rate > 100
+            with pytest.raises(HttpError):
+                get_video_detail_html(f"{self.endpoint}/error", client=client)
+            assert limiter.n_throttle == 1
+            assert limiter.rate < 100
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.01)
+        with HttpClient(circuit_breaker=breaker) as client:
+            with pytest.raises(MalformedHtmlError):
+                get_video_detail_html(f"{self.endpoint}/bad", client=client)
+            get_video_detail_html(f"{self.endpoint}/good", client=client)
+            assert breaker.n_consecutive_failure == 0
+
+            for _ in range(2):
+                with pytest.raises(HttpError):
+                    get_video_detail_html(f"{self.endpoint}/error", client=client)
+            assert breaker.state == "open"
+            # the probe request fails
+            with pytest.raises(HttpError):
+                get_video_detail_html(f"{self.endpoint}/error", client=client)
+            assert breaker.is_broken is True
+            with pytest.raises(CircuitOpenError):
+                get_video_detail_html(f"{self.endpoint}/good", client=client)
+
+        # 404 means the site is up, it doesn't trip the breaker
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.01)
+        with HttpClient(circuit_breaker=breaker) as client:
+            for _ in range(3):
+                with pytest.raises(HttpError) as exc_info:
+                    get_video_detail_html(f"{self.endpoint}/missing", client=client)
+                assert exc_info.value.status_code == 404
+            assert breaker.state == "closed"
+            assert breaker.n_consecutive_failure == 0
+
+            # and it closes a half open breaker
+            for _ in range(2):
+                with pytest.raises(HttpError):
+                    get_video_detail_html(f"{self.endpoint}/error", client=client)
+            assert breaker.state == "open"
+            with pytest.raises(HttpError):
+                get_video_detail_html(f"{self.endpoint}/missing", client=client)
+            assert breaker.state == "closed"
+            get_video_detail_html(f"{self.endpoint}/good", client=client)
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.downloader", preview=False)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import signal
+
+import moto
+import pynamodb_mate.api as pm
+
+from javlibrary_crawler.tests.mock import BaseMockTest
+from javlibrary_crawler.sites.missav.drain import (
+    InFlightTracker,
+    GracefulDrain,
+)
+from javlibrary_crawler.sites.missav.lease import (
+    get_queried_status,
+    set_released,
+    commit_tasks,
+)
+
+st = pm.patterns.status_tracker
+
+
+class Task(st.BaseTask):
+    class Meta:
+        table_name = "javlibrary-crawler-test-drain"
+        region = "us-east-1"
+
+    config = st.TrackerConfig.make(
+        use_case_id="test",
+        pending_status=10,
+        in_progress_status=12,
+        failed_status=14,
+        succeeded_status=16,
+        ignored_status=18,
+        n_pending_shard=2,
+        n_in_progress_shard=1,
+        n_failed_shard=1,
+        n_succeeded_shard=1,
+        n_ignored_shard=1,
+        max_retry=3,
+    )
+
+    status_and_update_time_index = st.StatusAndUpdateTimeIndex()
+
+
+def test_in_flight_tracker():
+    tracker = InFlightTracker()
+    item_1, item_2 = dict(a=1), dict(a=1)  # equal but not the same
+    tracker.add(item_1)
+    tracker.add(item_2)
+    tracker.add(item_2)
+    assert len(tracker) == 2
+    tracker.discard(item_1)
+    tracker.discard(item_1)
+    assert tracker.pop_all() == [item_2]
+    assert len(tracker) == 0
+
+
+def test_graceful_drain():
+    fired = list()
+    drain = GracefulDrain(grace_period=0.05, on_timeout=lambda: fired.append(1))
+    assert drain.should_stop() is False
+    drain.request("test")
+    assert drain.should_stop() is True
+    assert drain.reason == "test"
+    assert fired == []
+    time.sleep(0.2)
+    assert fired == [1]
+    # on_timeout is only called once
+    drain.request("again")
+    assert fired == [1]
+    assert drain.to_dict() == {"is_draining": True, "reason": "test"}
+
+    # the second request doesn't wait for the grace period
+    fired.clear()
+    drain = GracefulDrain(grace_period=60, on_timeout=lambda: fired.append(1))
+    drain.request("test")
+    drain.request("again")
+    assert fired == [1]
+    drain.uninstall()
+
+
+def test_graceful_drain_signal():
+    fired = list()
+    old_handler = signal.getsignal(signal.SIGTERM)
+    with GracefulDrain(grace_period=60, on_timeout=lambda: fired.append(1)) as drain:
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(0.05)
+        assert drain.is_draining is True
+        assert drain.reason == "received SIGTERM"
+        assert fired == []
+        # the second signal hands back the in-flight tasks immediately,
+        # and restores the default behavior
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(0.05)
+        assert fired == [1]
+        assert signal.getsignal(signal.SIGTERM) == old_handler
+    assert signal.getsignal(signal.SIGTERM) == old_handler
+
+
+class TestDrainRelease(BaseMockTest):
+    mock_list = [
+        moto.mock_dynamodb,
+    ]
+
+    def setup_method(self):
+        if Task.exists():
+            Task.delete_table()
+        Task.create_table(wait=True)
+
+    def test_release_queried_tasks(self):
+        with Task.batch_write() as batch:
+            for i in range(3):
+                batch.save(Task.make(task_id=f"t-{i}"))
+        # t-2 failed once
+        try:
+            with Task.start(task_id="t-2", debug=False):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+
+        # the tasks queried from the index only have the projected attributes
+        task_list = list(
+            Task.query_by_status(
+                [Task.config.pending_status, Task.config.failed_status], limit=10
+            )
+        )
+        assert {task.status for task in task_list} == {None}
+        assert sorted(get_queried_status(task) for task in task_list) == [10, 10, 14]
+
+        # the in-flight tasks, like DownloadJob.start
+        in_flight = InFlightTracker()
+        for task in task_list:
+            previous_status = get_queried_status(task)
+            exec_ctx = Task.start(task_id=task.task_id, debug=False).__enter__()
+            in_flight.add((exec_ctx, previous_status))
+
+        def release_in_flight():
+            exec_ctx_list = list()
+            for exec_ctx, previous_status in in_flight.pop_all():
+                set_released(exec_ctx, previous_status)
+                exec_ctx_list.append(exec_ctx)
+            assert commit_tasks(exec_ctx_list) == []
+
+        drain = GracefulDrain(grace_period=60, on_timeout=release_in_flight)
+        drain.request("test")
+        drain.request("again")
+        for task in Task.scan():
+            assert task.lock == Task.lock.default
+            if task.task_id == "t-2":
+                assert task.status == Task.config.failed_status
+                assert task.retry == 1
+            else:
+                assert task.status == Task.config.pending_status
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.drain", preview=False)
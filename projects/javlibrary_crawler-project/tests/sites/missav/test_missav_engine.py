@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from datetime import timedelta
+
+import pytest
+
+from javlibrary_crawler.utils import get_utc_now
+from javlibrary_crawler.sites.missav.downloader import MalformedHtmlError
+from javlibrary_crawler.sites.missav.engine import (
+    get_task_interval,
+    crawl,
+)
+
+
+def test_get_task_interval():
+    assert get_task_interval(1, 1, 2) == 2
+    assert get_task_interval(4, 1, 2) == 1
+    assert get_task_interval(4, 0.25, 2) == 0.5
+
+
+def test_crawl():
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+    done = list()
+
+    def process_task(task: int):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        if task % 5 == 0:
+            raise MalformedHtmlError
+        done.append(task)
+
+    result = crawl(
+        task_list=list(range(1, 21)),
+        process_task=process_task,
+        end_at=get_utc_now() + timedelta(seconds=60),
+        concurrency=4,
+    )
+    assert result.n_total == 20
+    assert result.n_succeeded == 16
+    assert result.n_ignored == 4
+    assert result.n_not_started == 0
+    assert result.is_time_up is False
+    assert sorted(done) == [i for i in range(1, 21) if i % 5]
+    assert 1 < running["max"] <= 4
+
+
+def test_crawl_time_is_up():
+    result = crawl(
+        task_list=list(range(10)),
+        process_task=lambda task: None,
+        end_at=get_utc_now() + timedelta(seconds=1),
+        task_processing_time=2,
+    )
+    assert result.is_time_up is True
+    assert result.n_not_started == 10
+
+    # use an injected clock that is already past the end time
+    end_at = get_utc_now() + timedelta(seconds=60)
+    result = crawl(
+        task_list=list(range(10)),
+        process_task=lambda task: None,
+        end_at=end_at,
+        now=lambda: end_at + timedelta(seconds=1),
+    )
+    assert result.is_time_up is True
+    assert result.n_not_started == 10
+
+
+def test_crawl_should_stop():
+    stop = threading.Event()
+
+    def process_task(task: int):
+        if task == 2:
+            stop.set()
+
+    result = crawl(
+        task_list=list(range(10)),
+        process_task=process_task,
+        end_at=get_utc_now() + timedelta(seconds=60),
+        should_stop=stop.is_set,
+    )
+    assert result.is_stopped is True
+    assert result.is_time_up is False
+    assert result.n_succeeded == 3
+    assert result.n_not_started == 7
+
+
+def test_crawl_error():
+    def process_task(task: int):
+        if task == 3:
+            raise ValueError
+
+    with pytest.raises(ValueError):
+        crawl(
+            task_list=list(range(10)),
+            process_task=process_task,
+            end_at=get_utc_now() + timedelta(seconds=60),
+            concurrency=2,
+        )
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.engine", preview=False)
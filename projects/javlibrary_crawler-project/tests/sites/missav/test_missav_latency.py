@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from javlibrary_crawler.sites.missav.latency import LatencyStats
+
+
+class TestLatencyStats:
+    def test_percentile(self):
+        stats = LatencyStats()
+        for i in range(1, 101):
+            stats.add(float(i))
+        assert stats.p50 == pytest.approx(50.5)
+        assert stats.p95 == pytest.approx(95.05)
+        assert stats.percentile(0) == 1
+        assert stats.percentile(100) == 100
+
+        with pytest.raises(ValueError):
+            LatencyStats().percentile(50)
+
+    def test_max_samples(self):
+        stats = LatencyStats(max_samples=3)
+        for i in range(5):
+            stats.add(i)
+        assert stats.samples == [2, 3, 4]
+
+        new_stats = stats.merge(LatencyStats(samples=[5, 6]))
+        assert new_stats.samples == [4, 5, 6]
+
+    def test_estimate(self):
+        stats = LatencyStats(min_samples=5)
+        for i in range(4):
+            stats.add(1.0)
+        assert stats.estimate(default=2) == (2, 2)
+        stats.add(11.0)
+        p50, p95 = stats.estimate(default=2)
+        assert p50 == 1
+        assert p95 == pytest.approx(9.0)
+
+    def test_seder(self):
+        stats = LatencyStats(samples=[1.0, 2.0], max_samples=10, min_samples=1)
+        assert LatencyStats.from_dict(stats.to_dict()).samples == [1.0, 2.0]
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.latency", preview=False)
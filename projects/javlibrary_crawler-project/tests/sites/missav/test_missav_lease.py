@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import moto
+import pytest
+import pynamodb_mate.api as pm
+
+from javlibrary_crawler.tests.mock import BaseMockTest
+from javlibrary_crawler.sites.missav.lease import (
+    claim_tasks,
+    set_succeeded,
+    set_failed,
+    commit_tasks,
+    TaskLeaser,
+    CompletionBatcher,
+)
+
+st = pm.patterns.status_tracker
+
+
+class Task(st.BaseTask):
+    class Meta:
+        table_name = "javlibrary-crawler-test-lease"
+        region = "us-east-1"
+
+    config = st.TrackerConfig.make(
+        use_case_id="test",
+        pending_status=10,
+        in_progress_status=12,
+        failed_status=14,
+        succeeded_status=16,
+        ignored_status=18,
+        n_pending_shard=2,
+        n_in_progress_shard=1,
+        n_failed_shard=1,
+        n_succeeded_shard=1,
+        n_ignored_shard=1,
+        max_retry=2,
+    )
+
+    status_and_update_time_index = st.StatusAndUpdateTimeIndex()
+
+
+class Test(BaseMockTest):
+    mock_list = [
+        moto.mock_dynamodb,
+    ]
+
+    def setup_method(self):
+        if Task.exists():
+            Task.delete_table()
+        Task.create_table(wait=True)
+
+    def make_tasks(self, n: int):
+        task_list = [Task.make(task_id=f"t-{i}") for i in range(n)]
+        with Task.batch_write() as batch:
+            for task in task_list:
+                batch.save(task)
+        return task_list
+
+    def test_claim_and_commit(self):
+        task_list = self.make_tasks(3)
+        # another worker holds the lock of t-1
+        with Task.start(task_id="t-1"):
+            claim_list = claim_tasks(task_list)
+        assert claim_list[1] is None
+        assert claim_list[0].previous_status == Task.config.pending_status
+        exec_ctx_list = [
+            None if claim is None else claim.exec_ctx for claim in claim_list
+        ]
+        assert exec_ctx_list[0].task.status == Task.config.in_progress_status
+        assert Task.get_one_or_none("t-0").lock == exec_ctx_list[0].task.lock
+
+        set_succeeded(exec_ctx_list[0])
+        set_failed(exec_ctx_list[2], ValueError("boom"))
+        assert commit_tasks([exec_ctx_list[0], exec_ctx_list[2]]) == []
+        task_0 = Task.get_one_or_none("t-0")
+        assert task_0.status == Task.config.succeeded_status
+        assert task_0.lock == Task.lock.default
+        task_2 = Task.get_one_or_none("t-2")
+        assert task_2.status == Task.config.failed_status
+        assert task_2.retry == 1
+        assert "boom" in task_2.errors["history"][0]["error"]
+
+        # the second failure reaches max_retry
+        (claim,) = claim_tasks([task_2])
+        assert claim.previous_status == Task.config.failed_status
+        exec_ctx = claim.exec_ctx
+        assert exec_ctx.task.retry == 1
+        set_failed(exec_ctx, ValueError("boom"))
+        commit_tasks([exec_ctx])
+        assert Task.get_one_or_none("t-2").status == Task.config.ignored_status
+
+        # succeeded task can only be claimed with more_pending_status
+        assert claim_tasks([task_0]) == [None]
+        (claim,) = claim_tasks([task_0], Task.config.succeeded_status)
+        assert claim.previous_status == Task.config.succeeded_status
+
+    def test_commit_lost_lock(self):
+        task_list = self.make_tasks(2)
+        exec_ctx_list = [claim.exec_ctx for claim in claim_tasks(task_list)]
+        for exec_ctx in exec_ctx_list:
+            set_succeeded(exec_ctx)
+        # the lock of t-0 is taken over by someone else
+        Task.get_one_or_none("t-0").update(actions=[Task.lock.set("other")])
+        errors = commit_tasks(exec_ctx_list)
+        assert [exec_ctx.task.task_id for exec_ctx, _ in errors] == ["t-0"]
+        # the other task is not affected by the failed transaction
+        task_1 = Task.get_one_or_none("t-1")
+        assert task_1.status == Task.config.succeeded_status
+
+        with pytest.raises(ValueError):
+            commit_tasks(exec_ctx_list * 51)
+
+    def test_leaser_and_batcher(self):
+        task_list = self.make_tasks(5)
+        leaser = TaskLeaser(task_list=task_list, batch_size=2)
+        with CompletionBatcher(batch_size=2, max_age=60) as batcher:
+            for task in task_list[:3]:
+                exec_ctx = leaser.get(task).exec_ctx
+                set_succeeded(exec_ctx)
+                batcher.add(exec_ctx)
+            leaser.close(batcher)
+        assert leaser.to_dict() == {
+            "batch_size": 2,
+            "n_claimed": 4,
+            "n_rejected": 0,
+            "n_released": 1,
+        }
+        assert batcher.n_committed == 4
+        status_list = [Task.get_one_or_none(task.task_id).status for task in task_list]
+        assert status_list == [16, 16, 16, 10, 10]
+        assert Task.get_one_or_none("t-3").lock == Task.lock.default
+
+        # the task is locked by another worker
+        leaser = TaskLeaser(task_list=task_list)
+        with pytest.raises(st.TaskIsNotReadyToStartError):
+            leaser.get(task_list[0])
+
+    def test_leaser_with_queried_tasks(self):
+        self.make_tasks(4)
+        # t-3 failed once
+        (claim,) = claim_tasks([Task.get_one_or_none("t-3")])
+        set_failed(claim.exec_ctx, ValueError("boom"))
+        commit_tasks([claim.exec_ctx])
+
+        # the tasks queried from the index only have the projected attributes
+        task_list = list(
+            Task.query_by_status(
+                [Task.config.pending_status, Task.config.failed_status], limit=10
+            )
+        )
+        assert len(task_list) == 4
+        assert {task.status for task in task_list} == {None}
+
+        leaser = TaskLeaser(task_list=task_list, batch_size=4)
+        with CompletionBatcher(batch_size=10, max_age=60) as batcher:
+            exec_ctx = leaser.get(task_list[0]).exec_ctx
+            set_succeeded(exec_ctx)
+            batcher.add(exec_ctx)
+            leaser.close(batcher)
+        assert leaser.n_released == 3
+        assert batcher.n_committed == 4
+        task_dict = {task.task_id: task for task in Task.scan()}
+        assert task_dict[task_list[0].task_id].status == Task.config.succeeded_status
+        for task in task_list[1:]:
+            task = task_dict[task.task_id]
+            assert task.lock == Task.lock.default
+            if task.task_id == "t-3":
+                assert task.status == Task.config.failed_status
+                assert task.retry == 1
+            else:
+                assert task.status == Task.config.pending_status
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.lease", preview=False)
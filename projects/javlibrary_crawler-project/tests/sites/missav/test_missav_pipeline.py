@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from datetime import timedelta
+
+import pytest
+
+from javlibrary_crawler.utils import get_utc_now
+from javlibrary_crawler.sites.missav.downloader import MalformedHtmlError
+from javlibrary_crawler.sites.missav.drain import GracefulDrain
+from javlibrary_crawler.sites.missav.pipeline import (
+    Stage,
+    run_pipeline,
+    make_deadline_checker,
+)
+
+
+def test_run_pipeline():
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+    done = list()
+    failed = list()
+
+    def download(item: int) -> int:
+        if item % 5 == 0:
+            raise MalformedHtmlError
+        return item * 10
+
+    def upload(item: int) -> int:
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.02)
+        with lock:
+            running["now"] -= 1
+        return item + 1
+
+    result = run_pipeline(
+        items=range(1, 21),
+        stages=[
+            Stage(name="download", func=download),
+            Stage(name="upload", func=upload, n_worker=3),
+        ],
+        queue_size=2,
+        on_success=done.append,
+        on_error=lambda item, e: failed.append(item),
+    )
+    assert result.n_total == 20
+    assert result.n_succeeded == 16
+    assert result.n_ignored == 4
+    assert result.n_not_started == 0
+    assert result.is_time_up is False
+    assert result.is_stopped is False
+    assert sorted(done) == [i * 10 + 1 for i in range(1, 21) if i % 5]
+    assert sorted(failed) == [5, 10, 15, 20]
+    assert 1 < running["max"] <= 3
+
+
+def test_run_pipeline_is_time_up():
+    counter = {"n": 0}
+
+    def is_time_up() -> bool:
+        counter["n"] += 1
+        return counter["n"] > 3
+
+    result = run_pipeline(
+        items=range(10),
+        stages=[Stage(name="noop", func=lambda item: item)],
+        is_time_up=is_time_up,
+    )
+    assert result.is_time_up is True
+    assert result.is_stopped is False
+    assert result.n_not_started > 0
+
+    result = run_pipeline(
+        items=range(10),
+        stages=[Stage(name="noop", func=lambda item: item)],
+        is_time_up=make_deadline_checker(
+            end_at=get_utc_now() + timedelta(seconds=1), task_processing_time=2
+        ),
+    )
+    assert result.is_time_up is True
+    assert result.is_stopped is False
+    assert result.n_not_started == 10
+
+
+def test_run_pipeline_should_stop():
+    drain = GracefulDrain(grace_period=60)
+
+    def download(item: int) -> int:
+        if item == 2:
+            drain.request("test")
+        return item
+
+    result = run_pipeline(
+        items=range(10),
+        stages=[
+            Stage(name="download", func=download),
+            Stage(name="upload", func=lambda item: item),
+        ],
+        queue_size=1,
+        is_time_up=lambda: False,
+        should_stop=drain.should_stop,
+    )
+    # a drain is not reported as time up
+    assert result.is_stopped is True
+    assert result.is_time_up is False
+    assert result.n_succeeded == 3
+    assert result.n_not_started == 7
+    drain.uninstall()
+
+
+def test_run_pipeline_error():
+    failed = list()
+
+    def upload(item: int):
+        if item == 3:
+            raise ValueError
+        return item
+
+    with pytest.raises(ValueError):
+        run_pipeline(
+            items=range(10),
+            stages=[
+                Stage(name="download", func=lambda item: item),
+                Stage(name="upload", func=upload, n_worker=2),
+            ],
+            on_error=lambda item, e: failed.append(item),
+        )
+    assert failed == [3]
+
+    with pytest.raises(ValueError):
+        run_pipeline(items=[], stages=[])
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.pipeline", preview=False)
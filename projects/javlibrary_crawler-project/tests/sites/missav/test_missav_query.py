@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import time
+from datetime import datetime, timezone, timedelta
+
+import pytest
+import pynamodb_mate.api as pm
+
+from javlibrary_crawler.sites.missav.query import (
+    get_status_shard_list,
+    query_for_unfinished_in_parallel,
+)
+
+st = pm.patterns.status_tracker
+
+
+class Task(st.BaseTask):
+    class Meta:
+        table_name = "javlibrary-crawler-test-query"
+        region = "us-east-1"
+
+    config = st.TrackerConfig.make(
+        use_case_id="test",
+        pending_status=10,
+        in_progress_status=12,
+        failed_status=14,
+        succeeded_status=16,
+        ignored_status=18,
+        n_pending_shard=3,
+        n_in_progress_shard=1,
+        n_failed_shard=2,
+        n_succeeded_shard=1,
+        n_ignored_shard=1,
+    )
+
+    status_and_update_time_index = st.StatusAndUpdateTimeIndex()
+
+
+class FakeIndex:
+    """
+    Each shard is a list of tasks sorted by update_time. Every query takes
+    ``delay`` seconds to simulate the network round trip.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.shards = dict()
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        i = 0
+        for status, shard_id in get_status_shard_list(Task, [10, 14]):
+            hash_key = Task.make_value(status=status, _shard_id=shard_id)
+            tasks = list()
+            for _ in range(4):
+                i += 1
+                tasks.append(
+                    Task.make(
+                        task_id=f"t-{i}",
+                        _status=status,
+                        _shard_id=shard_id,
+                        update_time=start + timedelta(minutes=(i * 7) % 20),
+                    )
+                )
+            self.shards[hash_key] = sorted(tasks, key=lambda t: t.update_time)
+
+    def query(self, hash_key, scan_index_forward, limit):
+        time.sleep(self.delay)
+        tasks = self.shards[hash_key]
+        if not scan_index_forward:
+            tasks = tasks[::-1]
+        return iter(tasks[:limit])
+
+
+def test_get_status_shard_list():
+    assert get_status_shard_list(Task, [10, 14]) == [
+        (10, 1),
+        (10, 2),
+        (10, 3),
+        (14, 1),
+        (14, 2),
+    ]
+
+
+def test_get_status_shard_list_by_worker():
+    assert get_status_shard_list(Task, [10, 14], worker_index=0, n_worker=2) == [
+        (10, 1),
+        (10, 3),
+        (14, 1),
+    ]
+    assert get_status_shard_list(Task, [10, 14], worker_index=1, n_worker=2) == [
+        (10, 2),
+        (14, 2),
+    ]
+    # a worker may not own any shard of a status
+    assert get_status_shard_list(Task, [10, 14], worker_index=2, n_worker=3) == [
+        (10, 3),
+    ]
+
+    # the shards of all workers are disjoint and cover all shards
+    for n_worker in range(1, 6):
+        shard_list = list()
+        for worker_index in range(n_worker):
+            shard_list.extend(
+                get_status_shard_list(
+                    Task, [10, 14], worker_index=worker_index, n_worker=n_worker
+                )
+            )
+        assert sorted(shard_list) == get_status_shard_list(Task, [10, 14])
+
+    with pytest.raises(ValueError):
+        get_status_shard_list(Task, [10, 14], worker_index=2, n_worker=2)
+    with pytest.raises(ValueError):
+        get_status_shard_list(Task, [10, 14], worker_index=0, n_worker=0)
+
+
+def test_query_for_unfinished_in_parallel(monkeypatch):
+    index = FakeIndex(delay=0.2)
+    monkeypatch.setattr(Task, "_get_status_index", classmethod(lambda cls: index))
+
+    st_time = time.monotonic()
+    task_list = list(
+        query_for_unfinished_in_parallel(Task, limit=3, older_task_first=False)
+    )
+    # 5 shard queries run at the same time
+    assert time.monotonic() - st_time < 0.6
+    assert len(task_list) == 5 * 3
+    update_time_list = [task.update_time for task in task_list]
+    assert update_time_list == sorted(update_time_list, reverse=True)
+
+    task_list = list(query_for_unfinished_in_parallel(Task, limit=10))
+    assert len(task_list) == 5 * 4
+    update_time_list = [task.update_time for task in task_list]
+    assert update_time_list == sorted(update_time_list)
+
+    # two workers get disjoint tasks
+    task_id_set_list = [
+        {
+            task.key
+            for task in query_for_unfinished_in_parallel(
+                Task, limit=10, worker_index=worker_index, n_worker=2
+            )
+        }
+        for worker_index in range(2)
+    ]
+    assert len(task_id_set_list[0]) == 3 * 4
+    assert len(task_id_set_list[1]) == 2 * 4
+    assert not (task_id_set_list[0] & task_id_set_list[1])
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.query", preview=False)
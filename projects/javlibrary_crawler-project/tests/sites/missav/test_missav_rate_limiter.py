@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from javlibrary_crawler.sites.missav.rate_limiter import AdaptiveRateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def make_limiter(**kwargs) -> AdaptiveRateLimiter:
+    clock = FakeClock()
+    return AdaptiveRateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestAdaptiveRateLimiter:
+    def test_acquire(self):
+        limiter = make_limiter(rate=2, burst=1)
+        assert limiter.acquire() == 0  # the bucket starts full
+        assert limiter.acquire() == pytest.approx(0.5)
+        assert limiter.acquire() == pytest.approx(0.5)
+        assert limiter.clock() == pytest.approx(1.0)
+
+    def test_additive_increase(self):
+        limiter = make_limiter(rate=1, max_rate=1.2, increase=0.05)
+        for _ in range(3):
+            limiter.on_success()
+        assert limiter.rate == pytest.approx(1.15)
+        for _ in range(10):
+            limiter.on_success()
+        assert limiter.rate == pytest.approx(1.2)
+        assert limiter.n_success == 13
+
+    def test_multiplicative_decrease(self):
+        limiter = make_limiter(rate=4, min_rate=0.5, decrease_factor=0.5, cooldown=2)
+        limiter.on_throttle(reason="HTTP 429")
+        assert limiter.rate == 2
+        # within the cooldown window, only count it
+        limiter.on_throttle(reason="HTTP 503")
+        assert limiter.rate == 2
+        assert limiter.n_throttle == 2
+
+        limiter.sleep(2)
+        limiter.on_throttle(reason="HTTP 503")
+        assert limiter.rate == 1
+        limiter.sleep(2)
+        limiter.on_throttle(reason="HTTP 503")
+        limiter.sleep(2)
+        limiter.on_throttle(reason="HTTP 503")
+        assert limiter.rate == 0.5
+        assert limiter.interval == 2
+
+    def test_validation(self):
+        with pytest.raises(ValueError):
+            make_limiter(rate=10, max_rate=8)
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.rate_limiter", preview=False)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import typing as T
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from javlibrary_crawler.sites.missav.downloader import HttpError
+from javlibrary_crawler.sites.missav.retry import (
+    RetryGiveUpError,
+    RetryBudget,
+    RetryPolicy,
+    is_retryable,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += timedelta(seconds=seconds)
+
+
+class Flaky:
+    def __init__(self, n_failure: int, status_code: T.Optional[int] = None):
+        self.n_failure = n_failure
+        self.status_code = status_code
+        self.n_call = 0
+
+    def __call__(self) -> str:
+        self.n_call += 1
+        if self.n_call <= self.n_failure:
+            raise HttpError(status_code=self.status_code)
+        return "ok"
+
+
+def make_policy(**kwargs) -> RetryPolicy:
+    clock = FakeClock()
+    return RetryPolicy(now=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_is_retryable():
+    assert is_retryable(HttpError()) is True
+    assert is_retryable(HttpError(status_code=503)) is True
+    assert is_retryable(HttpError(status_code=429)) is True
+    assert is_retryable(HttpError(status_code=408)) is True
+    assert is_retryable(HttpError(status_code=404)) is False
+    assert is_retryable(HttpError(status_code=403)) is False
+    assert is_retryable(ValueError()) is True
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, min_retries=1)
+    assert budget.try_spend() is True
+    assert budget.try_spend() is False
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_spend() is True
+    assert budget.try_spend() is False
+    assert budget.to_dict() == {"n_request": 2, "n_retry": 2}
+
+
+class TestRetryPolicy:
+    def test_get_wait(self):
+        policy = RetryPolicy()
+        assert [policy.get_wait(i) for i in range(1, 9)] == [
+            2,
+            2,
+            4,
+            8,
+            16,
+            32,
+            60,
+            60,
+        ]
+
+    def test_call(self):
+        policy = make_policy()
+        func = Flaky(n_failure=3)
+        assert policy.call(func) == "ok"
+        assert func.n_call == 4
+        assert policy.now() - FakeClock().now == timedelta(seconds=8)
+
+        # other errors are not retried
+        def func():
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            policy.call(func)
+
+    def test_max_attempts(self):
+        policy = make_policy(max_attempts=3)
+        func = Flaky(n_failure=5)
+        # only this task gives up, the error is ignored by the crawler
+        with pytest.raises(RetryGiveUpError) as exc_info:
+            policy.call(func)
+        assert isinstance(exc_info.value.__cause__, HttpError)
+        assert func.n_call == 3
+
+    def test_not_retryable(self):
+        policy = make_policy()
+        func = Flaky(n_failure=5, status_code=404)
+        with pytest.raises(RetryGiveUpError) as exc_info:
+            policy.call(func)
+        assert exc_info.value.__cause__.status_code == 404
+        assert func.n_call == 1
+        assert policy.now() == FakeClock().now
+
+        # 429 is retried
+        func = Flaky(n_failure=2, status_code=429)
+        assert policy.call(func) == "ok"
+        assert func.n_call == 3
+
+    def test_deadline(self):
+        policy = make_policy(attempt_time=5)
+        deadline = policy.now() + timedelta(seconds=20)
+        func = Flaky(n_failure=10)
+        with pytest.raises(RetryGiveUpError) as exc_info:
+            policy.call(func, deadline=deadline)
+        assert isinstance(exc_info.value.__cause__, HttpError)
+        # wait 2 + 2 + 4 seconds, the next wait 8 + 5 would pass the deadline
+        assert func.n_call == 4
+        assert policy.now() <= deadline
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0, min_retries=2)
+        policy = make_policy(budget=budget)
+        assert policy.call(Flaky(n_failure=1)) == "ok"
+        func = Flaky(n_failure=5)
+        # only this task gives up, the error is ignored by the crawler
+        with pytest.raises(RetryGiveUpError) as exc_info:
+            policy.call(func)
+        assert isinstance(exc_info.value.__cause__, HttpError)
+        assert func.n_call == 2
+        assert budget.to_dict() == {"n_request": 2, "n_retry": 2}
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.retry", preview=False)
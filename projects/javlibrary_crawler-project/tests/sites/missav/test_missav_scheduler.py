@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from javlibrary_crawler.sites.missav.scheduler import interleave_by_weight
+
+
+def test_interleave_by_weight():
+    assert interleave_by_weight(
+        {"a": [1, 2, 3, 4], "b": [5, 6]},
+        {"a": 2, "b": 1},
+    ) == [1, 5, 2, 3, 6, 4]
+
+    # equal weights, round-robin
+    assert interleave_by_weight(
+        {"a": [1, 2, 3], "b": [4, 5, 6], "c": [7, 8, 9]},
+        {"a": 1, "b": 1, "c": 1},
+    ) == [1, 4, 7, 2, 5, 8, 3, 6, 9]
+
+    # every prefix is proportional to the weights
+    result = interleave_by_weight(
+        {"a": ["a"] * 300, "b": ["b"] * 100},
+        {"a": 3, "b": 1},
+    )
+    for i in range(4, len(result) + 1, 4):
+        assert result[:i].count("b") == i // 4
+
+    # when one list is drained, the rest of the items go to the other lists
+    result = interleave_by_weight(
+        {"a": ["a"] * 2, "b": ["b"] * 10},
+        {"a": 10, "b": 1},
+    )
+    assert result[:3].count("a") == 2
+    assert result[3:] == ["b"] * 9
+
+    # empty lists are skipped
+    assert interleave_by_weight({"a": [], "b": [1, 2]}, {"a": 1, "b": 1}) == [1, 2]
+    assert interleave_by_weight({}, {}) == []
+
+
+def test_interleave_by_weight_error():
+    with pytest.raises(ValueError):
+        interleave_by_weight({"a": [1], "b": [2]}, {"a": 1, "b": 0})
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.scheduler", preview=False)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from s3pathlib import S3Path
+
+from javlibrary_crawler.sites.missav.segment import (
+    SegmentPointer,
+    is_segment_uri,
+    pack_segment,
+    unpack_segment,
+    SegmentWriter,
+)
+
+
+def test_segment_pointer():
+    pointer = SegmentPointer(bucket="my-bucket", key="a/b/1.seg", offset=10, length=20)
+    assert pointer.uri == "s3://my-bucket/a/b/1.seg?offset=10&length=20"
+    assert SegmentPointer.from_uri(pointer.uri) == pointer
+    assert pointer.s3path.uri == "s3://my-bucket/a/b/1.seg"
+    assert is_segment_uri(pointer.uri) is True
+    assert is_segment_uri("s3://my-bucket/a/b/attr=html/md5=abc") is False
+
+
+def test_pack_segment():
+    entries = [("a", b"hello"), ("b", b""), ("c", b"world!")]
+    data, position_list = pack_segment(entries)
+    assert position_list == [(0, 5), (5, 0), (5, 6)]
+    for (key, content), (offset, length) in zip(entries, position_list):
+        assert data[offset : offset + length] == content
+    assert unpack_segment(data) == dict(entries)
+
+
+class FakeS3Dir:
+    """
+    Mimic the ``joinpath`` / ``write_bytes`` of the segment directory in memory.
+    """
+
+    def __init__(self):
+        self.objects = dict()
+        self.fail = False
+
+    def joinpath(self, name: str) -> "FakeS3Path":
+        return FakeS3Path(self, name)
+
+
+class FakeS3Path(S3Path):
+    def __new__(cls, s3dir: FakeS3Dir, name: str):
+        obj = S3Path.__new__(cls, "bucket", "segments", name)
+        obj.fake_s3dir = s3dir
+        return obj
+
+    def write_bytes(self, data: bytes, bsm=None):
+        if self.fake_s3dir.fail:
+            raise ConnectionError("S3 is down")
+        self.fake_s3dir.objects[self.key] = data
+
+
+def make_writer(s3dir: FakeS3Dir, **kwargs):
+    flushed = list()
+    failed = list()
+    writer = SegmentWriter(
+        s3dir=s3dir,
+        bsm=None,
+        on_flush=lambda pairs: flushed.extend(pairs),
+        on_error=lambda items, e: failed.extend(items),
+        **kwargs,
+    )
+    return writer, flushed, failed
+
+
+def read_pointer(s3dir: FakeS3Dir, pointer: SegmentPointer) -> bytes:
+    data = s3dir.objects[pointer.key]
+    return data[pointer.offset : pointer.offset + pointer.length]
+
+
+def test_segment_writer_max_size():
+    s3dir = FakeS3Dir()
+    writer, flushed, failed = make_writer(s3dir, max_size=10, max_age=3600)
+    with writer:
+        for i in range(7):
+            writer.append(i, key=f"k{i}", content=f"item-{i}".encode())
+        # every 2 items make a full segment
+        assert writer.n_segment == 3
+    assert writer.n_segment == 4
+    assert writer.n_entry == 7
+    assert [item for item, _ in flushed] == list(range(7))
+    for item, pointer in flushed:
+        assert read_pointer(s3dir, pointer) == f"item-{item}".encode()
+    assert len({pointer.key for _, pointer in flushed}) == 4
+    assert failed == []
+
+
+def test_segment_writer_max_age():
+    s3dir = FakeS3Dir()
+    writer, flushed, failed = make_writer(s3dir, max_size=1000, max_age=0.1)
+    with writer:
+        writer.append("a", key="a", content=b"aaa")
+        writer.append("b", key="b", content=b"bbb")
+        time.sleep(0.5)
+        # flushed by the background thread
+        assert [item for item, _ in flushed] == ["a", "b"]
+        writer.append("c", key="c", content=b"ccc")
+    assert [item for item, _ in flushed] == ["a", "b", "c"]
+    assert writer.n_segment == 2
+
+
+def test_segment_writer_error():
+    s3dir = FakeS3Dir()
+    s3dir.fail = True
+    writer, flushed, failed = make_writer(s3dir, max_size=1000, max_age=3600)
+    with writer:
+        writer.append("a", key="a", content=b"aaa")
+    assert flushed == []
+    assert failed == ["a"]
+    assert writer.n_entry == 0
+
+
+def test_segment_writer_thread_safe():
+    s3dir = FakeS3Dir()
+    writer, flushed, failed = make_writer(s3dir, max_size=50, max_age=0.01)
+
+    def run(i: int):
+        for j in range(20):
+            writer.append((i, j), key=f"{i}-{j}", content=f"{i}-{j}".encode())
+
+    with writer:
+        thread_list = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+    assert len(flushed) == 80
+    for (i, j), pointer in flushed:
+        assert read_pointer(s3dir, pointer) == f"{i}-{j}".encode()
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.segment", preview=False)
@@ -1,21 +1,218 @@
 # -*- coding: utf-8 -*-
 
+import gzip
+
+import pytest
 from pathlib_mate import Path
-from javlibrary_crawler.sites.missav.sitemap import parse_actresses_xml, parse_item_xml
+
+import javlibrary_crawler.sites.missav.sitemap as sitemap
+from javlibrary_crawler.tests.missav_stand_in import MissavStandInServer
+from javlibrary_crawler.sites.missav.downloader import HttpClient
+from javlibrary_crawler.sites.missav.retry import RetryGiveUpError, RetryPolicy
+from javlibrary_crawler.sites.missav.constants import LangCodeEnum
+from javlibrary_crawler.sites.missav.sitemap import (
+    IncompleteXmlError,
+    ItemUrl,
+    SiteMapSnapshot,
+    get_done_marker,
+    is_downloaded,
+    download_sitemap_file,
+    parse_actresses_xml,
+    parse_item_xml,
+)
+
+dir_here = Path.dir_here(__file__)
+ITEM_XML = gzip.decompress((dir_here / "sitemap_items_1.xml.gz").read_bytes())
+
+
+def make_retry_policy(max_attempts: int = 5) -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=max_attempts,
+        retry_on=sitemap.make_sitemap_retry_policy().retry_on,
+        sleep=lambda seconds: None,
+    )
+
+
+def make_sitemap_xml(url_list, lastmod_list=None) -> bytes:
+    if lastmod_list is None:
+        locs = "".join(f"<sitemap><loc>{url}</loc></sitemap>" for url in url_list)
+    else:
+        locs = "".join(
+            f"<sitemap><loc>{url}</loc><lastmod>{lastmod}</lastmod></sitemap>"
+            for url, lastmod in zip(url_list, lastmod_list)
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f"{locs}</sitemapindex>"
+    ).encode("utf-8")
 
 
 def test_parse_actresses_xml():
     p = Path.dir_here(__file__) / "sitemap_actresses_1.xml.gz"
-    actress_url_list = parse_actresses_xml(p)
+    actress_url_list = list(parse_actresses_xml(p))
     assert len(actress_url_list) == 3 * 13
 
 
 def test_parse_item_xml():
     p = Path.dir_here(__file__) / "sitemap_items_1.xml.gz"
-    item_url_list = parse_item_xml(p)
+    item_url_list = list(parse_item_xml(p))
     assert len(item_url_list) == 3 * 13
 
 
+def test_group_by_lang():
+    p = dir_here / "sitemap_items_1.xml.gz"
+    lang_code_list = [LangCodeEnum.cn, LangCodeEnum.ja]
+    mapping = ItemUrl.group_by_lang(parse_item_xml(p), lang_code_list)
+    assert list(mapping) == lang_code_list
+    for lang_code in lang_code_list:
+        assert mapping[lang_code] == ItemUrl.filter_by_lang(
+            parse_item_xml(p), lang_code
+        )
+        assert len(mapping[lang_code]) == 3
+
+
+def test_parse_streaming():
+    for p in [
+        dir_here / "sitemap_items_1.xml.gz",
+        dir_here / "sitemap_actresses_1.xml.gz",
+    ]:
+        assert list(sitemap._parse_actress_or_item_xml_v3(p)) == (
+            sitemap._parse_actress_or_item_xml_v2(p)
+        )
+
+
+def test_download_sitemap_file(tmp_path):
+    path = Path(tmp_path, "sitemap_items_1.xml.gz")
+    with MissavStandInServer(html=ITEM_XML, error_rate=0.3, seed=1) as server:
+        url = f"{server.endpoint}/sitemap_items_1.xml"
+        with HttpClient(pool_size=2) as client:
+            assert download_sitemap_file(url, path, client, make_retry_policy())
+            assert gzip.decompress(path.read_bytes()) == ITEM_XML
+            assert is_downloaded(path)
+            n_request = server.n_request
+            # resume, the complete file is skipped
+            assert download_sitemap_file(url, path, client) is False
+            assert server.n_request == n_request
+
+            # the file without a valid marker is downloaded again
+            path.write_bytes(path.read_bytes()[:10])
+            assert is_downloaded(path) is False
+            assert download_sitemap_file(url, path, client, make_retry_policy())
+            assert gzip.decompress(path.read_bytes()) == ITEM_XML
+
+    # the server always returns a truncated xml
+    path = Path(tmp_path, "sitemap_items_2.xml.gz")
+    with MissavStandInServer(html=ITEM_XML[:-100]) as server:
+        url = f"{server.endpoint}/sitemap_items_2.xml"
+        with HttpClient(pool_size=2) as client:
+            with pytest.raises(RetryGiveUpError) as exc_info:
+                download_sitemap_file(url, path, client, make_retry_policy(2))
+            assert isinstance(exc_info.value.__cause__, IncompleteXmlError)
+        assert server.n_request == 2
+    assert path.exists() is False
+    assert get_done_marker(path).exists() is False
+    # no temp file is left behind
+    assert [p.basename for p in Path(tmp_path).select_file()] == [
+        "sitemap_items_1.xml.gz",
+        "sitemap_items_1.xml.gz.done",
+    ]
+
+
+def test_snapshot_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(sitemap, "dir_missav_sitemap", Path(tmp_path))
+    snapshot = SiteMapSnapshot(md5="abc")
+    snapshot.dir_sitemap_snapshot.mkdir_if_not_exists()
+    with MissavStandInServer(html=ITEM_XML, error_rate=0.2, seed=1) as server:
+        url_list = [f"{server.endpoint}/sitemap_items_{i}.xml" for i in range(1, 21)]
+        snapshot.path_missav_sitemap_xml_gz.write_bytes(
+            gzip.compress(make_sitemap_xml(url_list))
+        )
+        assert snapshot.get_xml_url_list() == url_list
+        with HttpClient(pool_size=4) as client:
+            stats = snapshot.download(
+                client=client, concurrency=4, retry_policy=make_retry_policy()
+            )
+            assert stats == {
+                "n_total": 20,
+                "n_downloaded": 20,
+                "n_reused": 0,
+                "n_skipped": 0,
+                "n_failed": 0,
+            }
+            assert len(snapshot.get_item_xml_list()) == 20
+
+            # simulate an interrupted run
+            get_done_marker(snapshot.get_item_xml(3)).remove()
+            stats = snapshot.download(
+                client=client, concurrency=4, retry_policy=make_retry_policy()
+            )
+            assert stats["n_downloaded"] == 1
+            assert stats["n_skipped"] == 19
+
+    # the site is down, the other files are still downloaded
+    get_done_marker(snapshot.get_item_xml(5)).remove()
+    get_done_marker(snapshot.get_item_xml(6)).remove()
+    with MissavStandInServer(html=ITEM_XML, error_rate=1) as server:
+        url_list = [f"{server.endpoint}/sitemap_items_{i}.xml" for i in range(1, 21)]
+        snapshot.path_missav_sitemap_xml_gz.write_bytes(
+            gzip.compress(make_sitemap_xml(url_list))
+        )
+        with HttpClient(pool_size=2) as client:
+            with pytest.raises(RetryGiveUpError) as exc_info:
+                snapshot.download(
+                    client=client, concurrency=2, retry_policy=make_retry_policy(1)
+                )
+            assert isinstance(exc_info.value.__cause__, sitemap.HttpError)
+    assert is_downloaded(snapshot.get_item_xml(4))
+
+
+def test_incremental_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(sitemap, "dir_missav_sitemap", Path(tmp_path))
+    assert SiteMapSnapshot.latest() is None
+
+    def make_snapshot(md5, parent_md5, url_list, lastmod_list) -> SiteMapSnapshot:
+        snapshot = SiteMapSnapshot(md5=md5)
+        snapshot.dir_sitemap_snapshot.mkdir_if_not_exists()
+        snapshot.write_metadata(parent_md5=parent_md5)
+        snapshot.path_missav_sitemap_xml_gz.write_bytes(
+            gzip.compress(make_sitemap_xml(url_list, lastmod_list))
+        )
+        return snapshot
+
+    with MissavStandInServer(html=ITEM_XML) as server:
+        url_list = [f"{server.endpoint}/sitemap_items_{i}.xml" for i in range(1, 6)]
+        with HttpClient(pool_size=2) as client:
+            snapshot_1 = make_snapshot("v1", None, url_list[:4], ["2024-01-01"] * 4)
+            assert (
+                snapshot_1.download(client=client, concurrency=2)["n_downloaded"] == 4
+            )
+            # the 4th file is changed, the 5th file is new,
+            # the 3rd file of the parent is incomplete
+            get_done_marker(snapshot_1.get_item_xml(3)).remove()
+            snapshot_2 = make_snapshot(
+                "v2", "v1", url_list, ["2024-01-01"] * 3 + ["2024-02-01"] * 2
+            )
+            n_request = server.n_request
+            stats = snapshot_2.download(client=client, concurrency=2)
+            assert stats["n_reused"] == 2
+            assert stats["n_downloaded"] == 3
+            assert server.n_request == n_request + 3
+
+    path_1 = snapshot_1.get_item_xml(1)
+    path_2 = snapshot_2.get_item_xml(1)
+    assert path_1.stat().st_ino == path_2.stat().st_ino
+    assert is_downloaded(path_2)
+    assert snapshot_2.parent.md5 == "v1"
+    assert snapshot_2.get_lineage() == ["v2", "v1"]
+    assert snapshot_1.parent is None
+    assert [snapshot.md5 for snapshot in SiteMapSnapshot.list_snapshots()] == [
+        "v1",
+        "v2",
+    ]
+    assert SiteMapSnapshot.latest().md5 == "v2"
+
+
 if __name__ == "__main__":
     from javlibrary_crawler.tests import run_cov_test
 
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+
+import pytest
+
+from javlibrary_crawler.sites.missav.latency import LatencyStats
+from javlibrary_crawler.sites.missav.telemetry import Histogram, CrawlTelemetry
+
+
+class TestHistogram:
+    def test_percentile(self):
+        histogram = Histogram()
+        assert histogram.percentile(50) is None
+        assert histogram.to_dict()["p99"] is None
+
+        random.seed(1)
+        samples = [random.expovariate(2) for _ in range(5000)] + [0]
+        latency = LatencyStats(samples=samples, max_samples=len(samples))
+        for value in samples:
+            histogram.add(value)
+        assert histogram.count == len(samples)
+        assert histogram.min == 0
+        assert histogram.max == max(samples)
+        assert histogram.total == pytest.approx(sum(samples))
+        for q in [50, 95, 99]:
+            assert histogram.percentile(q) == pytest.approx(
+                latency.percentile(q), rel=0.02
+            )
+        assert histogram.percentile(100) == max(samples)
+        assert histogram.percentile(101) == max(samples)
+        assert histogram.percentile(0) == 0
+
+
+class TestCrawlTelemetry:
+    def test(self):
+        telemetry = CrawlTelemetry()
+
+        def work():
+            for _ in range(100):
+                with telemetry.timer("http"):
+                    pass
+                telemetry.observe("http_bytes", 1024)
+                telemetry.incr("succeeded")
+
+        thread_list = [threading.Thread(target=work) for _ in range(4)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+
+        with pytest.raises(ValueError):
+            with telemetry.timer("s3_put"):
+                raise ValueError
+
+        report = telemetry.to_dict()
+        assert report["counters"] == {"succeeded": 400}
+        assert list(report["histograms"]) == ["http", "http_bytes", "s3_put"]
+        assert report["histograms"]["http"]["count"] == 400
+        assert report["histograms"]["http_bytes"]["p50"] == 1024
+        assert report["histograms"]["s3_put"]["count"] == 1
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.telemetry", preview=False)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+
+import pytest
+from pathlib_mate import Path
+
+import javlibrary_crawler.sites.missav.sitemap as sitemap
+from javlibrary_crawler.sites.missav.constants import LangCodeEnum
+from javlibrary_crawler.sites.missav.sitemap import (
+    SiteMapSnapshot,
+    ItemUrl,
+    parse_item_xml,
+)
+from javlibrary_crawler.sites.missav.url_index import (
+    UrlIndex,
+    get_path_url_index,
+    is_url_index_fresh,
+    open_url_index,
+)
+
+dir_here = Path.dir_here(__file__)
+path_items_xml = dir_here / "sitemap_items_1.xml.gz"
+path_actresses_xml = dir_here / "sitemap_actresses_1.xml.gz"
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch) -> SiteMapSnapshot:
+    monkeypatch.setattr(sitemap, "dir_missav_sitemap", Path(tmp_path))
+    snapshot = SiteMapSnapshot(md5="abc")
+    snapshot.dir_sitemap_snapshot.mkdir_if_not_exists()
+    # rows follow the number in the file name, not the order of creation
+    for ith in [10, 2]:
+        shutil.copy(path_items_xml.abspath, snapshot.get_item_xml(ith).abspath)
+    return snapshot
+
+
+def test_url_index(snapshot: SiteMapSnapshot):
+    expected = list(parse_item_xml(path_items_xml))
+    with open_url_index(snapshot) as url_index:
+        assert len(url_index) == 2 * len(expected)
+        assert list(url_index.iter_item_urls()) == expected * 2
+        assert url_index.get_row_range(2) == (0, len(expected))
+        assert url_index.get_row_range(10) == (len(expected), 2 * len(expected))
+        assert url_index.get_row_range(3) == (0, 0)
+        assert url_index.position[len(expected) + 1] == 1
+        assert url_index.file_ith[len(expected)] == 10
+
+        lang_code_list = [LangCodeEnum.cn, LangCodeEnum.ja]
+        mask = url_index.mask(lang_code_list)
+        assert mask == bytes(
+            int(item_url.lang in [lang_code.value for lang_code in lang_code_list])
+            for item_url in expected * 2
+        )
+        assert list(url_index.iter_item_urls([LangCodeEnum.cn], file_ith=10)) == (
+            ItemUrl.filter_by_lang(expected, LangCodeEnum.cn)
+        )
+        assert url_index.group_by_lang(lang_code_list, file_ith=2) == (
+            ItemUrl.group_by_lang(expected, lang_code_list)
+        )
+        assert list(url_index.iter_item_urls([LangCodeEnum.cn], file_ith=3)) == []
+
+
+def test_rebuild(snapshot: SiteMapSnapshot):
+    path_index = get_path_url_index(snapshot)
+    open_url_index(snapshot).close()
+    path_list = snapshot.get_item_xml_list()
+    assert is_url_index_fresh(path_index, path_list)
+    mtime = path_index.stat().st_mtime_ns
+
+    # the index is reused
+    open_url_index(snapshot).close()
+    assert path_index.stat().st_mtime_ns == mtime
+
+    # the content of a file changed
+    shutil.copy(path_actresses_xml.abspath, snapshot.get_item_xml(10).abspath)
+    assert is_url_index_fresh(path_index, path_list) is False
+    with open_url_index(snapshot) as url_index:
+        assert list(url_index.iter_item_urls(file_ith=10)) == [
+            ItemUrl(url=actress_url.url, lang=actress_url.lang)
+            for actress_url in sitemap.parse_actresses_xml(path_actresses_xml)
+        ]
+
+    # a new file is added
+    shutil.copy(path_items_xml.abspath, snapshot.get_item_xml(11).abspath)
+    assert is_url_index_fresh(path_index, snapshot.get_item_xml_list()) is False
+
+    # not an index file
+    path_index.write_bytes(b"hello world")
+    assert UrlIndex.read_header(path_index) is None
+    with pytest.raises(ValueError):
+        UrlIndex.open(path_index)
+    with open_url_index(snapshot) as url_index:
+        assert len(url_index.header["files"]) == 3
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.url_index", preview=False)
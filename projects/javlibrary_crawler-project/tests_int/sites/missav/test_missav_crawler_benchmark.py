@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+``crawl_pending_tasks`` 的端到端 benchmark, 不需要访问 missav.com 和真实的 AWS:
+
+- missav.com 由 :class:`~javlibrary_crawler.tests.missav_stand_in.MissavStandInServer` 代替.
+- DynamoDB 和 S3 由 moto 代替.
+- 时钟由 :class:`~javlibrary_crawler.tests.missav_stand_in.ScaledClock` 代替, 一次完整的
+  ``GITHUB_ACTION_RUN_INTERVAL`` 运行被压缩到 ``RUN_SECONDS`` 秒以内.
+
+每个场景会打印每秒处理的任务数和每个步骤的 p50 / p95 耗时, 用来发现 ``downloader``,
+``dynamodb``, ``crawler`` 的性能退化. 注意任务的锁的过期时间是按真实时间计算的, 所以在
+加速的时钟下, 重试会比真实运行更早放弃.
+"""
+
+import typing as T
+import gzip
+import dataclasses
+from pathlib import Path
+
+import moto
+
+from javlibrary_crawler.logger import logger
+from javlibrary_crawler.config.api import config
+from javlibrary_crawler.tests.mock import BaseMockTest
+from javlibrary_crawler.tests.missav_stand_in import MissavStandInServer, ScaledClock
+from javlibrary_crawler.sites.missav.constants import (
+    LangCodeEnum,
+    GITHUB_ACTION_RUN_INTERVAL,
+)
+from javlibrary_crawler.sites.missav.rate_limiter import AdaptiveRateLimiter
+from javlibrary_crawler.sites.missav.downloader import HttpClient
+from javlibrary_crawler.sites.missav.dynamodb import lang_to_step1_mapping
+from javlibrary_crawler.sites.missav.crawler import crawl_pending_tasks
+
+dir_here = Path(__file__).absolute().parent
+path_fixture = (
+    dir_here.parent.parent.parent / "tests" / "sites" / "missav" / "abf-106-cn.html.gz"
+)
+
+N_TASK = 200
+RUN_SECONDS = 120
+STAGE_LIST = [
+    "task",
+    "http",
+    "compress",
+    "s3_put",
+    "dynamodb_lock",
+    "dynamodb_update",
+    "dynamodb_unlock",
+]
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str = dataclasses.field()
+    latency: float = dataclasses.field(default=0.05)
+    error_rate: float = dataclasses.field(default=0.0)
+    malformed_ratio: float = dataclasses.field(default=0.0)
+    concurrency: int = dataclasses.field(default=4)
+    use_pipeline: bool = dataclasses.field(default=False)
+    use_segment: bool = dataclasses.field(default=False)
+    use_batch_lock: bool = dataclasses.field(default=False)
+
+
+scenario_list = [
+    Scenario(name="healthy"),
+    Scenario(name="healthy pipeline", use_pipeline=True),
+    Scenario(name="healthy segment", use_segment=True),
+    Scenario(name="healthy pipeline segment", use_pipeline=True, use_segment=True),
+    Scenario(name="healthy batch lock", use_batch_lock=True),
+    Scenario(
+        name="healthy pipeline batch lock", use_pipeline=True, use_batch_lock=True
+    ),
+    Scenario(name="slow site", latency=0.5, concurrency=8),
+    Scenario(name="malformed", malformed_ratio=0.2),
+    Scenario(name="flaky", error_rate=0.05),
+]
+
+
+def summarize(scenario: Scenario, report: T.Dict[str, T.Any]) -> T.Dict[str, T.Any]:
+    result = report["result"]
+    n_done = result["n_succeeded"] + result["n_ignored"]
+    summary = {
+        "scenario": scenario.name,
+        "n_done": n_done,
+        "tasks_per_second": n_done / result["elapsed"],
+    }
+    for stage in STAGE_LIST:
+        histogram = report["histograms"].get(stage)
+        if histogram is not None:
+            summary[f"{stage}_p50"] = histogram["p50"]
+            summary[f"{stage}_p95"] = histogram["p95"]
+    return summary
+
+
+class Test(BaseMockTest):
+    mock_list = [
+        moto.mock_s3,
+        moto.mock_dynamodb,
+    ]
+    lang_code = LangCodeEnum.cn
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        cls.bsm.s3_client.create_bucket(Bucket=config.env.s3dir_missav.bucket)
+        cls.html = gzip.decompress(path_fixture.read_bytes())
+
+    def reset_table(self, server: MissavStandInServer):
+        klass = lang_to_step1_mapping[self.lang_code.value]
+        klass.set_connection(self.bsm)
+        if klass.exists():
+            klass.delete_table()
+        klass.create_table(wait=True)
+        with klass.batch_write() as batch:
+            for i in range(N_TASK):
+                batch.save(klass.make(task_id=server.make_url(f"abc-{i:04d}")))
+
+    def run_scenario(self, scenario: Scenario) -> T.Dict[str, T.Any]:
+        # start from scratch, don't let the latency history of the
+        # previous scenario affect this one
+        config.env.s3dir_missav_crawler_stats.delete(bsm=self.bsm)
+        with MissavStandInServer(
+            html=self.html,
+            latency=scenario.latency,
+            error_rate=scenario.error_rate,
+            malformed_ratio=scenario.malformed_ratio,
+            seed=1,
+        ) as server:
+            self.reset_table(server)
+            client = HttpClient(
+                pool_size=scenario.concurrency,
+                rate_limiter=AdaptiveRateLimiter(rate=50, max_rate=200),
+            )
+            with client:
+                with logger.disabled(disable=True):
+                    report = crawl_pending_tasks(
+                        lang_code=self.lang_code,
+                        concurrency=scenario.concurrency,
+                        client=client,
+                        use_pipeline=scenario.use_pipeline,
+                        use_segment=scenario.use_segment,
+                        use_batch_lock=scenario.use_batch_lock,
+                        now=ScaledClock(speed=GITHUB_ACTION_RUN_INTERVAL / RUN_SECONDS),
+                    )
+        return summarize(scenario, report)
+
+    def test(self):
+        summary_list = [self.run_scenario(scenario) for scenario in scenario_list]
+        for summary in summary_list:
+            print(
+                ", ".join(
+                    f"{k} = {v:.3f}" if isinstance(v, float) else f"{k} = {v}"
+                    for k, v in summary.items()
+                )
+            )
+            assert summary["n_done"] > 0
+
+
+if __name__ == "__main__":
+    from javlibrary_crawler.tests import run_cov_test
+
+    run_cov_test(__file__, "javlibrary_crawler.sites.missav.crawler", preview=False)